@@ -0,0 +1,365 @@
+"""
+A simplified street graph of a StreetMap in which chains of degree-2 nodes are
+collapsed into single super-edges.
+
+Map data splits curved streets into many short segments, so most nodes of a map are
+the interior of a chain: they have exactly two segments, to two different neighbors.
+Every other node is a core node. A super-edge runs from a core node along a chain to
+the next core node; it keeps its total length and the edges of the map it stands for,
+so a route over super-edges expands back into exactly the StreetSegments of the map.
+Chains that form a loop without any core node get one of their nodes as a core node.
+
+Every chain is walked from both ends, so every super-edge exists in both directions.
+Queries run Dijkstra over the core nodes only. A query that starts or ends inside a
+chain enters the core graph at both ends of its chain, and a query whose two ends lie
+on the same chain also considers the direct way along it.
+
+When segment lengths change (StreetMap.reweightSegments) the chains stay the same, so
+only the lengths of the super-edges holding the changed edges are summed again. Closed
+segments have infinite lengths, and pieces of a chain past one are summed member by
+member instead of taken as a difference of lengths.
+When segments are added (StreetMap.addSegments) only the chains through the nodes of
+the new segments are walked again; the other super-edges are kept with their edges
+renumbered.
+"""
+from array import array
+from bisect import bisect_right
+from heapq import *
+from itertools import accumulate
+
+INFINITY = float('inf')
+INTERIOR = -1   # the core index of a chain interior
+
+class ChainGraph:
+
+    # @param streetmap The StreetMap (with loaded map data) the graph is built for.
+    def __init__(self, streetmap):
+        self.__map = streetmap
+        self.__coreIds      = array('i')    # core index by node id, INTERIOR for chain interiors
+        self.__superOffsets = array('I', [0])   # the super-edges of core c are superOffsets[c] .. [c+1]-1
+        self.__superTargets = array('I')    # core index a super-edge ends at
+        self.__superWeights = array('d')    # total length of a super-edge
+        self.__superStarts  = array('I')    # node id a super-edge starts at
+        self.__superReverse = array('I')    # the super-edge along the same chain the other way
+        self.__memberOffsets = array('I', [0])  # super-edge s stands for members[memberOffsets[s] ..]
+        self.__members      = array('I')    # map edge ids, in order along the super-edges
+        self.__prefixes     = array('d')    # length of each super-edge up to and including a member
+        self.__memberIndex  = array('I')    # position in members of every map edge
+        self.__chainOf      = {}            # chain interior node -> (super-edge, member it ends)
+        self.__settled      = 0
+
+    # returns whether the graph has been built for the current map data
+    def isBuilt(self):
+        return len(self.__coreIds) == self.__map.nodeCount() and len(self.__superOffsets) > 1
+
+    # returns the number of core nodes (the nodes searches settle)
+    def coreNodeCount(self):
+        return len(self.__superOffsets) - 1
+
+    # returns the number of directed super-edges
+    def superEdgeCount(self):
+        return len(self.__superTargets)
+
+    # returns the number of core nodes settled by the last query
+    def settledNodeCount(self):
+        return self.__settled
+
+    # Collapses the chains of the map into super-edges.
+    # @return The number of nodes collapsed into chains.
+    def build(self):
+        nodeCount = self.__map.nodeCount()
+        offsets, targets, _ = self.__map.adjacency()
+
+        interior = bytearray(self.__isInterior(u, offsets, targets) for u in range(nodeCount))
+        coreNodes = [u for u in range(nodeCount) if not interior[u]]
+
+        # walk every chain from the core nodes; loops of interiors get a core node each
+        superEdges = []     # (core node, end node, [member edges]) per super-edge
+        walked = bytearray(nodeCount)
+        for u in coreNodes:
+            self.__walk(u, range(offsets[u], offsets[u+1]), interior, walked, superEdges)
+        for u in range(nodeCount):
+            if interior[u] and not walked[u]:
+                interior[u] = 0
+                coreNodes.append(u)
+                self.__walk(u, range(offsets[u], offsets[u+1]), interior, walked, superEdges)
+        coreNodes.sort()
+        self.__store(coreNodes, superEdges)
+        return nodeCount - len(coreNodes)
+
+    # Takes in the segments StreetMap.addSegments put on the map. The super-edges that
+    # do not reach a node of the new segments are kept (renumbered); only the chains
+    # through those nodes are walked again.
+    # @param nodeIds The new id of every node, by its id before the change.
+    # @param edgeIds The new id of every edge, by its id before the change.
+    # @param edges The (node id, edge id) pairs of the added segments, in both directions.
+    def addSegments(self, nodeIds, edgeIds, edges):
+        nodeCount = self.__map.nodeCount()
+        offsets, targets, _ = self.__map.adjacency()
+        oldIds = {new: old for old, new in enumerate(nodeIds)}
+        touched = set(u for u, _ in edges)
+        oldCores = [0] * self.coreNodeCount()
+        for u, core in enumerate(self.__coreIds):
+            if core != INTERIOR:
+                oldCores[core] = u
+
+        # the super-edges reaching a touched node, in both directions
+        dirty = set()
+        for u in touched:
+            old = oldIds.get(u)
+            if old is None:
+                continue
+            if self.__coreIds[old] == INTERIOR:
+                dirty.add(self.__chainOf[old][0])
+            else:
+                dirty.update(range(self.__superOffsets[self.__coreIds[old]],
+                                   self.__superOffsets[self.__coreIds[old]+1]))
+        dirty.update([self.__superReverse[s] for s in dirty])
+
+        # the cores stay, except touched nodes that became chain interiors and the cores
+        # given to loops that are walked again (a loop that is still one gets one again)
+        interior = bytearray(b'\x01') * nodeCount
+        for u in oldCores:
+            interior[nodeIds[u]] = 0
+        superEdges = []
+        starts = []         # (core node, first edge) of the super-edges walked again
+        candidates = set()  # the nodes of those that may be left in a loop
+        for s in range(self.superEdgeCount()):
+            start = nodeIds[self.__superStarts[s]]
+            members = [edgeIds[self.__members[i]]
+                       for i in range(self.__memberOffsets[s], self.__memberOffsets[s+1])]
+            if s not in dirty:
+                superEdges.append((start, targets[members[-1]], members))
+                continue
+            candidates.update(targets[edge] for edge in members)
+            if start not in touched and not self.__isInterior(start, offsets, targets):
+                starts.append((start, members[0]))
+            elif start not in touched:
+                candidates.add(start)
+        for u in touched | candidates:
+            interior[u] = self.__isInterior(u, offsets, targets)
+        for u in touched:
+            if not interior[u]:
+                starts.extend((u, edge) for edge in range(offsets[u], offsets[u+1]))
+
+        walked = bytearray(nodeCount)
+        for u, edge in starts:
+            self.__walk(u, (edge,), interior, walked, superEdges)
+        for u in sorted(candidates | touched):
+            if interior[u] and not walked[u]:
+                interior[u] = 0
+                self.__walk(u, range(offsets[u], offsets[u+1]), interior, walked, superEdges)
+        self.__store([u for u in range(nodeCount) if not interior[u]], superEdges)
+
+    # Sums the lengths of the super-edges holding edges whose lengths changed on the map.
+    # @param edges The ids of the changed edges of the map.
+    def updateWeights(self, edges):
+        _, _, weights = self.__map.adjacency()
+        for s in set(bisect_right(self.__memberOffsets, self.__memberIndex[edge]) - 1 for edge in edges):
+            length = 0.0
+            for i in range(self.__memberOffsets[s], self.__memberOffsets[s+1]):
+                length += weights[self.__members[i]]
+                self.__prefixes[i] = length
+            self.__superWeights[s] = length
+
+    # Finds a shortest route between two nodes of the map.
+    # @param source The node id of the start.
+    # @param target The node id of the end.
+    # @return A list of (node id, edge id) pairs of the map from source to target, or
+    #   None if there is no route.
+    def query(self, source, target):
+        coreIds, superOffsets, superTargets, superWeights = \
+            self.__coreIds, self.__superOffsets, self.__superTargets, self.__superWeights
+        self.__settled = 0
+        if source == target:
+            return []
+
+        # the ways into the core graph from source: (distance, core, super-edge, first member)
+        best, bestPath = INFINITY, None
+        if coreIds[source] != INTERIOR:
+            seeds = [(0.0, coreIds[source], None, 0)]
+        else:
+            seeds = []
+            for s, k in self.__positions(source):
+                last = self.__memberOffsets[s+1] - self.__memberOffsets[s] - 1
+                seeds.append((self.__between(s, k, last), superTargets[s], s, k + 1))
+                # both ends on one chain: straight along it
+                for t, j in self.__positions(target) if coreIds[target] == INTERIOR else ():
+                    if t == s and j > k:
+                        distance = self.__between(s, k, j)
+                        if distance < best:
+                            best, bestPath = distance, [(s, k + 1, j + 1)]
+
+        # the ways out of the core graph to target: core -> [(distance, super-edge, members)]
+        exits = {}
+        if coreIds[target] != INTERIOR:
+            exits[coreIds[target]] = [(0.0, None, 0)]
+        else:
+            for s, k in self.__positions(target):
+                core = coreIds[self.__superStarts[s]]
+                exits.setdefault(core, []).append((self.__prefix(s, k), s, k + 1))
+
+        dist = {}
+        prev = {}   # core -> (previous core, super-edge) or (None, seed)
+        pq = []
+        for seed in seeds:
+            distance, core = seed[0], seed[1]
+            if distance < dist.get(core, INFINITY):
+                dist[core] = distance
+                prev[core] = (None, seed)
+                heappush(pq, (distance, core))
+        while len(pq) > 0:
+            distance, u = heappop(pq)
+            if distance >= best:
+                break
+            if distance > dist[u]:
+                continue
+            self.__settled += 1
+            for exitDistance, s, count in exits.get(u, ()):
+                if distance + exitDistance < best:
+                    best = distance + exitDistance
+                    bestPath = self.__corePath(prev, u) + ([(s, 0, count)] if s is not None else [])
+
+            for s in range(superOffsets[u], superOffsets[u+1]):
+                v = superTargets[s]
+                tentative_dist = distance + superWeights[s]
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    prev[v] = (u, s)
+                    heappush(pq, (tentative_dist, v))
+
+        if bestPath is None:
+            return None
+        return self.__expand(bestPath)
+
+    # A private function that tells whether a node is a chain interior: two segments,
+    # to two different nodes other than itself.
+    @staticmethod
+    def __isInterior(u, offsets, targets):
+        first = offsets[u]
+        if offsets[u+1] - first != 2:
+            return False
+        v, w = targets[first], targets[first+1]
+        return v != w and v != u and w != u
+
+    # A private function that walks chains from a core node to the next core nodes.
+    # @param edges The edges of u to walk along.
+    # @param interior The chain interior flags by node id (0 for every core node).
+    # @param walked The flags of the interiors walked over, set along the way.
+    # @param superEdges The list the (core node, end node, [member edges]) are appended to.
+    def __walk(self, u, edges, interior, walked, superEdges):
+        offsets, targets, _ = self.__map.adjacency()
+        for edge in edges:
+            members = [edge]
+            previous, v = u, targets[edge]
+            while interior[v]:
+                walked[v] = 1
+                first = offsets[v]
+                edge = first if targets[first] != previous else first + 1
+                members.append(edge)
+                previous, v = v, targets[edge]
+            superEdges.append((u, v, members))
+
+    # A private function that lays out super-edges in the arrays of the graph.
+    # @param coreNodes The core node ids, sorted.
+    # @param superEdges A list of (core node, end node, [member edges]) per super-edge.
+    def __store(self, coreNodes, superEdges):
+        _, targets, weights = self.__map.adjacency()
+        coreIds = array('i', [INTERIOR]) * self.__map.nodeCount()
+        for c, u in enumerate(coreNodes):
+            coreIds[u] = c
+        # super-edges grouped by core
+        superEdges.sort(key = lambda superEdge: coreIds[superEdge[0]])
+
+        self.__superOffsets = array('I', [0])
+        self.__superTargets = array('I')
+        self.__superWeights = array('d')
+        self.__superStarts  = array('I')
+        self.__memberOffsets = array('I', [0])
+        self.__members      = array('I')
+        self.__prefixes     = array('d')
+        self.__chainOf      = {}
+        firstMembers = {}
+        core = 0
+        for s, (u, v, members) in enumerate(superEdges):
+            while coreIds[u] > core:
+                self.__superOffsets.append(s)
+                core += 1
+            firstMembers[members[0]] = s
+            for k in range(len(members) - 1):
+                self.__chainOf.setdefault(targets[members[k]], (s, k))
+            self.__members.extend(members)
+            self.__prefixes.extend(accumulate(map(weights.__getitem__, members)))
+            self.__memberOffsets.append(len(self.__members))
+            self.__superTargets.append(coreIds[v])
+            self.__superWeights.append(self.__prefixes[-1])
+            self.__superStarts.append(u)
+        while core < len(coreNodes):
+            self.__superOffsets.append(len(superEdges))
+            core += 1
+
+        self.__memberIndex = array('I', [0]) * len(self.__members)
+        for i, edge in enumerate(self.__members):
+            self.__memberIndex[edge] = i
+
+        # the reverse of a super-edge starts with the reverse of its last member
+        self.__superReverse = array('I', [0]) * len(superEdges)
+        for s, (_, _, members) in enumerate(superEdges):
+            last = members[-1]
+            lastStart = superEdges[s][0] if len(members) == 1 else targets[members[-2]]
+            self.__superReverse[s] = firstMembers[self.__map.reverseEdge(lastStart, last)]
+        self.__coreIds = coreIds
+
+    # A private function that finds where a chain interior lies on the super-edges.
+    # @return Both (super-edge, k) pairs, one per direction, such that the node is the
+    #   end of member k of the super-edge.
+    def __positions(self, node):
+        s, k = self.__chainOf[node]
+        reverse = self.__superReverse[s]
+        length = self.__memberOffsets[s+1] - self.__memberOffsets[s]
+        return [(s, k), (reverse, length - k - 2)]
+
+    # A private function that returns the length of a super-edge up to the end of member k.
+    def __prefix(self, s, k):
+        return self.__prefixes[self.__memberOffsets[s] + k]
+
+    # A private function that returns the length of a super-edge from the end of member k
+    # to the end of member j.
+    def __between(self, s, k, j):
+        distance = self.__prefix(s, j) - self.__prefix(s, k)
+        if distance != distance:    # both infinite: a closed member at or before k
+            _, _, weights = self.__map.adjacency()
+            base = self.__memberOffsets[s]
+            distance = 0.0
+            for i in range(base + k + 1, base + j + 1):
+                distance += weights[self.__members[i]]
+        return distance
+
+    # A private function that lists the pieces of super-edges from the seed to a core.
+    # @return A list of (super-edge, first member, end member) pieces, in route order.
+    def __corePath(self, prev, core):
+        pieces = []
+        while True:
+            u, step = prev[core]
+            if u is None:
+                _, _, s, first = step
+                if s is not None:
+                    pieces.append((s, first, self.__memberOffsets[s+1] - self.__memberOffsets[s]))
+                break
+            pieces.append((step, 0, self.__memberOffsets[step+1] - self.__memberOffsets[step]))
+            core = u
+        pieces.reverse()
+        return pieces
+
+    # A private function that expands pieces of super-edges into the edges of the map.
+    def __expand(self, pieces):
+        _, targets, _ = self.__map.adjacency()
+        edges = []
+        for s, first, end in pieces:
+            base = self.__memberOffsets[s]
+            node = self.__superStarts[s] if first == 0 else targets[self.__members[base + first - 1]]
+            for i in range(base + first, base + end):
+                edge = self.__members[i]
+                edges.append((node, edge))
+                node = targets[edge]
+        return edges
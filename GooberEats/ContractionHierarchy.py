@@ -0,0 +1,529 @@
+"""
+Contraction Hierarchies for the street graph of a StreetMap.
+
+Preprocessing contracts the nodes one at a time, least important first (importance is
+the edge difference: shortcuts a contraction would add minus the edges it removes,
+plus the number of already contracted neighbors to spread contractions evenly).
+Contracting v removes it from the remaining graph and, for every pair of its
+neighbors u, w whose shortest connection ran through v, adds a shortcut u - w that
+remembers v as its middle node. A bounded "witness" Dijkstra from u that avoids v
+decides whether such a shortcut is needed.
+
+The result is the contraction order (rank) and, for every node, its "upward" edges to
+the neighbors it still had when it was contracted, all of which rank higher. Any
+shortest route then climbs in rank to a top node and descends again, so a query only
+runs two small Dijkstra searches over upward edges, one from each end. Shortcuts are
+unpacked recursively through their middle nodes back into the edges of the map.
+
+Street segments are stored in both directions with the same length, so the hierarchy
+treats the map as undirected. It can be saved to disk and loaded again for the same map;
+the file keeps a checksum of the map's edges and lengths, so a file saved before the map
+changed is refused. Changing segment lengths can make shortcuts a route needs missing,
+so a hierarchy is only current for the map version it was built or loaded at (see
+isCurrent) until update brings it up to date.
+
+Lengths changing keeps the node order. Contracting a node depends only on its edges and
+shortcuts when it is contracted and on the nodes its witness searches settled, so the
+hierarchy records those, and update contracts again, in rank order, only the ends of
+changed edges and the nodes whose witness searches settled them, following on to the
+nodes that the shortcuts those contractions add or drop affect in turn.
+"""
+import struct
+import zlib
+from array import array
+from bisect import insort
+from heapq import *
+from itertools import chain
+
+from StreetMap import MapChange
+
+MAGIC                = b'GOOBCH02'
+HEADER               = struct.Struct('=8sIIIII')
+INFINITY             = float('inf')
+WITNESS_SETTLE_LIMIT = 64
+NO_MIDDLE            = -1
+RECONTRACT_DIVISOR   = 4     # update contracts everything again past nodes / this
+
+class ContractionHierarchy:
+
+    # @param streetmap The StreetMap (with loaded map data) the hierarchy is built for.
+    def __init__(self, streetmap):
+        self.__map        = streetmap
+        self.__rank       = array('I')
+        self.__upOffsets  = array('I', [0])
+        self.__upTargets  = array('I')
+        self.__upWeights  = array('d')
+        self.__upMiddles  = array('i')
+        self.__settled    = 0
+        self.__mapVersion = None
+
+        # what update needs to contract nodes again (None for a loaded hierarchy), per node:
+        self.__original    = None    # neighbor -> length of the shortest edge of the map
+        self.__added       = None    # neighbor -> [(rank, middle, length)] shortcuts by rank
+        self.__contributed = None    # (lower id, higher id) -> length of the shortcuts it added
+        self.__witnessed   = None    # the nodes its witness searches settled
+        self.__witnessedBy = None    # the nodes whose witness searches settled it (or did once)
+
+    # returns whether the hierarchy has been built or loaded
+    def isPreprocessed(self):
+        return len(self.__rank) == self.__map.nodeCount() and len(self.__upOffsets) > 1
+
+    # returns whether the hierarchy is preprocessed for the current version of the map
+    def isCurrent(self):
+        return self.isPreprocessed() and self.__mapVersion == self.__map.version()
+
+    # returns the number of upward edges (original edges and shortcuts) of the hierarchy
+    def upwardEdgeCount(self):
+        return len(self.__upTargets)
+
+    # returns the number of nodes settled by the last query
+    def settledNodeCount(self):
+        return self.__settled
+
+    # Contracts every node of the map, computing the node ranks and upward edges.
+    # @return The number of shortcuts added.
+    def preprocess(self):
+        self.__mapVersion = self.__map.version()
+        return self.__contract(None)
+
+    # Brings the hierarchy up to date with the segment lengths changed since it was
+    # preprocessed, keeping its node order and contracting again only the nodes whose
+    # contraction may come out differently.
+    # @return True if the hierarchy is current, False if it must be preprocessed again
+    #   (the map got new data or added segments, or was never preprocessed).
+    def update(self):
+        if not self.isPreprocessed():
+            return False
+        changes = self.__map.changesSince(self.__mapVersion)
+        if changes is None or any(kind != MapChange.REWEIGHT for _, kind, _ in changes):
+            return False
+        if len(changes) == 0:
+            return True
+        version = changes[-1][0]
+        if self.__original is None:     # loaded from a file: nothing recorded to follow
+            self.__contract(self.__rank)
+            self.__mapVersion = version
+            return True
+
+        offsets, targets, weights = self.__map.adjacency()
+        dirty = set()
+        for _, _, details in changes:
+            for a, edge, _, _ in details:
+                b = targets[edge]
+                if a == b:
+                    continue
+                shortest = INFINITY
+                for u, v in ((a, b), (b, a)):
+                    for other in range(offsets[u], offsets[u+1]):
+                        if targets[other] == v and weights[other] < shortest:
+                            shortest = weights[other]
+                for u, v in ((a, b), (b, a)):
+                    if shortest < INFINITY:
+                        self.__original[u][v] = shortest
+                    else:
+                        self.__original[u].pop(v, None)
+                dirty.update((a, b), self.__witnessedBy[a], self.__witnessedBy[b])
+
+        contracted = self.__recontract(dirty)
+        if contracted is None:
+            self.__contract(self.__rank)
+        else:
+            self.__relistUpward(contracted)
+        self.__mapVersion = version
+        return True
+
+    # Writes the hierarchy to a file.
+    # @param hierarchyFile The binary file to be written.
+    def save(self, hierarchyFile):
+        with open(hierarchyFile, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, self.__map.nodeCount(), self.__mapEdgeCount(),
+                len(self.__rank), len(self.__upTargets), self.__mapChecksum()))
+            for section in (self.__rank, self.__upOffsets, self.__upTargets,
+                    self.__upWeights, self.__upMiddles):
+                output.write(section)
+
+    # Reads a hierarchy written by save.
+    # @param streetmap The StreetMap the hierarchy was built for.
+    # @param hierarchyFile The binary file to be read.
+    # @return A new ContractionHierarchy.
+    # @raises ValueError if the file is not a hierarchy of this map as it is now.
+    @classmethod
+    def load(cls, streetmap, hierarchyFile):
+        hierarchy = cls(streetmap)
+        with open(hierarchyFile, 'rb') as data:
+            magic, nodeCount, edgeCount, rankCount, upEdgeCount, checksum = \
+                HEADER.unpack(data.read(HEADER.size))
+            if magic != MAGIC or nodeCount != streetmap.nodeCount() or \
+                    edgeCount != hierarchy.__mapEdgeCount() or rankCount != nodeCount or \
+                    checksum != hierarchy.__mapChecksum():
+                raise ValueError(hierarchyFile + ' is not a contraction hierarchy of this map')
+            hierarchy.__rank.fromfile(data, nodeCount)
+            hierarchy.__upOffsets = array('I')
+            hierarchy.__upOffsets.fromfile(data, nodeCount + 1)
+            hierarchy.__upTargets.fromfile(data, upEdgeCount)
+            hierarchy.__upWeights.fromfile(data, upEdgeCount)
+            hierarchy.__upMiddles.fromfile(data, upEdgeCount)
+        hierarchy.__mapVersion = streetmap.version()
+        return hierarchy
+
+    # Finds a shortest route with two upward searches.
+    # @param source The node id of the start.
+    # @param target The node id of the end.
+    # @return A list of (node id, edge id) pairs, the edges of the map from source to
+    #   target in order, or None if there is no route.
+    def query(self, source, target):
+        self.__settled = 0
+        if source == target:
+            return []
+        upOffsets = self.__upOffsets
+        upTargets = self.__upTargets
+        upWeights = self.__upWeights
+
+        distF = {source: 0}
+        distB = {target: 0}
+        prevF = {source: None}
+        prevB = {target: None}
+        pqF = [(0, source)]
+        pqB = [(0, target)]
+        best = INFINITY
+        meeting = None
+
+        # each side runs until its queue minimum can no longer improve the best meeting
+        while (len(pqF) > 0 and pqF[0][0] < best) or (len(pqB) > 0 and pqB[0][0] < best):
+            if len(pqB) == 0 or pqB[0][0] >= best or \
+                    (len(pqF) > 0 and pqF[0][0] < best and pqF[0][0] <= pqB[0][0]):
+                pq, dist, prev, otherDist = pqF, distF, prevF, distB
+            else:
+                pq, dist, prev, otherDist = pqB, distB, prevB, distF
+
+            distance, u = heappop(pq)
+            if distance > dist[u]:
+                continue
+            self.__settled += 1
+            other = otherDist.get(u)
+            if other is not None and distance + other < best:
+                best = distance + other
+                meeting = u
+
+            for edge in range(upOffsets[u], upOffsets[u+1]):
+                v = upTargets[edge]
+                tentative_dist = distance + upWeights[edge]
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    prev[v] = u
+                    heappush(pq, (tentative_dist, v))
+
+        if meeting is None:
+            return None
+
+        # nodes of the hierarchy route: up from the source, then down to the target
+        path = []
+        node = meeting
+        while node is not None:
+            path.append(node)
+            node = prevF[node]
+        path.reverse()
+        node = prevB[meeting]
+        while node is not None:
+            path.append(node)
+            node = prevB[node]
+
+        edges = []
+        for i in range(len(path) - 1):
+            self.__unpack(path[i], path[i+1], edges)
+        return edges
+
+    # A private function that unpacks an edge of the hierarchy into edges of the map.
+    # @param a The node the edge is walked from.
+    # @param b The node the edge is walked to.
+    # @param edges The list the (node id, edge id) pairs of the map are appended to.
+    def __unpack(self, a, b, edges):
+        stack = [(a, b)]
+        while len(stack) > 0:
+            a, b = stack.pop()
+            middle = self.__middle(a, b)
+            if middle == NO_MIDDLE:
+                edges.append((a, self.__shortestEdge(a, b)))
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+    # A private function that gets the middle node of the hierarchy edge between a and b
+    # (NO_MIDDLE for an edge of the map), stored with the lower ranked of the two.
+    def __middle(self, a, b):
+        low, high = (a, b) if self.__rank[a] < self.__rank[b] else (b, a)
+        for edge in range(self.__upOffsets[low], self.__upOffsets[low+1]):
+            if self.__upTargets[edge] == high:
+                return self.__upMiddles[edge]
+        raise ValueError('no hierarchy edge between nodes {0} and {1}'.format(a, b))
+
+    # A private function that finds the shortest edge of the map from a to b.
+    def __shortestEdge(self, a, b):
+        offsets, targets, weights = self.__map.adjacency()
+        shortest = None
+        for edge in range(offsets[a], offsets[a+1]):
+            if targets[edge] == b and (shortest is None or weights[edge] < weights[shortest]):
+                shortest = edge
+        return shortest
+
+    # A private function that contracts every node of the map, least important first
+    # or in a given order, and records what update needs to contract them again.
+    # @param rank The rank of every node, or None to order the nodes by importance.
+    # @return The number of shortcuts added.
+    def __contract(self, rank):
+        nodeCount = self.__map.nodeCount()
+        offsets, targets, weights = self.__map.adjacency()
+
+        # the remaining graph: neighbor -> length of the shortest edge or shortcut
+        graph = [{} for _ in range(nodeCount)]
+        for u in range(nodeCount):
+            neighbors = graph[u]
+            for edge in range(offsets[u], offsets[u+1]):
+                v = targets[edge]
+                if v != u and weights[edge] < neighbors.get(v, INFINITY):
+                    neighbors[v] = graph[v][u] = weights[edge]
+        middles = {}    # (lower id, higher id) -> middle node of the shortcut between them
+
+        self.__original    = [dict(neighbors) for neighbors in graph]
+        self.__added       = [{} for _ in range(nodeCount)]
+        self.__contributed = [None] * nodeCount
+        self.__witnessed   = [None] * nodeCount
+        self.__witnessedBy = [array('I') for _ in range(nodeCount)]
+
+        contractedNeighbors = [0] * nodeCount
+        ordered = rank is not None
+        if ordered:
+            pq = [(rank[v], v) for v in range(nodeCount)]
+        else:
+            pq = [(self.__priority(v, graph, contractedNeighbors), v) for v in range(nodeCount)]
+        heapify(pq)
+
+        rank      = [0] * nodeCount
+        upward    = [None] * nodeCount
+        nextRank  = 0
+        shortcutCount = 0
+        while len(pq) > 0:
+            _, v = heappop(pq)
+            # lazy update: contract v only if it is still the least important node
+            if not ordered:
+                priority = self.__priority(v, graph, contractedNeighbors)
+                if len(pq) > 0 and priority > pq[0][0]:
+                    heappush(pq, (priority, v))
+                    continue
+
+            settled = []
+            shortcuts = self.__shortcuts(v, graph, settled)
+            rank[v] = nextRank
+            upward[v] = [(w, weight, middles.get(pairKey(v, w), NO_MIDDLE))
+                         for w, weight in graph[v].items()]
+            for u in graph[v]:
+                del graph[u][v]
+                contractedNeighbors[u] += 1
+            graph[v] = None
+
+            self.__contributed[v] = {}
+            for u, w, weight in shortcuts:
+                self.__contributed[v][pairKey(u, w)] = weight
+                self.__added[u].setdefault(w, []).append((nextRank, v, weight))
+                self.__added[w][u] = self.__added[u][w]
+                if weight < graph[u].get(w, INFINITY):
+                    graph[u][w] = graph[w][u] = weight
+                    middles[pairKey(u, w)] = v
+                    shortcutCount += 1
+            self.__witnessed[v] = array('I', sorted(set(settled)))
+            for a in self.__witnessed[v]:
+                self.__witnessedBy[a].append(v)
+            nextRank += 1
+
+        self.__rank = array('I', rank)
+        self.__upOffsets = array('I', [0])
+        self.__upTargets = array('I')
+        self.__upWeights = array('d')
+        self.__upMiddles = array('i')
+        for v in range(nodeCount):
+            for w, weight, middle in upward[v]:
+                self.__upTargets.append(w)
+                self.__upWeights.append(weight)
+                self.__upMiddles.append(middle)
+            self.__upOffsets.append(len(self.__upTargets))
+        return shortcutCount
+
+    # A private function that contracts nodes again, in rank order, with the lengths the
+    # map has now. When a contraction adds, drops or changes a shortcut, the ends of the
+    # shortcut and the later nodes whose witness searches settled them follow.
+    # @param dirty The nodes to contract again first.
+    # @return The list of nodes contracted again, or None if more than the nodes over
+    #   RECONTRACT_DIVISOR would be (contracting all of them again is cheaper).
+    def __recontract(self, dirty):
+        rank = self.__rank
+        limit = len(rank) // RECONTRACT_DIVISOR
+        queued = set(dirty)
+        pq = [(rank[v], v) for v in queued]
+        heapify(pq)
+        contracted = []
+        while len(pq) > 0:
+            if len(contracted) == limit:
+                return None
+            r, v = heappop(pq)
+            contracted.append(v)
+            settled = []
+            shortcuts = self.__shortcuts(v, RemainingGraph(self.__neighborsAt, r), settled)
+
+            old = self.__contributed[v]
+            new = self.__contributed[v] = {pairKey(u, w): weight for u, w, weight in shortcuts}
+            for key in old.keys() | new.keys():
+                if old.get(key) == new.get(key):
+                    continue
+                u, w = key
+                contributions = self.__added[u].setdefault(w, [])
+                self.__added[w][u] = contributions
+                if key in old:
+                    contributions.remove((r, v, old[key]))
+                if key in new:
+                    insort(contributions, (r, v, new[key]))
+                if len(contributions) == 0:
+                    del self.__added[u][w], self.__added[w][u]
+                for x in chain(key, self.__witnessedBy[u], self.__witnessedBy[w]):
+                    if rank[x] > r and x not in queued:
+                        queued.add(x)
+                        heappush(pq, (rank[x], x))
+
+            known = set(self.__witnessed[v])
+            self.__witnessed[v] = array('I', sorted(set(settled)))
+            for a in self.__witnessed[v]:
+                if a not in known:
+                    self.__witnessedBy[a].append(v)
+        return contracted
+
+    # A private function that lists the neighbors a node has in the remaining graph when
+    # the node of rank r is contracted: those ranked higher than r, each with the length
+    # of the shortest edge or shortcut to it added before then.
+    # @param middles A dict that gets the middle node of every shortcut listed, if given.
+    # @return A dict of neighbor -> length.
+    def __neighborsAt(self, a, r, middles = None):
+        rank = self.__rank
+        neighbors = {b: weight for b, weight in self.__original[a].items() if rank[b] > r}
+        for b, contributions in self.__added[a].items():
+            if rank[b] > r:
+                shortest = neighbors.get(b, INFINITY)
+                for contributionRank, middle, weight in contributions:
+                    if contributionRank >= r:
+                        break
+                    if weight < shortest:
+                        shortest = neighbors[b] = weight
+                        if middles is not None:
+                            middles[b] = middle
+        return neighbors
+
+    # A private function that lists the upward edges of the given nodes again and copies
+    # those of the other nodes.
+    def __relistUpward(self, nodes):
+        upOffsets = array('I', [0])
+        upTargets = array('I')
+        upWeights = array('d')
+        upMiddles = array('i')
+        start = 0   # the first node whose upward edges are not copied yet
+        for v in sorted(nodes) + [len(self.__rank)]:
+            begin, end = self.__upOffsets[start], self.__upOffsets[v]
+            shift = len(upTargets) - begin
+            upOffsets.extend(offset + shift for offset in self.__upOffsets[start+1:v+1])
+            upTargets.extend(self.__upTargets[begin:end])
+            upWeights.extend(self.__upWeights[begin:end])
+            upMiddles.extend(self.__upMiddles[begin:end])
+            if v == len(self.__rank):
+                break
+            middles = {}
+            for w, weight in self.__neighborsAt(v, self.__rank[v], middles).items():
+                upTargets.append(w)
+                upWeights.append(weight)
+                upMiddles.append(middles.get(w, NO_MIDDLE))
+            upOffsets.append(len(upTargets))
+            start = v + 1
+        self.__upOffsets = upOffsets
+        self.__upTargets = upTargets
+        self.__upWeights = upWeights
+        self.__upMiddles = upMiddles
+
+    # A private function that computes the shortcuts needed to contract a node.
+    # @param settled A list the nodes settled by the witness searches are appended to,
+    #   if given.
+    # @return A list of (u, w, length) shortcuts between neighbors of v.
+    def __shortcuts(self, v, graph, settled = None):
+        neighbors = list(graph[v].items())
+        shortcuts = []
+        for i, (u, toU) in enumerate(neighbors[:-1]):
+            rest = neighbors[i+1:]
+            maxDistance = toU + max(toW for _, toW in rest)
+            witness = self.__witnessSearch(u, v, maxDistance, graph, settled)
+            for w, toW in rest:
+                if witness.get(w, INFINITY) > toU + toW:
+                    shortcuts.append((u, w, toU + toW))
+        return shortcuts
+
+    # A private function that runs a bounded Dijkstra in the remaining graph.
+    # @param source The node to search from.
+    # @param excluded The node being contracted (the search may not pass through it).
+    # @param maxDistance Distances beyond this are not needed.
+    # @param settledNodes A list the settled nodes are appended to, if given.
+    # @return A mapping of node id to the length of some path from source (an upper bound).
+    def __witnessSearch(self, source, excluded, maxDistance, graph, settledNodes = None):
+        dist = {source: 0}
+        pq = [(0, source)]
+        settled = 0
+        while len(pq) > 0:
+            distance, u = heappop(pq)
+            if distance > dist[u]:
+                continue
+            if distance > maxDistance or settled == WITNESS_SETTLE_LIMIT:
+                break
+            settled += 1
+            if settledNodes is not None:
+                settledNodes.append(u)
+            for v, weight in graph[u].items():
+                if v == excluded:
+                    continue
+                tentative_dist = distance + weight
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    heappush(pq, (tentative_dist, v))
+        return dist
+
+    # A private function that computes how important it is to keep a node for later.
+    def __priority(self, v, graph, contractedNeighbors):
+        return len(self.__shortcuts(v, graph)) - len(graph[v]) + contractedNeighbors[v]
+
+    # A private function that counts the directed edges of the map.
+    def __mapEdgeCount(self):
+        _, targets, _ = self.__map.adjacency()
+        return len(targets)
+
+    # A private function that computes a CRC-32 of the edge targets and lengths of the map.
+    def __mapChecksum(self):
+        _, targets, weights = self.__map.adjacency()
+        checksum = 0
+        for values, typecode in ((targets, 'I'), (weights, 'd')):
+            try:
+                data = memoryview(values).cast('B')
+            except TypeError:   # the arrays of a tiled map are not buffers
+                data = array(typecode, values)
+            checksum = zlib.crc32(data, checksum)
+        return checksum
+
+# The remaining graph of a hierarchy when the node of rank r is contracted, as the list
+# of neighbor dicts the contraction uses, built for each node a witness search reaches.
+class RemainingGraph(dict):
+
+    # @param neighborsAt The function listing the neighbors of a node at a rank.
+    # @param r The rank of the node being contracted.
+    def __init__(self, neighborsAt, r):
+        super().__init__()
+        self.__neighborsAt = neighborsAt
+        self.__r = r
+
+    def __missing__(self, u):
+        neighbors = self[u] = self.__neighborsAt(u, self.__r)
+        return neighbors
+
+# returns the key of an unordered pair of node ids
+def pairKey(u, w):
+    return (u, w) if u < w else (w, u)
@@ -1,22 +1,50 @@
 from PointToPointRouter import *
+import multiprocessing
 import random
+import time
 
 TEMPERATURE = 100000
 COOLINGRATE = 0.003
 
+# Time-budgeted annealing: the starting temperature accepts an average uphill move with
+# this probability, the schedule ends at FINAL_TEMPERATURE_RATIO times that temperature,
+# and the clock is read every CHECK_INTERVAL iterations.
+INITIAL_ACCEPTANCE      = 0.5
+FINAL_TEMPERATURE_RATIO = 1e-4
+CALIBRATION_SAMPLES     = 100
+CONVERGED_ITERATIONS    = 2000
+CHECK_INTERVAL          = 128
+
+# Orders of up to EXACT_STOPS deliveries are solved exactly (Held-Karp takes about 30 ms
+# at 12 stops and doubles with every stop). Annealing from a constructed tour starts at
+# REFINE_TEMPERATURE times its mean leg length: most random moves on a good tour are far
+# uphill, so a temperature calibrated to them would melt it back into a random order.
+EXACT_STOPS        = 12
+REFINE_TEMPERATURE = 0.3
+
+# stands in for the distance between stops that have no route between them
+UNREACHABLE_DISTANCE = 1e6
+
+# What the optimizer minimizes: the crow distance between consecutive stops, or the
+# length of the shortest route between them on the street map.
+class DistanceMetric(Enum):
+    CROW = 0
+    ROAD = 1
+
+# How the optimizer orders the deliveries. AUTO solves orders of up to EXACT_STOPS
+# deliveries exactly and anneals larger ones from the shorter of a nearest-neighbor and
+# a farthest-insertion tour; ANNEAL anneals every order from random orders.
+class Solver(Enum):
+    AUTO   = 0
+    ANNEAL = 1
+
 # Calculates the crow distance of the delivery route.
 # @param depot The geospatial coordinate of the start & end location (i.e. the depot location)
 # @param deliveries A list containing all the delivery requests to be fulfilled.
 # @return The total crow distance (a double) through each point of delivery, in order.
 def deliveryRouteCrowDistance(depot, deliveries):
-    totalCrowDistance = 0.0
-    for i in range(len(deliveries)-1):
-        gc1 = deliveries[i].location
-        gc2 = deliveries[i+1].location
-        totalCrowDistance += distanceEarthMiles(gc1, gc2)
-    totalCrowDistance += distanceEarthMiles(depot, deliveries[0].location)
-    totalCrowDistance += distanceEarthMiles(deliveries[-1].location, depot)
-    return totalCrowDistance
+    stops = [depot] + [delivery.location for delivery in deliveries] + [depot]
+    return sum(distanceEarthMilesAlong([gc.latitude for gc in stops], [gc.longitude for gc in stops]))
 
 # Swaps the elements of a list
 # @param list The list to be modified.
@@ -36,63 +64,418 @@ def acceptanceProbability(currentDistance, newDistance, temperature):
         return 1.0
     return math.exp((currentDistance-newDistance)/temperature)
 
+# Builds the table of crow distances between the depot and the delivery locations.
+# @param depot The geospatial coordinate of the depot.
+# @param deliveries A list of delivery requests.
+# @return A list of rows, table[a][b] being the crow distance between stop a and stop b,
+#   where stop 0 is the depot and stop i is the location of deliveries[i-1].
+def crowDistanceTable(depot, deliveries):
+    locations = [depot] + [delivery.location for delivery in deliveries]
+    return distanceEarthMilesMatrix([gc.latitude for gc in locations], [gc.longitude for gc in locations])
+
+# Calculates the length of a tour.
+# @param table A distance table as returned by crowDistanceTable.
+# @param tour A list of stops that starts and ends with the depot (0).
+# @return The total distance of the tour.
+def tourCost(table, tour):
+    cost = 0.0
+    for i in range(len(tour)-1):
+        cost += table[tour[i]][tour[i+1]]
+    return cost
+
+# The moves below change a tour [0, s1, ..., sn, 0] at positions 1..n, and their delta
+# functions compute the change of tourCost in constant time from the few edges the move
+# replaces. The table must be symmetric (2-opt walks the reversed segment backwards).
+
+# Calculates the change in length of swapping the stops at positions i < j.
+def swapDelta(table, tour, i, j):
+    a, b = tour[i], tour[j]
+    before, after = tour[i-1], tour[j+1]
+    if j == i+1:
+        return table[before][b] + table[b][a] + table[a][after] \
+            - table[before][a] - table[a][b] - table[b][after]
+    return table[before][b] + table[b][tour[i+1]] + table[tour[j-1]][a] + table[a][after] \
+        - table[before][a] - table[a][tour[i+1]] - table[tour[j-1]][b] - table[b][after]
+
+# Calculates the change in length of reversing the stops at positions i..j (2-opt).
+def twoOptDelta(table, tour, i, j):
+    return table[tour[i-1]][tour[j]] + table[tour[i]][tour[j+1]] \
+        - table[tour[i-1]][tour[i]] - table[tour[j]][tour[j+1]]
+
+# Reverses the stops at positions i..j of a tour.
+def twoOpt(tour, i, j):
+    tour[i:j+1] = tour[j:i-1:-1]
+
+# Calculates the change in length of moving the stops at positions i..i+length-1 so
+# that, once they are taken out, they are inserted before position k (Or-opt).
+# @pre 1 <= k <= len(tour) - length - 1 and k != i.
+def orOptDelta(table, tour, i, length, k):
+    first, last = tour[i], tour[i+length-1]
+    before, after = tour[i-1], tour[i+length]
+    # the neighbors at position k of the tour without the segment
+    left  = tour[k-1] if k <= i else tour[k-1+length]
+    right = tour[k] if k < i else tour[k+length]
+    return table[before][after] - table[before][first] - table[last][after] \
+        + table[left][first] + table[last][right] - table[left][right]
+
+# Moves the stops at positions i..i+length-1 of a tour before position k of the rest.
+def orOpt(tour, i, length, k):
+    segment = tour[i:i+length]
+    del tour[i:i+length]
+    tour[k:k] = segment
+
+# Draws a random swap, 2-opt or Or-opt move for a tour of at least 2 stops.
+# @return A tuple of the change in length the move makes and the move, for applyMove.
+def randomMove(table, tour, rng):
+    n = len(tour) - 2
+    kind = rng.randrange(3)
+    if kind == 0:       # swap two stops
+        i, j = sorted(rng.sample(range(1, n+1), 2))
+        return swapDelta(table, tour, i, j), (kind, i, j)
+    elif kind == 1:     # reverse a run of stops
+        i, j = sorted(rng.sample(range(1, n+1), 2))
+        return twoOptDelta(table, tour, i, j), (kind, i, j)
+    # move a run of up to 3 stops elsewhere
+    length = rng.randint(1, min(3, n-1))
+    i = rng.randint(1, n-length+1)
+    k = rng.randint(1, n-length)
+    if k >= i:
+        k += 1
+    return orOptDelta(table, tour, i, length, k), (kind, i, length, k)
+
+# Applies a move drawn by randomMove to a tour.
+def applyMove(tour, move):
+    if move[0] == 0:
+        swap(tour, move[1], move[2])
+    elif move[0] == 1:
+        twoOpt(tour, move[1], move[2])
+    else:
+        orOpt(tour, move[1], move[2], move[3])
+
+# Calibrates the starting temperature to the distances of a tour, so that at first an
+# average uphill move is accepted with probability INITIAL_ACCEPTANCE.
+# @param samples The number of random moves whose deltas are averaged.
+# @return The starting temperature.
+def initialTemperature(table, tour, rng, samples = CALIBRATION_SAMPLES):
+    if len(tour) < 4:
+        return 1.0
+    uphill = [delta for delta, _ in (randomMove(table, tour, rng) for _ in range(samples)) if delta > 0]
+    if len(uphill) == 0:
+        return 1.0
+    return -(sum(uphill) / len(uphill)) / math.log(INITIAL_ACCEPTANCE)
+
+# Finds the shortest tour exactly, by dynamic programming over the subsets of stops
+# (Held-Karp), in O(2^n n^2) time and O(2^n n) memory for n stops.
+# @param table A distance table as returned by crowDistanceTable.
+# @return A tuple of the shortest tour, starting and ending with the depot (0), and its
+#   length; the stops in the given order if no tour has a finite length (e.g. a distance
+#   is NaN).
+def heldKarp(table):
+    n = len(table) - 1
+    if n == 0:
+        return [0, 0], 0.0
+    # cost[mask][j]: the shortest path from the depot through the stops in mask (bit k
+    # for stop k+1) that ends at stop j+1, and parent[mask][j] the stop before it
+    cost   = [[0.0] * n for _ in range(1 << n)]
+    parent = [[-1] * n for _ in range(1 << n)]
+    rows = [row[1:] for row in table[1:]]
+    for j in range(n):
+        cost[1 << j][j] = table[0][j+1]
+    for mask in range(3, 1 << n):
+        members = [k for k in range(n) if mask >> k & 1]
+        if len(members) < 2:
+            continue
+        costRow, parentRow = cost[mask], parent[mask]
+        for j in members:
+            previous = cost[mask ^ (1 << j)]
+            best, bestK = INFINITY, -1
+            for k in members:
+                if k != j and previous[k] + rows[k][j] < best:
+                    best, bestK = previous[k] + rows[k][j], k
+            costRow[j], parentRow[j] = best, bestK
+
+    mask = (1 << n) - 1
+    best, j = min((cost[mask][j] + table[j+1][0], j) for j in range(n))
+    stops = []
+    while j >= 0:
+        stops.append(j+1)
+        j, mask = parent[mask][j], mask ^ (1 << j)
+    if len(stops) < n:
+        givenTour = [0] + list(range(1, n+1)) + [0]
+        return givenTour, tourCost(table, givenTour)
+    return [0] + stops[::-1] + [0], tourCost(table, [0] + stops[::-1] + [0])
+
+# Builds a tour by always going on to the nearest stop not yet visited.
+# @param table A distance table as returned by crowDistanceTable.
+# @return A tour that starts and ends with the depot (0).
+def nearestNeighborTour(table):
+    unvisited = set(range(1, len(table)))
+    tour = [0]
+    while unvisited:
+        row = table[tour[-1]]
+        stop = min(unvisited, key = row.__getitem__)
+        unvisited.remove(stop)
+        tour.append(stop)
+    tour.append(0)
+    return tour
+
+# Builds a tour by farthest insertion: the stop farthest from the tour so far is
+# inserted where it lengthens the tour the least, until every stop is in.
+# @param table A distance table as returned by crowDistanceTable.
+# @return A tour that starts and ends with the depot (0).
+def farthestInsertionTour(table):
+    tour = [0, 0]
+    # the distance of every stop not yet in the tour to the nearest stop in it
+    distances = {stop: table[0][stop] for stop in range(1, len(table))}
+    while distances:
+        stop = max(distances, key = distances.__getitem__)
+        del distances[stop]
+        row = table[stop]
+        i = min(range(len(tour) - 1),
+                key = lambda i: table[tour[i]][stop] + row[tour[i+1]] - table[tour[i]][tour[i+1]])
+        tour.insert(i + 1, stop)
+        for other in distances:
+            if row[other] < distances[other]:
+                distances[other] = row[other]
+    return tour
+
+# Anneals a tour with random swap, 2-opt and Or-opt moves, each scored by its delta.
+# Without a time budget the temperature drops by coolingRate every iteration. With one,
+# the temperature follows the fraction of the budget used, from temperature down to
+# finalTemperature when it runs out, so the whole schedule fits the budget; annealing
+# also stops early once no move has been accepted for CONVERGED_ITERATIONS (or 20 per
+# stop) in the colder half of the schedule.
+# @param table A symmetric distance table as returned by crowDistanceTable.
+# @param tour The starting tour, a list of stops that starts and ends with the depot (0).
+# @param rng The source of randomness (the random module or a random.Random).
+# @param temperature The starting temperature.
+# @param coolingRate The fraction the temperature drops by every iteration.
+# @param finalTemperature The temperature annealing stops at.
+# @param timeBudgetMs The number of milliseconds to anneal for (None for no limit).
+# @param stopEvent A threading.Event that stops annealing when set (checked with the time).
+# @return A tuple of the best tour found and its length.
+def anneal(table, tour, rng = random, temperature = TEMPERATURE, coolingRate = COOLINGRATE,
+        finalTemperature = 1, timeBudgetMs = None, stopEvent = None):
+    tour = tour.copy()
+    n = len(tour) - 2
+    currentCost = tourCost(table, tour)
+    bestTour, bestCost = tour.copy(), currentCost
+    if n < 2:
+        return bestTour, bestCost
+
+    startTemperature = temperature
+    begin = time.perf_counter()
+    converged = max(CONVERGED_ITERATIONS, 20 * n)
+    iteration = lastAccepted = 0
+    while temperature > finalTemperature:
+        delta, move = randomMove(table, tour, rng)
+
+        # Determine if the move should be accepted.
+        if acceptanceProbability(currentCost, currentCost + delta, temperature) > rng.random():
+            applyMove(tour, move)
+            currentCost += delta
+            lastAccepted = iteration
+
+            # Track best solution so far.
+            if currentCost < bestCost:
+                bestTour, bestCost = tour.copy(), currentCost
+        iteration += 1
+
+        # Cool temperature
+        if timeBudgetMs is None:
+            temperature *= 1-coolingRate
+        elif iteration % CHECK_INTERVAL == 0:
+            used = (time.perf_counter() - begin) * 1000 / timeBudgetMs if timeBudgetMs > 0 else 1
+            if used >= 1 or (stopEvent is not None and stopEvent.is_set()) or \
+                    (used > 0.5 and iteration - lastAccepted > converged):
+                break
+            temperature = startTemperature * (finalTemperature / startTemperature) ** used
+
+    # the running cost drifts by rounding, so report the exact length
+    return bestTour, tourCost(table, bestTour)
+
+# Runs one annealing chain of a multi-start optimization (in a worker process).
+# @param chain A tuple of the distance table, the starting tour, the seed of the chain,
+#   the temperatures it starts and stops at and its time budget in ms (or None).
+# @return A tuple of the best tour found and its length.
+def annealChain(chain):
+    table, tour, seed, temperature, finalTemperature, timeBudgetMs = chain
+    return anneal(table, tour, random.Random(seed), temperature, COOLINGRATE, finalTemperature,
+        timeBudgetMs)
+
 class DeliveryOptimizer:
 
-    def __init__(self, streetmap):
+    # @param metric The DistanceMetric to minimize (crow distance unless specified).
+    # @param chains The number of independent annealing chains, each from its own random
+    #   order; the best result of all of them is kept.
+    # @param processes The number of worker processes the chains run on (0 runs them in
+    #   this process; the result is the same either way).
+    # @param seed The master seed every chain seed is drawn from, for reproducible
+    #   results (None draws it from the random module).
+    # @param exchanges The number of times the chains stop to restart from the best
+    #   order found by any of them, evenly spread over the cooling schedule.
+    # @param solver The Solver that orders the deliveries. With AUTO every chain of a
+    #   large order starts from the same constructed tour instead of a random order.
+    def __init__(self, streetmap, metric = DistanceMetric.CROW, chains = 1, processes = 0,
+            seed = None, exchanges = 0, solver = Solver.AUTO):
         self.__router = PointToPointRouter(streetmap)
+        self.__metric = metric
+        self.__chains = chains
+        self.__processes = processes
+        self.__seed = seed
+        self.__exchanges = exchanges
+        self.__solver = solver
+        self.__pool = None
+
+        # the stops, road distances and search trees of the last ROAD optimization
+        self.__stops  = {}
+        self.__matrix = None
+        self.__trees  = None
+
+    # returns the distance metric the optimizer minimizes
+    def metric(self):
+        return self.__metric
+
+    # returns the solver the optimizer orders deliveries with
+    def solver(self):
+        return self.__solver
 
-    # Optimizes the delivery process by Simulated Annealing.
+    # Stops the worker processes of a parallel optimizer.
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    # Optimizes the delivery process, exactly for small orders and by Simulated Annealing
+    # otherwise (see Solver).
     # @param depot The geospatial coordinate of the food depot, i.e. start location.
     # @param deliveries A list of delivery requests to be handled.
-    # @return A tuple consisting of the old crow distance and the new
-    #   crow distance (after optimization).
-    def optimizeDeliveryOrder(self, depot, deliveries):
+    # @param timeBudgetMs The number of milliseconds the optimization may take (None
+    #   runs the fixed TEMPERATURE / COOLINGRATE schedule instead). The temperature is
+    #   then calibrated to the distances of the order and cooled to fit the budget, and
+    #   the result depends on timing, not only on the seed. Exact solutions ignore it.
+    # @param stopEvent A threading.Event that, once set, makes the optimization return the
+    #   best order found so far (chains on worker processes still run out their budget).
+    # @return A tuple consisting of the old distance and the new distance (after
+    #   optimization), crow distances or road distances depending on the metric.
+    def optimizeDeliveryOrder(self, depot, deliveries, timeBudgetMs = None, stopEvent = None):
+        deadline = None if timeBudgetMs is None else time.perf_counter() + timeBudgetMs / 1000
+        self.__stops = {}
         if len(deliveries) < 2:
             return
-            
-        temperature = TEMPERATURE
-        coolingRate = COOLINGRATE
-
-        # Initialize current solution as a random solution.
-        currentSolution = deliveries.copy()
-        random.shuffle(currentSolution)
-
-        # Keep track of the best solution so far.
-        bestSolution = currentSolution.copy()
-        bestDistance = deliveryRouteCrowDistance(depot, currentSolution)
-
-        while temperature > 1:
-            newSolution = currentSolution.copy()
-
-            # generate 2 distinct random indices.
-            index1 = random.randint(0, len(deliveries)-1)
-            index2 = random.randint(0, len(deliveries)-1)
-            while (index2 == index1):
-                index2 = random.randint(0, len(deliveries)-1)
-            
-            # Swap the two random indices to create a new solution.
-            swap(newSolution, index1, index2)
-            
-            # Get the energy states of both solutions (i.e. the distances)
-            currentDistance = deliveryRouteCrowDistance(depot, currentSolution)
-            newDistance     = deliveryRouteCrowDistance(depot, newSolution)
-            
-            # Determine if new solution should be accepted.
-            rand = random.random()
-            if acceptanceProbability(currentDistance, newDistance, temperature) > rand:
-                currentSolution = newSolution
-            
-            # Track best solution so far.
-            if currentDistance < bestDistance:
-                bestSolution = currentSolution
-                bestDistance = currentDistance
 
-            # Cool temperature
-            temperature *= 1-coolingRate
+        if self.__metric == DistanceMetric.ROAD:
+            table = self.__roadDistanceTable(depot, deliveries)
+        else:
+            table = crowDistanceTable(depot, deliveries)
+        n = len(deliveries)
+        givenTour = [0] + list(range(1, n+1)) + [0]
+        oldDistance = tourCost(table, givenTour)
+
+        if self.__solver == Solver.AUTO and n <= EXACT_STOPS:
+            bestTour, bestDistance = heldKarp(table)
+        else:
+            bestTour, bestDistance = self.__multiStart(table, n, deadline, stopEvent)
+
+        # never return an order worse than the one given, or one that is not an order of
+        # every stop (NaN distances fail every comparison)
+        if not bestDistance < oldDistance or sorted(bestTour[1:-1]) != givenTour[1:-1]:
+            bestTour, bestDistance = givenTour, oldDistance
+
+        deliveries[:] = [deliveries[stop-1] for stop in bestTour[1:-1]]
+
+        return oldDistance, bestDistance
+
+    # Generates the route between two stops of the last ROAD optimization from the
+    # searches that optimization ran, so the leg is not routed a second time.
+    # @param start The starting geospatial coordinate (the depot or a delivery location).
+    # @param end The ending geospatial coordinate (the depot or a delivery location).
+    # @param route A list of connected street segments forming the route.
+    # @return The same as PointToPointRouter.generatePointToPointRoute, or None if start
+    #   and end were not both stops of the last ROAD optimization.
+    def generateLegRoute(self, start, end, route):
+        i = self.__stops.get(start)
+        j = self.__stops.get(end)
+        if i is None or j is None:
+            return None
+        result = self.__router.generateRouteFromTree(self.__trees[i], end, route)
+        if result != DeliveryResult.DELIVERY_SUCCESS:
+            return result, -1
+        return result, self.__matrix[i][j]
+
+    # A private function that anneals chains from random orders (or, with Solver.AUTO,
+    # from a constructed tour), in rounds separated by the exchanges, and returns the best
+    # tour and its length. All randomness comes from the master seed, so the result does
+    # not depend on how the chains are scheduled.
+    # @param deadline The time.perf_counter() time to finish by, or None.
+    def __multiStart(self, table, n, deadline = None, stopEvent = None):
+        master = random.Random(self.__seed if self.__seed is not None else random.randrange(2**32))
+        tours = []
+        if self.__solver == Solver.AUTO:
+            tours = [min(nearestNeighborTour(table), farthestInsertionTour(table),
+                         key = lambda tour: tourCost(table, tour))] * max(1, self.__chains)
+        else:
+            for _ in range(max(1, self.__chains)):
+                # Initialize current solution as a random solution.
+                stops = list(range(1, n+1))
+                master.shuffle(stops)
+                tours.append([0] + stops + [0])
+
+        # the geometric cooling schedule, cut into equal rounds: from TEMPERATURE to 1, or
+        # from a temperature calibrated to the table when there is a time budget or the
+        # chains start from a constructed tour
+        rounds = self.__exchanges + 1
+        if self.__solver == Solver.AUTO:
+            first = REFINE_TEMPERATURE * tourCost(table, tours[0]) / (n + 1)
+            last  = first * FINAL_TEMPERATURE_RATIO
+        elif deadline is None:
+            first, last = TEMPERATURE, 1
+        else:
+            first = initialTemperature(table, tours[0], master)
+            last  = first * FINAL_TEMPERATURE_RATIO
+        temperatures = [first * (last / first) ** (r / rounds) for r in range(rounds + 1)]
+        parallel = self.__processes > 1 and len(tours) > 1
+        # the number of chains that run one after another
+        waves = -(-len(tours) // self.__processes) if parallel else len(tours)
+
+        bestTour, bestDistance = None, INFINITY
+        for r in range(rounds):
+            budget = None
+            if deadline is not None:
+                budget = max(0, deadline - time.perf_counter()) * 1000 / (rounds - r) / waves
+            chains = [(table, tour, master.randrange(2**32), temperatures[r], temperatures[r+1], budget)
+                      for tour in tours]
+            if parallel:
+                results = self.__workers().map(annealChain, chains)
+            else:
+                results = [anneal(table, tour, random.Random(seed), start, COOLINGRATE, end,
+                                  budget, stopEvent)
+                           for table, tour, seed, start, end, budget in chains]
+            for tour, distance in results:
+                if distance < bestDistance:
+                    bestTour, bestDistance = tour, distance
+            tours = [bestTour] * len(tours)
+            if stopEvent is not None and stopEvent.is_set():
+                break
+        return bestTour, bestDistance
 
-        oldCrowDistance = deliveryRouteCrowDistance(depot, deliveries)
-        
-        deliveries[:] = bestSolution
+    # A private function that starts the worker processes the first time they are needed.
+    def __workers(self):
+        if self.__pool is None:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                self.__pool = multiprocessing.get_context('fork').Pool(self.__processes)
+            else:
+                self.__pool = multiprocessing.Pool(self.__processes)
+        return self.__pool
 
-        return oldCrowDistance, bestDistance
-        
\ No newline at end of file
+    # A private function that builds the table of road distances between the depot and
+    # the delivery locations, with one search per stop, and keeps the searches.
+    # Stops without a route between them are UNREACHABLE_DISTANCE apart.
+    def __roadDistanceTable(self, depot, deliveries):
+        locations = [depot] + [delivery.location for delivery in deliveries]
+        for i, gc in enumerate(locations):
+            self.__stops.setdefault(gc, i)
+        self.__matrix, self.__trees = self.__router.distanceMatrix(locations, locations, returnTrees = True)
+        return [[UNREACHABLE_DISTANCE if distance < 0 else distance for distance in row]
+                for row in self.__matrix]
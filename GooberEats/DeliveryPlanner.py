@@ -1,5 +1,8 @@
-from DeliveryOptimizer import DeliveryOptimizer
+import itertools
+
+from DeliveryOptimizer import DeliveryOptimizer, DistanceMetric
 from PointToPointRouter import PointToPointRouter
+from RoutePool import RoutePool
 from provided import *
 
 # Function which gets the delivery command type.
@@ -47,99 +50,230 @@ def turnDirection(seg1, seg2):
     angle = angleBetween2Lines(seg1, seg2)
     return 'left' if 1 <= angle < 180 else 'right'
 
-# Generates a list of appropriate delivery commands of a given route.
-# @param route A list of street segments for which the commands is to be generated.
-# @param commands A list to be populated with the appropriate delivery commands (in order).
-# @param deliveries A list of delivery requests to be fulfilled.
-# @post 'commands' will be cleared and populated with the appropriate delivery commands.
-def generateDeliveryCommand(route, commands, deliveries):
-    commands.clear()
+# Generates the delivery commands of a route one at a time, reading the route only as
+# far as the commands need: a proceed command is yielded once the route leaves its
+# street, so the commands of the start of a route are ready before the rest is routed.
+# @param segments An iterable of the street segments of the route (e.g. a generator
+#   chaining the routes of the legs of a plan).
+# @param deliveries A list of delivery requests to be fulfilled, in route order.
+# @return A generator of the delivery commands, in order (none for an empty route).
+def iterDeliveryCommands(segments, deliveries):
+    segments = iter(segments)
+    previous = next(segments, None)
+    if previous is None:
+        return
     # Generate first command from depot to first GeoCoord.
     command = DeliveryCommand()
-    command.initAsProceedCommand(proceedDirection(route[0]), route[0].name, 
-        segmentDistance(route[0]) )
-    commands.append(command)
+    command.initAsProceedCommand(proceedDirection(previous), previous.name,
+        segmentDistance(previous) )
 
     # Iterate from second street segment to last segment (from last delivery back to depot).
-    i = 1   # index of route
     j = 0   # index of deliveries
-    while i < len(route):
-        if (commands[-1].streetName() == route[i].name):    # Proceed since still on same street.
-            commands[-1].increaseDistance(segmentDistance(route[i]) )
+    segment = next(segments, None)
+    while segment is not None:
+        if (command.streetName() == segment.name):    # Proceed since still on same street.
+            command.increaseDistance(segmentDistance(segment) )
         else:   # Turn and/or proceed onto new street.
-            command = DeliveryCommand()
-            seg1 = route[i-1]
-            seg2 = route[i]
-            if commandType(seg1, seg2) == CommandType.TURN:
-                command.initAsTurnCommand(turnDirection(seg1, seg2), seg2.name)
-                commands.append(command)
+            yield command
+            if commandType(previous, segment) == CommandType.TURN:
+                turn = DeliveryCommand()
+                turn.initAsTurnCommand(turnDirection(previous, segment), segment.name)
+                yield turn
 
             command = DeliveryCommand()
-            command.initAsProceedCommand(proceedDirection(seg2), seg2.name, 
-                segmentDistance(seg2) )
-            commands.append(command)
-        i += 1 
+            command.initAsProceedCommand(proceedDirection(segment), segment.name,
+                segmentDistance(segment) )
+        previous = segment
+        segment = next(segments, None)
         # Check if a delivery is to be made.
-        if i < len(route) and j < len(deliveries) and route[i].end == deliveries[j].location:
+        if segment is not None and j < len(deliveries) and segment.end == deliveries[j].location:
+            yield command
             command = DeliveryCommand()
             command.initAsDeliverCommand(deliveries[j].item)
-            commands.append(command)
-            i += 1
+            yield command
             j += 1
-            
+
             # Delivery command immediately after delivery shall always be 'proceed'
+            # (the segment into the delivery location is skipped)
+            previous = next(segments, None)
+            if previous is None:
+                return
             command = DeliveryCommand()
-            command.initAsProceedCommand(proceedDirection(route[i]), route[i].name, 
-                segmentDistance(route[i]) )
-            commands.append(command)
-            i += 1
+            command.initAsProceedCommand(proceedDirection(previous), previous.name,
+                segmentDistance(previous) )
+            segment = next(segments, None)
+    yield command
+
+# Generates a list of appropriate delivery commands of a given route.
+# @param route The street segments for which the commands is to be generated (a list,
+#   or any iterable of them).
+# @param commands A list to be populated with the appropriate delivery commands (in order).
+# @param deliveries A list of delivery requests to be fulfilled.
+# @post 'commands' will be cleared and populated with the appropriate delivery commands.
+def generateDeliveryCommand(route, commands, deliveries):
+    commands.clear()
+    commands += iterDeliveryCommands(route, deliveries)
 
 class DeliveryPlanner:
-    def __init__(self, streetmap):
+    # @param processes The number of worker processes the legs of a plan are routed on
+    #   (0 routes them one after another in this process).
+    # @param metric The DistanceMetric the delivery order is optimized for. With ROAD the
+    #   legs are read off the searches the optimizer ran instead of being routed again.
+    # @param snapMiles How far (in miles) the depot and delivery locations that are not on
+    #   the map may be snapped to it (StreetMap.snapGeoCoords). None does not snap, so a
+    #   location off the map is a BAD_COORD.
+    def __init__(self, streetmap, processes = 0, metric = DistanceMetric.CROW, snapMiles = None):
+        self.__map = streetmap
+        self.__snapMiles = snapMiles
         self.__router = PointToPointRouter(streetmap)
-        self.__optimizer = DeliveryOptimizer(streetmap)
-        
+        self.__optimizer = DeliveryOptimizer(streetmap, metric)
+        self.__pool = RoutePool(streetmap, processes) if processes > 1 else None
+
+    # Stops the worker processes of a parallel planner.
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.close()
+
     # Generates a delivery plan fulfilling all delivery requests.
     # @param depotLocation The geospatial coordinate of the depot (i.e start & end point)
     # @param deliveries A list of all delivery requests to be fulfilled.
     # @param commands A list of delivery commands to be populated with delivery instructions.
+    # @param timeBudgetMs The number of milliseconds ordering the deliveries may take (None
+    #   for the fixed annealing schedule), see DeliveryOptimizer.optimizeDeliveryOrder.
     # @return A tuple of the delivery result and the total distance through the delivery plan.
+    #  *If a leg has a bad coordinate or no route, will return (BAD_COORD or NO_ROUTE, -1)
+    #  *If a location is farther than snapMiles from the map, will return (BAD_COORD, -1)
+    # @post The deliveries are reordered; with snapping, a delivery whose location was
+    #   snapped is replaced by a DeliveryRequest for the same item at the snapped location.
     def generateDeliveryPlan(self,
             depotLocation, 
             deliveries, 
-            commands):
+            commands,
+            timeBudgetMs = None):
 
-        if len(deliveries) == 0:
+        result, legs = self.__planLegs(depotLocation, deliveries, timeBudgetMs)
+        if result != DeliveryResult.DELIVERY_SUCCESS:
+            return result, -1
+        if len(legs) == 0:
             return DeliveryResult.DELIVERY_SUCCESS, 0.0
 
-        self.__optimizer.optimizeDeliveryOrder(depotLocation, deliveries)
-        
-        totalRoute = []
+        routes = []
         totalDistance   = 0.0
-        for i in range(len(deliveries)-1):
-            route = []
-            gc1 = deliveries[i].location
-            gc2 = deliveries[i+1].location
-            result, distance = self.__router.generatePointToPointRoute(gc1, gc2, route)
-            
+        for result, distance, route in self.__legRoutes(legs):
             if result == DeliveryResult.BAD_COORD or result == DeliveryResult.NO_ROUTE:
-                return result
-            
+                return result, -1
+
             totalDistance += distance
-            totalRoute    += route
-
-        firstRoute = []
-        lastRoute  = []
-        firstDeliveryLocation = deliveries[0].location
-        lastDeliveryLocation  = deliveries[-1].location
-        result, distance1 = \
-            self.__router.generatePointToPointRoute(depotLocation, firstDeliveryLocation, firstRoute)
-        result, distance2 = \
-            self.__router.generatePointToPointRoute(lastDeliveryLocation, depotLocation, lastRoute)
-        
-        totalDistance += distance1 + distance2
-        totalRoute = firstRoute + totalRoute + lastRoute
-
-        generateDeliveryCommand(totalRoute, commands, deliveries)
-
-        return DeliveryResult.DELIVERY_SUCCESS, totalDistance
\ No newline at end of file
+            routes.append(route)
+
+        generateDeliveryCommand(itertools.chain.from_iterable(routes), commands, deliveries)
+
+        return DeliveryResult.DELIVERY_SUCCESS, totalDistance
+
+    # Generates a delivery plan like generateDeliveryPlan, but hands out the delivery
+    # commands while the legs are routed: the commands of a leg are generated as soon as
+    # its route is known, so a driver gets the first instructions of a long plan without
+    # waiting for the rest. The deliveries are ordered before this returns.
+    # @param depotLocation The geospatial coordinate of the depot (i.e start & end point)
+    # @param deliveries A list of all delivery requests to be fulfilled.
+    # @param timeBudgetMs The number of milliseconds ordering the deliveries may take.
+    # @return A DeliveryPlanStream of the delivery commands. Its result and total distance
+    #   are those generateDeliveryPlan returns; if a leg has no route, the commands stop
+    #   before that leg and the result is NO_ROUTE.
+    # @post The same as generateDeliveryPlan.
+    def streamDeliveryPlan(self, depotLocation, deliveries, timeBudgetMs = None):
+        result, legs = self.__planLegs(depotLocation, deliveries, timeBudgetMs)
+        return DeliveryPlanStream(self.__streamCommands(result, legs, deliveries))
+
+    # A private function that snaps and orders the deliveries of a plan.
+    # @return A tuple of the delivery result (BAD_COORD if a location could not be
+    #   snapped) and a list of the (start, end) legs of the plan (empty without deliveries).
+    def __planLegs(self, depotLocation, deliveries, timeBudgetMs):
+        if len(deliveries) == 0:
+            return DeliveryResult.DELIVERY_SUCCESS, []
+
+        if self.__snapMiles is not None:
+            snapped = self.__map.snapGeoCoords([depotLocation] + [delivery.location for delivery in deliveries])
+            if any(snap is None or snap[1] > self.__snapMiles for snap in snapped):
+                return DeliveryResult.BAD_COORD, []
+            depotLocation = snapped[0][0]
+            for i, (location, _) in enumerate(snapped[1:]):
+                if location != deliveries[i].location:
+                    deliveries[i] = DeliveryRequest(deliveries[i].item, location)
+
+        self.__optimizer.optimizeDeliveryOrder(depotLocation, deliveries, timeBudgetMs)
+
+        # the legs depot -> first delivery -> ... -> last delivery -> depot
+        stops = [depotLocation] + [delivery.location for delivery in deliveries] + [depotLocation]
+        return DeliveryResult.DELIVERY_SUCCESS, list(zip(stops, stops[1:]))
+
+    # A private function that routes the legs of a plan.
+    # @param streaming Whether to hand out every leg as soon as it is routed (with worker
+    #   processes, routeLegs hands them out together, in larger batches).
+    # @return An iterator over a tuple of (delivery result, distance, route) per leg.
+    def __legRoutes(self, legs, streaming = False):
+        if self.__pool is not None and self.__optimizer.metric() != DistanceMetric.ROAD:
+            return self.__pool.iterRouteLegs(legs) if streaming else iter(self.__pool.routeLegs(legs))
+        return self.__serialLegRoutes(legs)
+
+    # A private function that routes the legs of a plan one after another in this process.
+    def __serialLegRoutes(self, legs):
+        for gc1, gc2 in legs:
+            route = []
+            legRoute = self.__optimizer.generateLegRoute(gc1, gc2, route)
+            if legRoute is None:
+                legRoute = self.__router.generatePointToPointRoute(gc1, gc2, route)
+            result, distance = legRoute
+            yield result, distance, route
+
+    # A private function that generates the commands of a streamed plan.
+    # @return A generator of the delivery commands that returns a tuple of the delivery
+    #   result and the total distance.
+    def __streamCommands(self, result, legs, deliveries):
+        if result != DeliveryResult.DELIVERY_SUCCESS:
+            return result, -1
+        status = [DeliveryResult.DELIVERY_SUCCESS, 0.0]
+        def segments():
+            for result, distance, route in self.__legRoutes(legs, streaming = True):
+                if result == DeliveryResult.BAD_COORD or result == DeliveryResult.NO_ROUTE:
+                    status[:] = result, -1
+                    return
+                status[1] += distance
+                yield from route
+
+        for command in iterDeliveryCommands(segments(), deliveries):
+            # the last command before a failed leg may be incomplete
+            if status[0] != DeliveryResult.DELIVERY_SUCCESS:
+                break
+            yield command
+        return tuple(status)
+
+# The delivery commands of a plan (DeliveryPlanner.streamDeliveryPlan), generated as they
+# are iterated over. The result and total distance of the plan are known once every
+# command has been generated.
+class DeliveryPlanStream:
+
+    def __init__(self, commands):
+        self.__commands      = commands
+        self.__result        = None
+        self.__totalDistance = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.__commands)
+        except StopIteration as stop:
+            if stop.value is not None:
+                self.__result, self.__totalDistance = stop.value
+            raise
+
+    # returns the delivery result of the plan (None until every command is generated)
+    def result(self):
+        return self.__result
+
+    # returns the total distance of the plan in miles (-1 unless it succeeded, None until
+    # every command is generated)
+    def totalDistance(self):
+        return self.__totalDistance
@@ -68,6 +68,42 @@ class ExpandableHashMap:
         if (self.__loadFactor > self.__maxLoadFactor):
             self.__rehash()
 
+    # Makes room for a number of associations so that inserting them does not rehash.
+    # @param n The number of associations the hash table should hold.
+    # @post The capacity is the smallest prime of the list keeping the load factor of n
+    #   associations within the maximum (capped at the last prime), rehashing at most once.
+    def reserve(self, n):
+        if n <= self.__capacity * self.__maxLoadFactor:
+            return
+        index = self.__indexOfNextPrime
+        if index >= PRIME_NUMBER_COUNT:
+            return
+        while index < PRIME_NUMBER_COUNT-1 and n > primeNumberList[index] * self.__maxLoadFactor:
+            index += 1
+        self.__rehash(index)
+
+    # Builds a hash table from key, value pairs, sizing it once for all of them.
+    # @param items An iterable of key, value pairs (later pairs win on duplicate keys).
+    # @param maxLoadFactor The maximum load factor of the new hash table.
+    # @return A new ExpandableHashMap holding all associations.
+    @classmethod
+    def fromItems(cls, items, maxLoadFactor = 0.5):
+        items = list(items)
+        hashmap = cls(maxLoadFactor)
+        hashmap.reserve(len(items))
+        table = hashmap.__table
+        for key, value in items:
+            bucket = table[hashmap.__hash(key)]
+            for node in bucket:
+                if node.hasKey(key):
+                    node.value = value
+                    break
+            else:
+                bucket.append(HashNode(key, value))
+                hashmap.__size += 1
+        hashmap.__updateLoadFactor()
+        return hashmap
+
     # Finds the value of a key.
     # @param key The key whose value is to be returned.
     # @return None if key is not found, else its value.
@@ -82,9 +118,9 @@ class ExpandableHashMap:
         row = self.__hash(key)
         if (len(self.__table[row]) == 0):
             return None, None
-        for node in self.__table[row]:
+        for col, node in enumerate(self.__table[row]):
             if node.hasKey(key): 
-                return row, self.__table[row].index(node)
+                return row, col
         return None, None
     
     # A private function that returns a hash value of a key.
@@ -94,25 +130,29 @@ class ExpandableHashMap:
         return hash(key) % self.__capacity
     
     # A private function that rehashes the whole table, roughly doubling its capacity.
+    # @param primeIndex The index of the new capacity in the prime list (the next one if None).
     # @post The hash table shall have all its keys rehashed and its size will be roughly doubled.
-    def __rehash(self):
-        if (self.__indexOfNextPrime >= PRIME_NUMBER_COUNT):
+    #   The existing HashNodes are moved into the new buckets, none are allocated.
+    def __rehash(self, primeIndex = None):
+        if primeIndex is None:
+            primeIndex = self.__indexOfNextPrime
+        if (primeIndex >= PRIME_NUMBER_COUNT):
             return
         
-        newCapacity = primeNumberList[self.__indexOfNextPrime]
-        self.__indexOfNextPrime += 1
+        newCapacity = primeNumberList[primeIndex]
+        self.__indexOfNextPrime = primeIndex + 1
 
         # create a new empty table with increased size while keeping a copy of 
         # old table to be rehashed
         oldTable        = self.__table
         self.__table    = [[] for _ in range(newCapacity)]
         self.__capacity = newCapacity
-        # update size to 0 as it will be increased when reinserting associations
-        self.__size     = 0 
 
+        # keys are known to be distinct, so nodes can be appended to their new bucket 
+        # without going through associate (and its load factor check)
         for bucket in oldTable:
             for hashnode in bucket:
-                self.associate(hashnode.key, hashnode.value)
+                self.__table[self.__hash(hashnode.key)].append(hashnode)
 
         self.__updateLoadFactor()
 
@@ -0,0 +1,53 @@
+"""
+Compiles Open Street Map text data (the format read by StreetMap.load) into a compact
+binary file that StreetMap.loadCompiled memory-maps instead of parsing.
+
+Usage: python MapCompiler.py mapdata.txt mapdata.gmap
+       python MapCompiler.py --tiles DEGREES mapdata.txt mapdata-tiles/
+
+The file holds sorted fixed-point coordinate keys, coordinate arrays, the CSR
+adjacency index of StreetGraph (every segment as two directed edges with their
+lengths in miles) and interned coordinate-text and street-name tables. See
+StreetGraph for the exact layout.
+
+With --tiles the map is split into square tiles of the given size in degrees, written
+as one compiled file per tile plus an index into a directory that StreetMap.loadTiled
+opens (see TiledStreetGraph).
+"""
+import sys
+
+from StreetGraph import *
+from TiledStreetGraph import *
+
+# Compiles a map data text file into the binary map format.
+# @param mapFile The text file containing the map data.
+# @param compiledFile The binary file to be written.
+# @return A tuple of the number of nodes and the number of directed edges written.
+def compileMap(mapFile, compiledFile):
+    graph = StreetGraph.fromMapFile(mapFile)
+    graph.save(compiledFile)
+    return graph.nodeCount(), graph.edgeCount()
+
+# Compiles a map data text file into a directory of tiles.
+# @param mapFile The text file containing the map data.
+# @param directory The directory to write the tiles to (created if needed).
+# @param tileDegrees The side of a tile in degrees.
+# @return A tuple of the number of nodes, the number of directed edges and the number
+#   of tiles written.
+def compileTiledMap(mapFile, directory, tileDegrees = TILE_DEGREES):
+    graph = StreetGraph.fromMapFile(mapFile)
+    tileCount = saveTiles(graph, directory, tileDegrees)
+    return graph.nodeCount(), graph.edgeCount(), tileCount
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == '--tiles':
+        nodeCount, edgeCount, tileCount = compileTiledMap(sys.argv[3], sys.argv[4], float(sys.argv[2]))
+        print('compiled {0} nodes and {1} directed edges into {2} tiles in {3}'.format(
+            nodeCount, edgeCount, tileCount, sys.argv[4]))
+        sys.exit()
+    if len(sys.argv) != 3:
+        sys.exit('usage: python MapCompiler.py [--tiles <degrees>] <map data text file> '
+                 '<compiled map file or tile directory>')
+    nodeCount, edgeCount = compileMap(sys.argv[1], sys.argv[2])
+    print('compiled {0} nodes and {1} directed edges into {2}'.format(
+        nodeCount, edgeCount, sys.argv[2]))
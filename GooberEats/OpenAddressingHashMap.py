@@ -0,0 +1,153 @@
+"""
+Open addressing counterpart of ExpandableHashMap.
+
+Keys, values and their hashes are kept in three parallel arrays instead of a list
+of buckets, so a lookup never walks a chain of HashNodes. The capacity is always a
+power of two and simply doubles whenever the load factor is exceeded (there is no
+upper bound like the prime table of ExpandableHashMap).
+
+Collisions are resolved with the perturbed probe sequence used by CPython's dict:
+    index = (5 * index + 1 + perturb) mod capacity,  perturb >>= 5
+which visits every slot eventually, while the perturbation makes use of the high
+bits of the hash so keys that only differ there do not pile up on the same slots.
+"""
+INITIAL_CAPACITY = 8
+PERTURB_SHIFT    = 5
+HASH_MASK        = (1 << 64) - 1
+
+class OpenAddressingHashMap:
+
+    def __init__(self, maxLoadFactor = 0.5):
+        self.__size = 0
+        self.__capacity = INITIAL_CAPACITY
+        self.__maxLoadFactor = maxLoadFactor if 0 < maxLoadFactor < 1 else 0.5
+        # a slot is empty iff its hash is None
+        self.__keys   = [None] * self.__capacity
+        self.__values = [None] * self.__capacity
+        self.__hashes = [None] * self.__capacity
+
+    # magic method to support value = OpenAddressingHashMap[key]
+    def __getitem__(self, key):
+        return self.find(key)
+
+    # magic method to support OpenAddressingHashMap[key] = value
+    def __setitem__(self, key, value):
+        self.associate(key, value)
+
+    # magic method to support len(OpenAddressingHashMap)
+    def __len__(self):
+        return self.__size
+
+    # resets the hashmap back to 8 slots, deletes all items
+    def reset(self):
+        self.__init__(self.__maxLoadFactor)
+
+    # returns the number of associations in the hashmap
+    def size(self):
+        return self.__size
+
+    # Inserts a key, value pair into the hash table (value will be updated if key already exists).
+    # @param key The key of the association to be inserted.
+    # @param value The value (of the key) of the association to be inserted.
+    # @post If key currently does not exist in the hash table, the key, value pair will
+    #   be inserted into the hash table. If it already exists, its value will be updated.
+    def associate(self, key, value):
+        keyHash = hash(key)
+        index, found = self.__findSlot(key, keyHash)
+        if found:
+            self.__values[index] = value
+            return
+        self.__keys[index]   = key
+        self.__values[index] = value
+        self.__hashes[index] = keyHash
+        self.__size += 1
+        if self.__size > self.__capacity * self.__maxLoadFactor:
+            self.__resize(self.__capacity * 2)
+
+    # Makes room for a number of associations so that inserting them does not resize.
+    # @param n The number of associations the hash table should hold.
+    # @post The capacity is the smallest power of two keeping the load factor of n
+    #   associations within the maximum, the table is resized at most once.
+    def reserve(self, n):
+        newCapacity = self.__capacity
+        while n > newCapacity * self.__maxLoadFactor:
+            newCapacity *= 2
+        if newCapacity != self.__capacity:
+            self.__resize(newCapacity)
+
+    # Builds a hash table from key, value pairs, sizing it once for all of them.
+    # @param items An iterable of key, value pairs (later pairs win on duplicate keys).
+    # @param maxLoadFactor The maximum load factor of the new hash table.
+    # @return A new OpenAddressingHashMap holding all associations.
+    @classmethod
+    def fromItems(cls, items, maxLoadFactor = 0.5):
+        items = list(items)
+        hashmap = cls(maxLoadFactor)
+        hashmap.reserve(len(items))
+        for key, value in items:
+            hashmap.associate(key, value)
+        return hashmap
+
+    # Finds the value of a key.
+    # @param key The key whose value is to be returned.
+    # @return None if key is not found, else its value.
+    def find(self, key):
+        index, found = self.__findSlot(key, hash(key))
+        return self.__values[index] if found else None
+
+    # Iterates over all key, value pairs (in slot order).
+    def items(self):
+        keys   = self.__keys
+        values = self.__values
+        for index, keyHash in enumerate(self.__hashes):
+            if keyHash is not None:
+                yield keys[index], values[index]
+
+    # A private function that walks the probe sequence of a key.
+    # @param key The key to look for.
+    # @param keyHash The (precomputed) hash of the key.
+    # @return A pair of the slot index and whether the key was found there. If the key
+    #   was not found, the index is the first empty slot of its probe sequence.
+    def __findSlot(self, key, keyHash):
+        hashes  = self.__hashes
+        keys    = self.__keys
+        mask    = self.__capacity - 1
+        perturb = keyHash & HASH_MASK
+        index   = perturb & mask
+        while True:
+            slotHash = hashes[index]
+            if slotHash is None:
+                return index, False
+            if slotHash == keyHash:
+                slotKey = keys[index]
+                if slotKey is key or slotKey == key:
+                    return index, True
+            perturb >>= PERTURB_SHIFT
+            index = (5 * index + 1 + perturb) & mask
+
+    # A private function that moves every association into a table of a new capacity.
+    # @param newCapacity The new capacity (must be a power of two greater than the size).
+    # @post Every association is placed by its stored hash, no key is hashed again.
+    def __resize(self, newCapacity):
+        oldKeys   = self.__keys
+        oldValues = self.__values
+        oldHashes = self.__hashes
+
+        self.__capacity = newCapacity
+        self.__keys     = keys   = [None] * newCapacity
+        self.__values   = values = [None] * newCapacity
+        self.__hashes   = hashes = [None] * newCapacity
+
+        mask = newCapacity - 1
+        for oldIndex, keyHash in enumerate(oldHashes):
+            if keyHash is None:
+                continue
+            # keys are known to be distinct, so only an empty slot has to be found
+            perturb = keyHash & HASH_MASK
+            index   = perturb & mask
+            while hashes[index] is not None:
+                perturb >>= PERTURB_SHIFT
+                index = (5 * index + 1 + perturb) & mask
+            keys[index]   = oldKeys[oldIndex]
+            values[index] = oldValues[oldIndex]
+            hashes[index] = keyHash
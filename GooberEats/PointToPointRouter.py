@@ -1,11 +1,72 @@
-from ExpandableHashMap import *
+import threading
+from collections import OrderedDict
+from enum import Enum
 from heapq import *
+from ContractionHierarchy import ContractionHierarchy
+from StreetMap import MapChange, LENGTH_ROUNDING
 from provided import *
 
+INFINITY = float('inf')
+
+# Scales the A* heuristic below the great-circle distance by more than the rounding a
+# segment length may have (see StreetMap.reweightSegments), so that it can never
+# overestimate a road distance.
+HEURISTIC_SCALE = 1 - 2 * LENGTH_ROUNDING
+
+class RoutingMode(Enum):
+    DIJKSTRA      = 0
+    ASTAR         = 1
+    BIDIRECTIONAL = 2
+    CONTRACTION_HIERARCHIES = 3
+    COLLAPSED_CHAINS        = 4
+
 class PointToPointRouter:
     # the streetmap argument must contain loaded map data.
-    def __init__(self, streetmap):
+    # @param mode The search algorithm used by this router (Dijkstra unless specified).
+    # @param hierarchy A preprocessed ContractionHierarchy of the map for the
+    #   CONTRACTION_HIERARCHIES mode. If None it is preprocessed on the first query. After
+    #   the map changes, queries run Dijkstra while a background thread updates it (for
+    #   changed lengths) or preprocesses a new one (for new map data or added segments).
+    # @param cacheSize The number of routes kept in a least recently used cache (0 disables it).
+    def __init__(self, streetmap, mode = RoutingMode.DIJKSTRA, hierarchy = None, cacheSize = 0):
         self.__map = streetmap
+        self.__mode = mode
+        self.__hierarchy = hierarchy
+        self.__refresh = None     # the thread bringing the hierarchy up to date, if any
+        self.__settled = 0
+
+        # (source id, target id) -> (result, distance, tuple of StreetSegments), oldest first
+        self.__cache = OrderedDict()
+        self.__cacheSize = cacheSize
+        self.__cacheVersion = streetmap.version()
+        self.__hits = 0
+        self.__misses = 0
+
+    # returns the search algorithm used by this router
+    def mode(self):
+        return self.__mode
+
+    # returns the number of nodes settled by the last search (0 if no search was needed)
+    def settledNodeCount(self):
+        return self.__settled
+
+    # Waits for the contraction hierarchy being brought up to date in the background
+    # (after the map changed) to be ready, e.g. before timing queries.
+    def waitForHierarchy(self):
+        refresh = self.__refresh
+        if refresh is not None:
+            refresh.join()
+
+    # returns a tuple of the number of cache hits, cache misses and cached routes
+    def cacheStats(self):
+        return self.__hits, self.__misses, len(self.__cache)
+
+    # Empties the route cache and resets its counters.
+    def clearCache(self):
+        self.__cache.clear()
+        self.__cacheVersion = self.__map.version()
+        self.__hits = 0
+        self.__misses = 0
 
     # Generates a route from the starting coordinate to the ending coordinate.
     # @param start The starting geospatial coordinate.
@@ -15,58 +76,385 @@ class PointToPointRouter:
     #  *If either geospatial coordinate is bad, will return (BAD_COORD, -1)
     # @post If there exists a path between the start and end geospatial coordinate,
     #  the current contents of 'route' will be cleared and populated with the new route.
+    #  Routes served from the cache are copied out, so changing 'route' never changes the cache.
     def generatePointToPointRoute(self, start, end, route):
+        self.__settled = 0
+        source = self.__map.nodeId(start)
+        target = self.__map.nodeId(end)
 
-        connectionsWithStart = []
-        connectionsWithEnd   = []
-        self.__map.getSegmentsThatStartWith(start, connectionsWithStart)
-        self.__map.getSegmentsThatStartWith(end, connectionsWithEnd)
-
-        if len(connectionsWithStart) == 0 or len(connectionsWithEnd) == 0:
+        if source is None or target is None:
             return DeliveryResult.BAD_COORD, -1
-        elif start == end:
+        elif source == target:
             route.clear()
             return DeliveryResult.DELIVERY_SUCCESS, 0
+        elif self.__cacheSize <= 0:
+            return self.__route(source, target, route)
+
+        if self.__cacheVersion != self.__map.version():
+            self.__refreshCache()
+        cached = self.__cache.get((source, target))
+        if cached is not None:
+            self.__hits += 1
+            self.__cache.move_to_end((source, target))
+            result, distance, segments = cached
+        else:
+            self.__misses += 1
+            segments = []
+            result, distance = self.__route(source, target, segments)
+            segments = tuple(segments)
+            self.__cache[(source, target)] = (result, distance, segments)
+            if len(self.__cache) > self.__cacheSize:
+                self.__cache.popitem(last = False)
+        if result == DeliveryResult.DELIVERY_SUCCESS:
+            route[:] = segments
+        return result, distance
+
+    # Generates a route as edges of the map rather than StreetSegments, which is much
+    # cheaper to send between processes (StreetMap.edgeSegment turns it into segments).
+    # The cache is not used.
+    # @param start The starting geospatial coordinate.
+    # @param end The ending geospatial coordinate location.
+    # @return A tuple of the delivery result, the distance of the route and a list of
+    #   (node id, edge id) pairs from start to end (empty unless there is a route).
+    def generateEdgeRoute(self, start, end):
+        self.__settled = 0
+        source = self.__map.nodeId(start)
+        target = self.__map.nodeId(end)
+
+        if source is None or target is None:
+            return DeliveryResult.BAD_COORD, -1, []
+        elif source == target:
+            return DeliveryResult.DELIVERY_SUCCESS, 0, []
+        distance, prev = self.__search(source, target)
+        if prev is None:
+            return DeliveryResult.NO_ROUTE, -1, []
+        return DeliveryResult.DELIVERY_SUCCESS, distance, self.__routeEdges(prev, target)
+
+    # A private function that brings the route cache up to the current map version. If
+    # the map only changed by segments getting longer (or closed), every other cached
+    # route is still a shortest route, so only the routes over those segments are
+    # dropped; any other change empties the cache.
+    def __refreshCache(self):
+        changes = self.__map.changesSince(self.__cacheVersion)
+        self.__cacheVersion = self.__map.version()
+        if changes is None:
+            self.__cache.clear()
+            return
+        _, targets, _ = self.__map.adjacency()
+        longer = set()
+        for _, kind, details in changes:
+            if kind != MapChange.REWEIGHT or any(new < old for _, _, old, new in details):
+                self.__cache.clear()
+                return
+            for nodeId, edge, _, _ in details:
+                longer.add((self.__map.nodeGeoCoord(nodeId), self.__map.nodeGeoCoord(targets[edge])))
+        for key, (_, _, segments) in list(self.__cache.items()):
+            if any((segment.start, segment.end) in longer for segment in segments):
+                del self.__cache[key]
+
+    # A private function that searches for a route between two different nodes.
+    # @return The same as generatePointToPointRoute.
+    def __route(self, source, target, route):
+        distance, prev = self.__search(source, target)
+        if prev is None:
+            return DeliveryResult.NO_ROUTE, -1
+        self.__buildRoute(prev, target, route)
+        return DeliveryResult.DELIVERY_SUCCESS, distance
+
+    # A private function that runs the search of the routing mode.
+    # @return The same as __dijkstra.
+    def __search(self, source, target):
+        if self.__mode == RoutingMode.ASTAR:
+            return self.__astar(source, target)
+        elif self.__mode == RoutingMode.BIDIRECTIONAL:
+            return self.__bidirectional(source, target)
+        elif self.__mode == RoutingMode.CONTRACTION_HIERARCHIES:
+            return self.__contractionHierarchies(source, target)
+        elif self.__mode == RoutingMode.COLLAPSED_CHAINS:
+            return self.__collapsedChains(source, target)
+        return self.__dijkstra(source, target)
+
+    # Computes the road distances from every source to every target, with one Dijkstra
+    # search per source that stops once all of the targets are settled.
+    # @param sources A list of geospatial coordinates the routes start at.
+    # @param targets A list of geospatial coordinates the routes end at.
+    # @param returnTrees Whether to also return the predecessor trees of the searches.
+    # @return A list of rows, matrix[i][j] being the distance from sources[i] to
+    #   targets[j] (-1 if either coordinate is bad or there is no route). If returnTrees,
+    #   a tuple of the matrix and a list of trees, one per source (None for a bad
+    #   coordinate), for generateRouteFromTree.
+    def distanceMatrix(self, sources, targets, returnTrees = False):
+        self.__settled = 0
+        targetIds = [self.__map.nodeId(gc) for gc in targets]
+        matrix = []
+        trees  = []
+        for start in sources:
+            source = self.__map.nodeId(start)
+            if source is None:
+                matrix.append([-1] * len(targets))
+                trees.append(None)
+                continue
+            dist, prev = self.__multiTargetDijkstra(source, targetIds)
+            matrix.append([dist.get(t, -1) if t is not None else -1 for t in targetIds])
+            trees.append(prev)
+        if returnTrees:
+            return matrix, trees
+        return matrix
+
+    # Extracts a route from a predecessor tree returned by distanceMatrix.
+    # @param tree The tree of the source the route starts at.
+    # @param end The ending geospatial coordinate (one of the targets of the matrix).
+    # @param route A list of connected street segments forming the route.
+    # @return The delivery result (BAD_COORD if the tree is None or end is bad,
+    #   NO_ROUTE if the search did not reach end).
+    # @post If there exists a path, 'route' will be cleared and populated with it.
+    def generateRouteFromTree(self, tree, end, route):
+        target = self.__map.nodeId(end)
+        if tree is None or target is None:
+            return DeliveryResult.BAD_COORD
+        if target not in tree:
+            return DeliveryResult.NO_ROUTE
+        self.__buildRoute(tree, target, route)
+        return DeliveryResult.DELIVERY_SUCCESS
+
+    # A private function that runs Dijkstra on the integer graph of the map: nodes are
+    # ids, the edges of u are offsets[u] .. offsets[u+1]-1 and their lengths are precomputed.
+    # @return A tuple of the distance to the target and the predecessor mapping of the
+    #   search (node -> (previous node, edge taken from it)), or (-1, None) if unreachable.
+    def __dijkstra(self, source, target):
+        offsets, targets, weights = self.__map.adjacency()
+        dist = {source: 0}
+        prev = {source: None}
+
+        # maintain a priority queue of elements (distance, node)
+        pq = [(0, source)]
+        while len(pq) > 0:
+            distance, u = heappop(pq)
+            if distance > dist[u]:
+                continue
+            self.__settled += 1
+            if u == target:
+                return distance, prev
+
+            for edge in range(offsets[u], offsets[u+1]):
+                v = targets[edge]
+                tentative_dist = distance + weights[edge]
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    prev[v] = (u, edge)
+                    heappush(pq, (tentative_dist, v))
+
+        return -1, None
 
-        dist = ExpandableHashMap()
-        dist[start] = 0
+    # A private function that runs Dijkstra from the source until every target is settled.
+    # @param targetIds The node ids of the targets (None entries are ignored).
+    # @return A tuple of the distance and predecessor mappings of the search, restricted
+    #   to the nodes it settled or reached; targets missing from them are unreachable.
+    def __multiTargetDijkstra(self, source, targetIds):
+        offsets, targets, weights = self.__map.adjacency()
+        remaining = set(t for t in targetIds if t is not None)
+        dist = {source: 0}
+        prev = {source: None}
 
-        prev = ExpandableHashMap()
-        prev[start] = None
+        pq = [(0, source)]
+        while len(pq) > 0 and len(remaining) > 0:
+            distance, u = heappop(pq)
+            if distance > dist[u]:
+                continue
+            self.__settled += 1
+            remaining.discard(u)
+
+            for edge in range(offsets[u], offsets[u+1]):
+                v = targets[edge]
+                tentative_dist = distance + weights[edge]
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    prev[v] = (u, edge)
+                    heappush(pq, (tentative_dist, v))
 
-        # maintain a priority queue of elements (distance, StreetSegment)
-        pq = []        
-        heappush(pq, (0, StreetSegment(None, start, '')) )
+        return dist, prev
 
+    # A private function that runs A* towards the target. Every edge is at least as long
+    # as the great-circle distance between its ends (StreetMap refuses live changes that
+    # would make one shorter), so the (scaled) great-circle distance to the target never
+    # overestimates and the search settles the target with the same distance as
+    # Dijkstra, while expanding mostly towards it.
+    # @return The same as __dijkstra.
+    def __astar(self, source, target):
+        offsets, targets, weights = self.__map.adjacency()
+        latitudes, longitudes = self.__map.coordinates()
+
+        # haversine (as in distanceEarthKM) against a fixed destination
+        milesPerRadian = 2.0 * 6371.0 / 1.609344 * HEURISTIC_SCALE
+        lat2r = math.radians(latitudes[target])
+        lon2r = math.radians(longitudes[target])
+        cosLat2 = math.cos(lat2r)
+        heuristics = {}
+        def heuristic(v):
+            h = heuristics.get(v)
+            if h is None:
+                lat1r = math.radians(latitudes[v])
+                u = math.sin((lat2r - lat1r) / 2)
+                w = math.sin((lon2r - math.radians(longitudes[v])) / 2)
+                h = heuristics[v] = milesPerRadian * math.asin(\
+                    math.sqrt(u*u + math.cos(lat1r) * cosLat2 * w*w))
+            return h
+
+        dist = {source: 0}
+        prev = {source: None}
+
+        # maintain a priority queue of elements (estimated total distance, distance, node)
+        pq = [(heuristic(source), 0, source)]
         while len(pq) > 0:
-            distance, street = heappop(pq)
-            u = street.end
+            _, distance, u = heappop(pq)
+            if distance > dist[u]:
+                continue
+            self.__settled += 1
+            if u == target:
+                return distance, prev
+
+            for edge in range(offsets[u], offsets[u+1]):
+                v = targets[edge]
+                tentative_dist = distance + weights[edge]
+                if tentative_dist < dist.get(v, INFINITY):
+                    dist[v] = tentative_dist
+                    prev[v] = (u, edge)
+                    heappush(pq, (tentative_dist + heuristic(v), tentative_dist, v))
 
-            if (dist[u] != distance):
+        return -1, None
+
+    # A private function that runs Dijkstra forwards from the source and backwards from
+    # the target at the same time, always expanding the side whose queue is closer.
+    # Every time an edge reaches a node the other side has seen, the two half paths form
+    # a candidate route; once the two queue minimums add up to at least the best
+    # candidate, no shorter route can exist and the searches stop.
+    # @return The same as __dijkstra.
+    def __bidirectional(self, source, target):
+        offsets, targets, weights = self.__map.adjacency()
+        distF = {source: 0}
+        distB = {target: 0}
+        prevF = {source: None}  # node -> (previous node, edge taken from it)
+        nextB = {target: None}  # node -> (next node towards the target, edge from it back to node)
+        pqF = [(0, source)]
+        pqB = [(0, target)]
+        best = INFINITY
+        meeting = None
+
+        while len(pqF) > 0 and len(pqB) > 0:
+            if pqF[0][0] + pqB[0][0] >= best:
+                break
+            if pqF[0][0] <= pqB[0][0]:
+                pq, dist, prev, otherDist = pqF, distF, prevF, distB
+            else:
+                pq, dist, prev, otherDist = pqB, distB, nextB, distF
+
+            distance, u = heappop(pq)
+            if distance > dist[u]:
                 continue
-            
-            if prev[end] is not None:
-                route.clear()
-                street = prev[end]
-                while street is not None:
-                    route[:0] = [street]
-                    street = prev[street.start]
-                return DeliveryResult.DELIVERY_SUCCESS, dist[end]
-                    
-            neighbors = []
-            self.__map.getSegmentsThatStartWith(u, neighbors)
-            for neighbor in neighbors:
-                v = neighbor.end
-                if dist[u] is None:
-                    dist[u] = float('inf')
-                if dist[v] is None:
-                    dist[v] = float('inf')
-
-                tentative_dist = dist[u] + distanceEarthMiles(u, v)
-                
-                if tentative_dist < dist[v]:
+            self.__settled += 1
+
+            for edge in range(offsets[u], offsets[u+1]):
+                v = targets[edge]
+                tentative_dist = distance + weights[edge]
+                if tentative_dist < dist.get(v, INFINITY):
                     dist[v] = tentative_dist
-                    prev[v] = neighbor
-                    heappush(pq, [tentative_dist, neighbor])
+                    prev[v] = (u, edge)
+                    heappush(pq, (tentative_dist, v))
+                    other = otherDist.get(v)
+                    if other is not None and tentative_dist + other < best:
+                        best = tentative_dist + other
+                        meeting = v
+
+        if meeting is None:
+            return -1, None
+
+        # continue the forward predecessors along the backward half, turning its edges around
+        node = meeting
+        while nextB[node] is not None:
+            nextNode, edge = nextB[node]
+            prevF[nextNode] = (node, self.__map.reverseEdge(nextNode, edge))
+            node = nextNode
+
+        # add the edges up from the start, so the distance is exactly routeDistance(route)
+        edges = []
+        step = prevF[target]
+        while step is not None:
+            edges.append(step[1])
+            step = prevF[step[0]]
+        distance = 0
+        for edge in reversed(edges):
+            distance += weights[edge]
+        return distance, prevF
+
+    # A private function that answers a query with the contraction hierarchy of the map.
+    # @return The same as __dijkstra.
+    def __contractionHierarchies(self, source, target):
+        if self.__hierarchy is None:
+            self.__hierarchy = ContractionHierarchy(self.__map)
+            self.__hierarchy.preprocess()
+        elif (self.__refresh is not None and self.__refresh.is_alive()) or \
+                not self.__hierarchy.isCurrent():
+            self.__refreshHierarchy()
+            return self.__dijkstra(source, target)
+        hierarchy = self.__hierarchy
+        edges = hierarchy.query(source, target)
+        self.__settled = hierarchy.settledNodeCount()
+        if edges is None:
+            return -1, None
+        return self.__edgePath(source, edges)
+
+    # A private function that brings the hierarchy up to date with the map on a
+    # background thread, unless that is running already: it is updated for changed
+    # lengths, or a new one is preprocessed and swapped in.
+    def __refreshHierarchy(self):
+        if self.__refresh is not None and self.__refresh.is_alive():
+            return
+        def refresh():
+            if not self.__hierarchy.update():
+                hierarchy = ContractionHierarchy(self.__map)
+                hierarchy.preprocess()
+                self.__hierarchy = hierarchy
+        self.__refresh = threading.Thread(target = refresh, daemon = True)
+        self.__refresh.start()
+
+    # A private function that runs Dijkstra on the map's ChainGraph, which only settles
+    # the nodes that are not in the middle of a chain of degree-2 nodes.
+    # @return The same as __dijkstra.
+    def __collapsedChains(self, source, target):
+        chainGraph = self.__map.chainGraph()
+        edges = chainGraph.query(source, target)
+        self.__settled = chainGraph.settledNodeCount()
+        if edges is None:
+            return -1, None
+        return self.__edgePath(source, edges)
+
+    # A private function that turns the edges of a route into the result of a search.
+    # @param edges A list of (node id, edge id) pairs from source to the target.
+    # @return A tuple of the distance, added up from the start so that it is exactly
+    #   routeDistance of the route, and a predecessor mapping along the route.
+    def __edgePath(self, source, edges):
+        _, targets, weights = self.__map.adjacency()
+        prev = {source: None}
+        distance = 0
+        for u, edge in edges:
+            prev[targets[edge]] = (u, edge)
+            distance += weights[edge]
+        return distance, prev
+
+    # A private function that turns the predecessor edges of a search into a route.
+    # @param prev A mapping of node id to (previous node id, edge id), None for the start.
+    # @param target The node id the route ends at.
+    # @param route The list to be populated with the StreetSegments from start to target.
+    def __buildRoute(self, prev, target, route):
+        route[:] = [self.__map.edgeSegment(u, edge) for u, edge in self.__routeEdges(prev, target)]
 
-        return DeliveryResult.NO_ROUTE, -1
+    # A private function that follows the predecessor edges of a search back from the target.
+    # @return A list of (node id, edge id) pairs from the start of the search to target.
+    def __routeEdges(self, prev, target):
+        edges = []
+        step = prev[target]
+        while step is not None:
+            edges.append(step)
+            step = prev[step[0]]
+        edges.reverse()
+        return edges
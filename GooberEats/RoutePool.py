@@ -0,0 +1,123 @@
+"""
+Routes many independent legs on a pool of worker processes.
+
+The workers never receive the map in a task. Where processes are forked (Linux) they
+inherit the parent's router, map and all, copy-on-write; otherwise a map loaded with
+StreetMap.loadCompiled is memory-mapped again by every worker. Either way the workers
+hold the map as it was when they started, so they are restarted on the next legs once
+the map changes (see StreetMap.version); a changed map is no longer the compiled file,
+so without fork the legs are then routed in this process. Only coordinates go to the
+workers and only edge ids come back, which the parent turns into the StreetSegments of
+its own map.
+"""
+import multiprocessing
+
+from PointToPointRouter import *
+from StreetMap import StreetMap
+
+# the router the next forked pool inherits, and the router of a worker process
+inheritedRouter = None
+workerRouter    = None
+
+# Sets up a worker process.
+# @param compiledFile The compiled map to load, or None to use the inherited router.
+# @param mode The routing mode of a router built from the compiled map.
+def initWorker(compiledFile, mode):
+    global workerRouter
+    if compiledFile is None:
+        workerRouter = inheritedRouter
+    else:
+        streetmap = StreetMap()
+        streetmap.loadCompiled(compiledFile)
+        workerRouter = PointToPointRouter(streetmap, mode)
+
+# Routes one leg in a worker process.
+# @param leg A tuple of the start and end geospatial coordinates.
+# @return The tuple returned by PointToPointRouter.generateEdgeRoute.
+def routeLeg(leg):
+    return workerRouter.generateEdgeRoute(leg[0], leg[1])
+
+class RoutePool:
+
+    # @param streetmap The StreetMap (with loaded map data) to route on.
+    # @param processes The number of worker processes (legs are routed in this process
+    #   if it is less than 2, or if the map can neither be forked nor memory-mapped).
+    # @param mode The routing mode of the workers.
+    # @param hierarchy A preprocessed ContractionHierarchy of the map, for forked workers.
+    def __init__(self, streetmap, processes, mode = RoutingMode.DIJKSTRA, hierarchy = None):
+        self.__map       = streetmap
+        self.__router    = PointToPointRouter(streetmap, mode, hierarchy)
+        self.__mode      = mode
+        self.__processes = processes
+        self.__pool      = None
+        self.__poolVersion = None   # the map version the workers were started with
+
+    # returns the number of worker processes the legs are routed on (0 if routed serially)
+    def processCount(self):
+        return self.__processes if self.__canShareMap() else 0
+
+    # Routes legs in parallel.
+    # @param legs A list of (start, end) geospatial coordinate tuples.
+    # @return A list with a tuple of (delivery result, distance, route) for every leg,
+    #   in the order of legs, each route being a list of StreetSegments as returned by
+    #   PointToPointRouter.generatePointToPointRoute.
+    def routeLegs(self, legs):
+        self.__checkVersion()
+        if self.processCount() < 2 or len(legs) < 2:
+            results = [self.__router.generateEdgeRoute(start, end) for start, end in legs]
+        else:
+            chunksize = max(1, len(legs) // (self.__processes * 4))
+            results = self.__workers().map(routeLeg, legs, chunksize)
+        return [(result, distance, [self.__map.edgeSegment(u, edge) for u, edge in edges])
+                for result, distance, edges in results]
+
+    # Routes legs in parallel, handing each leg back as soon as it and the legs before it
+    # are routed.
+    # @param legs A list of (start, end) geospatial coordinate tuples.
+    # @return A generator of the tuples routeLegs returns, in the order of legs.
+    def iterRouteLegs(self, legs):
+        self.__checkVersion()
+        if self.processCount() < 2 or len(legs) < 2:
+            results = (self.__router.generateEdgeRoute(start, end) for start, end in legs)
+        else:
+            results = self.__workers().imap(routeLeg, legs)
+        for result, distance, edges in results:
+            yield result, distance, [self.__map.edgeSegment(u, edge) for u, edge in edges]
+
+    # Stops the worker processes.
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # A private function that stops workers started with an older version of the map, so
+    # that the next legs start new ones.
+    def __checkVersion(self):
+        if self.__pool is not None and self.__poolVersion != self.__map.version():
+            self.close()
+
+    # A private function that checks whether the workers can get the map without pickling.
+    def __canShareMap(self):
+        return 'fork' in multiprocessing.get_all_start_methods() or \
+            self.__map.compiledFile() is not None
+
+    # A private function that starts the worker processes the first time they are needed.
+    def __workers(self):
+        global inheritedRouter
+        if self.__pool is None:
+            self.__poolVersion = self.__map.version()
+            if 'fork' in multiprocessing.get_all_start_methods():
+                inheritedRouter = self.__router
+                self.__pool = multiprocessing.get_context('fork').Pool(
+                    self.__processes, initWorker, (None, self.__mode))
+            else:
+                self.__pool = multiprocessing.Pool(self.__processes, initWorker,
+                    (self.__map.compiledFile(), self.__mode))
+        return self.__pool
@@ -0,0 +1,321 @@
+"""
+A long-running routing and planning service that keeps one map loaded.
+
+Clients connect to a local TCP socket and send one JSON object per line; every
+request gets one JSON line back (responses to pipelined requests may arrive out of
+order, so requests carry an "id" that is echoed back). Request types:
+
+    {"id": 1, "type": "route", "start": ["34.0625329", "-118.4470263"],
+                               "end":   ["34.0712323", "-118.4505969"]}
+    {"id": 2, "type": "matrix", "sources": [[lat, lon], ...], "targets": [[lat, lon], ...]}
+    {"id": 3, "type": "plan", "depot": [lat, lon],
+                              "deliveries": [{"item": "pho", "location": [lat, lon]}, ...]}
+    {"id": 4, "type": "stats"}
+
+Route requests that arrive within a short window of each other are coalesced: the
+whole batch is answered with one multi-target search per distinct start
+(PointToPointRouter.distanceMatrix) and the routes are read off the search trees.
+Searches run on a pool of worker processes so the event loop keeps accepting requests
+and several batches are searched at once. Where processes are forked (Linux) every
+worker inherits the map copy-on-write and builds its own router; elsewhere the workers
+are threads with a router each. The workers are restarted when the map changes (see
+StreetMap.version). Plans run one at a time on a thread of their own, and their planner
+routes the legs of a plan on a RoutePool of the same number of processes. Every
+response reports its latency in milliseconds, from the request being read to the
+response being ready.
+
+Start it with
+    python RoutingService.py mapdata.txt [port]
+(a file compiled by MapCompiler, ending in .gmap, is memory-mapped instead).
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from DeliveryPlanner import DeliveryPlanner
+from PointToPointRouter import PointToPointRouter
+from StreetMap import StreetMap
+from provided import *
+
+COALESCE_WINDOW = 0.005     # seconds route requests wait for others to share a batch
+DEFAULT_PORT    = 8765
+
+# the router of a worker process or thread
+worker = threading.local()
+
+# Sets up a worker.
+# @param streetmap The map to route on (inherited, not pickled, by forked processes).
+# @param forked Whether the worker is a forked process, which closes the sockets it
+#   inherited so that connections the service closes do not stay open in it.
+def initWorker(streetmap, forked):
+    worker.router = PointToPointRouter(streetmap)
+    if forked and os.path.isdir('/proc/self/fd'):
+        for fd in os.listdir('/proc/self/fd'):
+            try:
+                if stat.S_ISSOCK(os.fstat(int(fd)).st_mode):
+                    os.close(int(fd))
+            except OSError:     # the descriptor of the listing itself
+                pass
+
+# Runs a search on a worker.
+# @param function A function taking the worker's router and then args.
+# @return What the function returns.
+def runOnWorker(function, *args):
+    return function(worker.router, *args)
+
+# Routes a batch of (start, end) pairs with one multi-target search per distinct start.
+# @param router The PointToPointRouter to search with.
+# @return A list of route responses, in the order of pairs.
+def routeBatch(router, pairs):
+    sources = list(dict.fromkeys(start for start, _ in pairs))
+    targets = list(dict.fromkeys(end for _, end in pairs))
+    sourceIndex = {gc: i for i, gc in enumerate(sources)}
+    targetIndex = {gc: j for j, gc in enumerate(targets)}
+    matrix, trees = router.distanceMatrix(sources, targets, returnTrees = True)
+
+    responses = []
+    for start, end in pairs:
+        i, j = sourceIndex[start], targetIndex[end]
+        route = []
+        result = router.generateRouteFromTree(trees[i], end, route)
+        distance = matrix[i][j] if result == DeliveryResult.DELIVERY_SUCCESS else -1
+        responses.append({'result': result.name, 'distance': distance,
+                          'route': routeToJson(route)})
+    return responses
+
+# Computes a distance matrix.
+# @param router The PointToPointRouter to search with.
+# @return The matrix PointToPointRouter.distanceMatrix returns.
+def distanceMatrix(router, sources, targets):
+    return router.distanceMatrix(sources, targets)
+
+# Reads a coordinate of a request.
+# @param value A [latitude, longitude] pair of strings or numbers.
+# @return A GeoCoord.
+# @raises ValueError if the value is not a pair.
+def geoCoordFromJson(value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError('a coordinate must be a [latitude, longitude] pair')
+    return GeoCoord(str(value[0]), str(value[1]))
+
+# Writes a route of a response.
+# @return A list of [start latitude, start longitude, end latitude, end longitude, street name].
+def routeToJson(route):
+    return [[segment.start.latitudeText, segment.start.longitudeText,
+             segment.end.latitudeText, segment.end.longitudeText, segment.name]
+            for segment in route]
+
+class RoutingService:
+
+    # @param streetmap The StreetMap (with loaded map data) to answer requests on.
+    # @param window The number of seconds route requests are held to be batched together
+    #   (None routes every request on its own).
+    # @param processes The number of worker processes (threads where processes cannot
+    #   be forked) searches run on, and that plans route their legs on.
+    def __init__(self, streetmap, window = COALESCE_WINDOW, processes = os.cpu_count() or 1):
+        self.__map      = streetmap
+        self.__planner  = DeliveryPlanner(streetmap, processes)
+        self.__planning = ThreadPoolExecutor(1)     # the planner is not thread safe
+        self.__window   = window
+        self.__processes = processes
+        self.__executor = None
+        self.__executorVersion = None   # the map version the workers were started with
+        self.__server   = None
+        self.__pending  = []    # (start, end, future) of route requests waiting for a batch
+        self.__batches  = 0
+        self.__latencies = []
+
+    # Starts accepting connections.
+    # @param host The address to listen on (local only by default).
+    # @param port The port to listen on (0 picks a free port).
+    # @return The port the service listens on.
+    async def start(self, host = '127.0.0.1', port = 0):
+        # the workers start before the socket is open, so forked ones do not inherit it
+        await asyncio.get_running_loop().run_in_executor(self.__workers(), os.getpid)
+        self.__server = await asyncio.start_server(self.__client, host, port)
+        return self.__server.sockets[0].getsockname()[1]
+
+    # Serves connections until the service is closed.
+    async def serveForever(self):
+        async with self.__server:
+            await self.__server.serve_forever()
+
+    # Stops accepting connections and shuts the workers down.
+    async def close(self):
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+        if self.__executor is not None:
+            self.__executor.shutdown(wait = False)
+            self.__executor = None
+        self.__planning.shutdown(wait = False)
+        self.__planner.close()
+
+    # Answers a request.
+    # @param request A request object as described at the top of this module.
+    # @return The response object, with the id of the request and the latency in ms.
+    async def handle(self, request):
+        begin = time.perf_counter()
+        try:
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+            requestType = request.get('type')
+            if requestType == 'route':
+                response = await self.__route(geoCoordFromJson(request.get('start')),
+                                              geoCoordFromJson(request.get('end')))
+            elif requestType == 'matrix':
+                response = await self.__matrix([geoCoordFromJson(gc) for gc in request.get('sources', [])],
+                                               [geoCoordFromJson(gc) for gc in request.get('targets', [])])
+            elif requestType == 'plan':
+                response = await self.__plan(geoCoordFromJson(request.get('depot')),
+                    [DeliveryRequest(str(delivery['item']), geoCoordFromJson(delivery['location']))
+                     for delivery in request.get('deliveries', [])])
+            elif requestType == 'stats':
+                response = self.stats()
+            else:
+                raise ValueError('unknown request type: {0}'.format(requestType))
+        except Exception as error:
+            response = {'error': str(error) or type(error).__name__}
+
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        latency = (time.perf_counter() - begin) * 1000
+        self.__latencies.append(latency)
+        response['latencyMs'] = latency
+        return response
+
+    # Reports the requests answered so far.
+    # @return An object with the number of requests, the number of route batches and the
+    #   mean, median and 95th percentile latency in ms.
+    def stats(self):
+        latencies = sorted(self.__latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0
+        return {'requests': len(latencies), 'routeBatches': self.__batches,
+                'meanMs': sum(latencies) / len(latencies) if latencies else 0,
+                'p50Ms': percentile(0.5), 'p95Ms': percentile(0.95)}
+
+    # A private function that serves one connection.
+    async def __client(self, reader, writer):
+        tasks = set()
+        async def respond(line):
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                response = {'error': 'bad JSON: {0}'.format(error)}
+            else:
+                response = await self.handle(request)
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # A private function that queues a route request for the next batch.
+    async def __route(self, start, end):
+        future = asyncio.get_running_loop().create_future()
+        self.__pending.append((start, end, future))
+        if self.__window is None:
+            self.__flush()
+        elif len(self.__pending) == 1:
+            asyncio.get_running_loop().call_later(self.__window, self.__flush)
+        return await future
+
+    # A private function that answers the queued route requests in one batch.
+    def __flush(self):
+        pending = self.__pending
+        self.__pending = []
+        self.__batches += 1
+        async def run():
+            try:
+                responses = await self.__search(routeBatch, [(start, end) for start, end, _ in pending])
+            except Exception as error:
+                responses = [{'error': str(error)}] * len(pending)
+            for (_, _, future), response in zip(pending, responses):
+                if not future.done():
+                    future.set_result(dict(response))
+        asyncio.ensure_future(run())
+
+    # A private function that runs a search on a worker.
+    # @param function A function taking a router and then args, as runOnWorker runs.
+    async def __search(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__workers(),
+            runOnWorker, function, *args)
+
+    # A private function that starts the workers the first time they are needed, and again
+    # once the map has changed since they were started.
+    def __workers(self):
+        if self.__executor is not None and self.__executorVersion != self.__map.version():
+            self.__executor.shutdown(wait = False)
+            self.__executor = None
+        if self.__executor is None:
+            self.__executorVersion = self.__map.version()
+            if 'fork' in multiprocessing.get_all_start_methods():
+                self.__executor = ProcessPoolExecutor(self.__processes,
+                    multiprocessing.get_context('fork'), initWorker, (self.__map, True))
+            else:
+                self.__executor = ThreadPoolExecutor(self.__processes,
+                    initializer = initWorker, initargs = (self.__map, False))
+        return self.__executor
+
+    # A private function that computes a distance matrix on a worker.
+    async def __matrix(self, sources, targets):
+        return {'matrix': await self.__search(distanceMatrix, sources, targets)}
+
+    # A private function that generates a delivery plan on the planning thread.
+    async def __plan(self, depot, deliveries):
+        def plan():
+            commands = []
+            planResult = self.__planner.generateDeliveryPlan(depot, deliveries, commands)
+            return planResult, commands
+        (result, distance), commands = await asyncio.get_running_loop().run_in_executor(
+            self.__planning, plan)
+        return {'result': result.name, 'distance': distance,
+                'deliveries': [delivery.item for delivery in deliveries],
+                'commands': [command.description() for command in commands]}
+
+# Loads a map and serves it until interrupted.
+# @param mapFile A map data text file, or a compiled map ending in .gmap.
+# @param port The port to listen on.
+async def main(mapFile, port = DEFAULT_PORT):
+    streetmap = StreetMap()
+    begin = time.perf_counter()
+    if mapFile.endswith('.gmap'):
+        streetmap.loadCompiled(mapFile)
+    else:
+        streetmap.load(mapFile)
+    service = RoutingService(streetmap)
+    port = await service.start(port = port)
+    print('loaded {0} in {1:.2f} s, listening on 127.0.0.1:{2}'.format(
+        mapFile, time.perf_counter() - begin, port))
+    try:
+        await service.serveForever()
+    finally:
+        await service.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit('usage: python RoutingService.py <map file> [port]')
+    try:
+        asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_PORT))
+    except KeyboardInterrupt:
+        pass
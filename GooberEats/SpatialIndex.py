@@ -0,0 +1,235 @@
+"""
+A uniform latitude/longitude grid over the nodes and segments of a street map, for
+snapping coordinates that are not on the map (e.g. customer geocodes) to the nearest
+intersection or street.
+
+The cells are about square on the ground and hold NODES_PER_CELL nodes on average.
+Every cell lists, in CSR form like StreetGraph, the nodes inside it and the segments
+whose bounding boxes overlap it. A query looks at the cell of the coordinate and then
+at rings of cells around it until the next ring is farther away than the nearest hit
+so far, so it examines a handful of cells instead of the whole map.
+
+When segments are added to the map the grid keeps its cells; the nodes and segments in
+them are renumbered and the new ones inserted, without placing the others again.
+"""
+import math
+from array import array
+
+from provided import *
+
+NODES_PER_CELL   = 2
+MILES_PER_DEGREE = EARTH_DIAMETER_KM * math.pi / 360 * MILES_PER_KM
+INFINITY         = float('inf')
+
+class SpatialIndex:
+
+    # Builds the grid of a map.
+    # @param latitudes The latitudes of the nodes, by node id (as StreetMap.coordinates).
+    # @param longitudes The longitudes of the nodes, by node id.
+    # @param offsets The offsets array of the map (as StreetMap.adjacency).
+    # @param targets The targets array of the map.
+    def __init__(self, latitudes, longitudes, offsets, targets):
+        self.__latitudes  = latitudes
+        self.__longitudes = longitudes
+        self.__targets    = targets
+        self.__rows = self.__cols = 0
+        self.__nodeOffsets = self.__segmentOffsets = array('I', [0])
+        self.__nodes = self.__segments = self.__edgeStarts = array('I')
+        nodeCount = len(latitudes)
+        if nodeCount == 0:
+            return
+
+        self.__minLatitude  = min(latitudes)
+        self.__minLongitude = min(longitudes)
+        height = max(latitudes) - self.__minLatitude
+        width  = max(longitudes) - self.__minLongitude
+        cosLatitude = math.cos(math.radians(self.__minLatitude + height / 2))
+        # the side of a cell in degrees of latitude, at least 1/nodeCount of the longer
+        # side of the map so that a long thin map does not get more cells than nodes
+        side = max(math.sqrt(height * width * cosLatitude * NODES_PER_CELL / nodeCount),
+                   max(height, width * cosLatitude) / nodeCount, 1e-9)
+        self.__rows = int(height / side) + 1
+        self.__cols = int(width * cosLatitude / side) + 1
+        self.__cellHeight = side
+        self.__cellWidth  = side / cosLatitude if cosLatitude > 0 else 360.0
+        # no point of a cell two rings away is nearer than one cell, in miles (the
+        # width shrinks towards the poles, so take it at the map's highest latitude)
+        highest = max(abs(self.__minLatitude), abs(self.__minLatitude + height))
+        self.__cellMiles = 0.99 * MILES_PER_DEGREE * min(self.__cellHeight,
+            self.__cellWidth * math.cos(math.radians(min(highest, 89.9))))
+
+        nodeCells = [[] for _ in range(self.__rows * self.__cols)]
+        for node in range(nodeCount):
+            nodeCells[self.__cell(latitudes[node], longitudes[node])].append(node)
+
+        # every segment once, as the edge leaving its smaller node
+        segmentCells = [[] for _ in range(self.__rows * self.__cols)]
+        self.__edgeStarts = array('I', [0]) * len(targets)
+        for u in range(nodeCount):
+            for edge in range(offsets[u], offsets[u+1]):
+                self.__edgeStarts[edge] = u
+                v = targets[edge]
+                if u > v:
+                    continue
+                row1, col1 = self.__rowCol(latitudes[u], longitudes[u])
+                row2, col2 = self.__rowCol(latitudes[v], longitudes[v])
+                for row in range(min(row1, row2), max(row1, row2) + 1):
+                    for col in range(min(col1, col2), max(col1, col2) + 1):
+                        segmentCells[row * self.__cols + col].append(edge)
+
+        self.__nodeOffsets, self.__nodes = self.__compress(nodeCells)
+        self.__segmentOffsets, self.__segments = self.__compress(segmentCells)
+
+    # returns the (rows, columns) of the grid
+    def shape(self):
+        return self.__rows, self.__cols
+
+    # Adds the nodes and segments that StreetMap.addSegments put on the map. The grid
+    # keeps its cells: the items in them are renumbered and the new ones inserted, new
+    # nodes outside the grid going to its border cells (as queries outside it do).
+    # @param latitudes, longitudes, offsets, targets The arrays of the map after the change.
+    # @param nodeIds The new id of every node, by its id before the change.
+    # @param edgeIds The new id of every edge, by its id before the change.
+    # @param edges The (node id, edge id) pairs of the added segments, in both directions.
+    def addSegments(self, latitudes, longitudes, offsets, targets, nodeIds, edgeIds, edges):
+        if self.__rows == 0:
+            self.__init__(latitudes, longitudes, offsets, targets)
+            return
+        self.__latitudes  = latitudes
+        self.__longitudes = longitudes
+        self.__targets    = targets
+        self.__edgeStarts = array('I')
+        for u in range(len(latitudes)):
+            self.__edgeStarts.extend(array('I', [u]) * (offsets[u+1] - offsets[u]))
+
+        oldNodes = set(nodeIds)
+        nodeCells, segmentCells = {}, {}
+        for u, edge in edges:
+            if u not in oldNodes:
+                oldNodes.add(u)
+                nodeCells.setdefault(self.__cell(latitudes[u], longitudes[u]), []).append(u)
+            v = targets[edge]
+            if u > v:
+                continue
+            row1, col1 = self.__rowCol(latitudes[u], longitudes[u])
+            row2, col2 = self.__rowCol(latitudes[v], longitudes[v])
+            for row in range(min(row1, row2), max(row1, row2) + 1):
+                for col in range(min(col1, col2), max(col1, col2) + 1):
+                    segmentCells.setdefault(row * self.__cols + col, []).append(edge)
+
+        self.__nodeOffsets, self.__nodes = self.__insert(self.__nodeOffsets,
+            array('I', map(nodeIds.__getitem__, self.__nodes)), nodeCells)
+        self.__segmentOffsets, self.__segments = self.__insert(self.__segmentOffsets,
+            array('I', map(edgeIds.__getitem__, self.__segments)), segmentCells)
+
+    # Finds the node nearest to a coordinate.
+    # @param latitude The latitude in degrees.
+    # @param longitude The longitude in degrees.
+    # @return A tuple of the node id and its great-circle distance in miles, or None if
+    #   the map has no nodes.
+    def nearestNode(self, latitude, longitude):
+        latitudes, longitudes = self.__latitudes, self.__longitudes
+        sin, cos, sqrt, asin, radians = math.sin, math.cos, math.sqrt, math.asin, math.radians
+        lat1r = radians(latitude)
+        lon1r = radians(longitude)
+        cos1  = cos(lat1r)
+        # haversine (as in distanceEarthKM) against the fixed query coordinate
+        def distance(node):
+            lat2r = radians(latitudes[node])
+            u = sin((lat2r - lat1r) / 2)
+            v = sin((radians(longitudes[node]) - lon1r) / 2)
+            return EARTH_DIAMETER_KM * asin(sqrt(u*u + cos1 * cos(lat2r) * v*v)) * MILES_PER_KM
+        return self.__search(latitude, longitude, self.__nodeOffsets, self.__nodes, distance)
+
+    # Finds the segment nearest to a coordinate.
+    # @param latitude The latitude in degrees.
+    # @param longitude The longitude in degrees.
+    # @return A tuple of the node the segment starts at, the id of its edge from that node,
+    #   the distance in miles from the coordinate to the nearest point of the segment and
+    #   how far along the segment that point is (0 at the start, 1 at the end), or None if
+    #   the map has no segments. Distances are measured on a plane tangent at the
+    #   coordinate, which is exact to well under a foot over the length of a street.
+    def nearestSegment(self, latitude, longitude):
+        latitudes, longitudes, targets, starts = \
+            self.__latitudes, self.__longitudes, self.__targets, self.__edgeStarts
+        xScale = MILES_PER_DEGREE * math.cos(math.radians(latitude))
+        fractions = {}
+        def distance(edge):
+            u, v = starts[edge], targets[edge]
+            x1 = (longitudes[u] - longitude) * xScale
+            y1 = (latitudes[u] - latitude) * MILES_PER_DEGREE
+            dx = (longitudes[v] - longitude) * xScale - x1
+            dy = (latitudes[v] - latitude) * MILES_PER_DEGREE - y1
+            length = dx*dx + dy*dy
+            t = 0.0 if length == 0 else min(1.0, max(0.0, -(x1*dx + y1*dy) / length))
+            fractions[edge] = t
+            return math.hypot(x1 + t*dx, y1 + t*dy)
+        nearest = self.__search(latitude, longitude, self.__segmentOffsets, self.__segments, distance)
+        if nearest is None:
+            return None
+        edge, miles = nearest
+        return starts[edge], edge, miles, fractions[edge]
+
+    # A private function that searches the cells in rings around the cell of a coordinate.
+    # @param offsets, items The CSR lists of the items in every cell.
+    # @param distance A function giving the distance in miles from the coordinate to an item.
+    # @return A tuple of the nearest item and its distance, or None if there are no items.
+    def __search(self, latitude, longitude, offsets, items, distance):
+        if self.__rows == 0 or len(items) == 0:
+            return None
+        row0, col0 = self.__rowCol(latitude, longitude)
+        best, bestDistance = None, INFINITY
+        seen = set()
+        for ring in range(max(self.__rows, self.__cols)):
+            for row in range(max(0, row0 - ring), min(self.__rows, row0 + ring + 1)):
+                onEdge = row == row0 - ring or row == row0 + ring
+                for col in range(max(0, col0 - ring), min(self.__cols, col0 + ring + 1)):
+                    if not onEdge and col != col0 - ring and col != col0 + ring:
+                        continue
+                    cell = row * self.__cols + col
+                    for i in range(offsets[cell], offsets[cell+1]):
+                        item = items[i]
+                        if item in seen:
+                            continue
+                        seen.add(item)
+                        itemDistance = distance(item)
+                        if itemDistance < bestDistance:
+                            best, bestDistance = item, itemDistance
+            # every cell of the next ring is at least this far away
+            if best is not None and bestDistance <= ring * self.__cellMiles:
+                break
+        return best, bestDistance
+
+    # A private function that finds the cell of a coordinate (clamped into the grid).
+    def __rowCol(self, latitude, longitude):
+        row = int((latitude - self.__minLatitude) / self.__cellHeight)
+        col = int((longitude - self.__minLongitude) / self.__cellWidth)
+        return min(max(row, 0), self.__rows - 1), min(max(col, 0), self.__cols - 1)
+
+    # A private function that finds the index of the cell of a coordinate.
+    def __cell(self, latitude, longitude):
+        row, col = self.__rowCol(latitude, longitude)
+        return row * self.__cols + col
+
+    # A private function that turns lists of items per cell into CSR arrays.
+    @staticmethod
+    def __compress(cells):
+        offsets = array('I', [0])
+        items   = array('I')
+        for cell in cells:
+            items.extend(cell)
+            offsets.append(len(items))
+        return offsets, items
+
+    # A private function that adds items to some cells of CSR arrays.
+    # @param additions A dict of cell index -> list of the items to add to it.
+    # @return The new offsets and items arrays.
+    @staticmethod
+    def __insert(offsets, items, additions):
+        newOffsets = array('I', [0])
+        newItems   = array('I')
+        for cell in range(len(offsets) - 1):
+            newItems.extend(items[offsets[cell]:offsets[cell+1]])
+            newItems.extend(additions.get(cell, ()))
+            newOffsets.append(len(newItems))
+        return newOffsets, newItems
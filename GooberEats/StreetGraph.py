@@ -0,0 +1,440 @@
+"""
+Compact graph representation of a street map.
+
+Every distinct coordinate is a node with a dense integer id and every segment is
+stored as two directed edges in CSR (compressed sparse row) form:
+
+    the edges leaving node u are offsets[u] .. offsets[u+1]-1
+    edge e ends at node targets[e], is weights[e] miles long and lies on the
+    street streetName(edgeNames[e])
+
+Nodes are numbered in the order of their fixed-point coordinate key (GeoCoord.key),
+so a GeoCoord is found by a binary search over the keys, and every node has exactly
+one GeoCoord object. The same arrays are either built from a map data text file or
+memory-mapped from a file compiled by MapCompiler, in which case they are read-only
+views of the file's pages until the graph is changed (setWeights, addSegments).
+
+Layout of a compiled map (native byte order, every section directly follows the
+previous one, 8 byte items first so that every section stays aligned):
+
+    header              magic, endianness check and the counts N, E, S, T, B
+    keys                int64[N]    fixed-point coordinate keys, sorted ascending
+    latitudes           float64[N]
+    longitudes          float64[N]
+    weights             float64[E]
+    offsets             uint32[N+1]
+    targets             uint32[E]
+    edgeNames           uint32[E]
+    coordTextOffsets    uint32[2N+1] latitude/longitude texts of node i are entries 2i, 2i+1
+    nameOffsets         uint32[S+1]
+    coordText           T bytes of ascii
+    names               B bytes of utf-8
+"""
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+from OpenAddressingHashMap import *
+from provided import *
+
+MAGIC        = b'GOOBMAP1'
+ENDIAN_CHECK = 0x01020304
+HEADER       = struct.Struct('=8sIIIIII')
+
+# Reads the street segments of a map data text file.
+# @param mapFile A string of the text file name containing the map data.
+# @return A generator of (street name, latitude text 1, longitude text 1,
+#   latitude text 2, longitude text 2) tuples, one per segment in file order.
+# @raises An exception if the file does not exist.
+def readMapFile(mapFile):
+    with open(mapFile, "r") as mapdata:
+        lines = mapdata.read().split('\n')
+    i = 0
+    while i < len(lines):
+        name = lines[i]
+        if not name:    # skip blank lines between streets
+            i += 1
+            continue
+        nSegments = int(lines[i+1])
+        for line in lines[i+2 : i+2+nSegments]:
+            coordinates = line.split(' ')
+            yield name, coordinates[0], coordinates[1], coordinates[2], coordinates[3]
+        i += 2 + nSegments
+
+class StreetGraph:
+
+    def __init__(self):
+        self.__keys       = array('q')
+        self.__latitudes  = array('d')
+        self.__longitudes = array('d')
+        self.__weights    = array('d')
+        self.__offsets    = array('I', [0])
+        self.__targets    = array('I')
+        self.__edgeNames  = array('I')
+        # GeoCoords and names are decoded from these tables on first use (compiled maps only)
+        self.__coordText        = None
+        self.__coordTextOffsets = None
+        self.__nameBytes        = None
+        self.__nameOffsets      = None
+        self.__geoCoords  = []
+        self.__names      = []
+        self.__mmap       = None
+
+    # Builds the graph of a map data text file.
+    # @param mapFile A string of the text file name containing the map data.
+    # @return A new StreetGraph.
+    # @raises An exception if the file does not exist.
+    @classmethod
+    def fromMapFile(cls, mapFile):
+        rows = list(readMapFile(mapFile))
+        # coordinates are interned by their text first, so a GeoCoord is only created
+        # (and its text parsed) once per distinct coordinate of the file. The tables are
+        # sized once up front: a street map has about as many nodes as segments, and no
+        # more names than streets (runs of segments with the same name).
+        textIds   = OpenAddressingHashMap()
+        nodeIds   = OpenAddressingHashMap()
+        geoCoords = []
+        keys      = []
+        adjacency = []
+        nameIds   = OpenAddressingHashMap()
+        names     = []
+        segments  = []
+        textIds.reserve(len(rows))
+        nodeIds.reserve(len(rows))
+        nameIds.reserve(sum(1 for i in range(len(rows)) if i == 0 or rows[i][0] != rows[i-1][0]))
+
+        def nodeOf(latitudeText, longitudeText):
+            text = latitudeText + ' ' + longitudeText
+            node = textIds[text]
+            if node is not None:
+                return node
+            geoCoord = GeoCoord(latitudeText, longitudeText)
+            if geoCoord.key is None:
+                raise ValueError('bad coordinate ' + text)
+            node = nodeIds[geoCoord.key]
+            if node is None:
+                node = nodeIds[geoCoord.key] = len(keys)
+                geoCoords.append(geoCoord)
+                keys.append(geoCoord.key)
+                adjacency.append([])
+            textIds[text] = node
+            return node
+
+        for name, lat1, lon1, lat2, lon2 in rows:
+            u = nodeOf(lat1, lon1)
+            v = nodeOf(lat2, lon2)
+            nameId = nameIds[name]
+            if nameId is None:
+                nameId = nameIds[name] = len(names)
+                names.append(name)
+            segments.append((u, v, nameId))
+
+        # the lengths of all segments in one batch
+        starts = [geoCoords[u] for u, _, _ in segments]
+        ends   = [geoCoords[v] for _, v, _ in segments]
+        lengths = distanceEarthMilesPairs([gc.latitude for gc in starts], [gc.longitude for gc in starts],
+                                          [gc.latitude for gc in ends], [gc.longitude for gc in ends])
+        for (u, v, nameId), length in zip(segments, lengths):
+            adjacency[u].append((v, length, nameId))
+            adjacency[v].append((u, length, nameId))
+
+        # renumber the nodes in key order
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        newIds = [0] * len(order)
+        for newId, oldId in enumerate(order):
+            newIds[oldId] = newId
+
+        graph = cls()
+        graph.__names = names
+        for oldId in order:
+            geoCoord = geoCoords[oldId]
+            graph.__geoCoords.append(geoCoord)
+            graph.__keys.append(keys[oldId])
+            graph.__latitudes.append(geoCoord.latitude)
+            graph.__longitudes.append(geoCoord.longitude)
+            for target, weight, nameId in adjacency[oldId]:
+                graph.__targets.append(newIds[target])
+                graph.__weights.append(weight)
+                graph.__edgeNames.append(nameId)
+            graph.__offsets.append(len(graph.__targets))
+        return graph
+
+    # Memory-maps a compiled map file (read only, so processes share its pages).
+    # @param compiledFile The file written by save.
+    # @return A new StreetGraph whose arrays are views of the file.
+    # @raises ValueError if the file is not a compiled map of this machine's byte order.
+    @classmethod
+    def fromCompiledFile(cls, compiledFile):
+        graph = cls()
+        with open(compiledFile, 'rb') as mapfile:
+            graph.__mmap = mmap.mmap(mapfile.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(graph.__mmap)
+
+        magic, endianCheck, nodeCount, edgeCount, nameCount, coordTextBytes, nameBytes = \
+            HEADER.unpack_from(view)
+        if magic != MAGIC or endianCheck != ENDIAN_CHECK:
+            raise ValueError(compiledFile + ' is not a compiled map')
+
+        offset = HEADER.size
+        def section(format, count):
+            nonlocal offset
+            size = struct.calcsize(format) * count
+            data = view[offset : offset+size]
+            offset += size
+            return data.cast(format) if format != 'B' else data
+
+        graph.__keys             = section('q', nodeCount)
+        graph.__latitudes        = section('d', nodeCount)
+        graph.__longitudes       = section('d', nodeCount)
+        graph.__weights          = section('d', edgeCount)
+        graph.__offsets          = section('I', nodeCount + 1)
+        graph.__targets          = section('I', edgeCount)
+        graph.__edgeNames        = section('I', edgeCount)
+        graph.__coordTextOffsets = section('I', 2 * nodeCount + 1)
+        graph.__nameOffsets      = section('I', nameCount + 1)
+        graph.__coordText        = section('B', coordTextBytes)
+        graph.__nameBytes        = section('B', nameBytes)
+
+        # objects are only created for the parts of the map that are used
+        graph.__geoCoords = [None] * nodeCount
+        graph.__names     = [None] * nameCount
+        return graph
+
+    # Writes the graph in the compiled map format described above.
+    # @param compiledFile The binary file to be written.
+    def save(self, compiledFile):
+        coordText = bytearray()
+        coordTextOffsets = array('I', [0])
+        for node in range(self.nodeCount()):
+            geoCoord = self.geoCoord(node)
+            for text in (geoCoord.latitudeText, geoCoord.longitudeText):
+                coordText += text.encode('ascii')
+                coordTextOffsets.append(len(coordText))
+
+        nameBytes   = bytearray()
+        nameOffsets = array('I', [0])
+        for nameId in range(len(self.__names)):
+            nameBytes += self.streetName(nameId).encode('utf-8')
+            nameOffsets.append(len(nameBytes))
+
+        with open(compiledFile, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, ENDIAN_CHECK, self.nodeCount(), self.edgeCount(),
+                len(self.__names), len(coordText), len(nameBytes)))
+            for section in (self.__keys, self.__latitudes, self.__longitudes, self.__weights,
+                    self.__offsets, self.__targets, self.__edgeNames, coordTextOffsets,
+                    nameOffsets):
+                output.write(section)
+            output.write(coordText)
+            output.write(nameBytes)
+
+    # Builds the graph of some of the nodes and the edges leaving them, e.g. one tile of
+    # a tiled map. The targets of the edges are renumbered and may lie outside it.
+    # @param nodes The node ids of the subgraph, in key order.
+    # @param nodeIds The new id of every node of this graph, by node id.
+    # @return A new StreetGraph with its own street name table.
+    def subgraph(self, nodes, nodeIds):
+        graph = StreetGraph()
+        nameIds = {}
+        for node in nodes:
+            geoCoord = self.geoCoord(node)
+            graph.__geoCoords.append(geoCoord)
+            graph.__keys.append(self.__keys[node])
+            graph.__latitudes.append(self.__latitudes[node])
+            graph.__longitudes.append(self.__longitudes[node])
+            for edge in range(self.__offsets[node], self.__offsets[node+1]):
+                nameId = self.__edgeNames[edge]
+                if nameId not in nameIds:
+                    nameIds[nameId] = len(graph.__names)
+                    graph.__names.append(self.streetName(nameId))
+                graph.__targets.append(nodeIds[self.__targets[edge]])
+                graph.__weights.append(self.__weights[edge])
+                graph.__edgeNames.append(nameIds[nameId])
+            graph.__offsets.append(len(graph.__targets))
+        return graph
+
+    # Changes the lengths of edges. The arrays of a compiled map are read-only views of
+    # its file, so the weights are copied the first time they change.
+    # @param changes A list of (edge id, new length in miles) pairs.
+    def setWeights(self, changes):
+        if not isinstance(self.__weights, array):
+            self.__weights = array('d', self.__weights)
+        for edge, weight in changes:
+            self.__weights[edge] = weight
+
+    # Adds street segments (both directions of each) and the coordinates they introduce.
+    # The arrays are rebuilt once for the whole batch; nodes stay numbered in key order,
+    # so node ids only change if new coordinates are added, but edge ids change.
+    # @param segments A list of (start GeoCoord, end GeoCoord, street name, length in miles).
+    # @return A tuple of two arrays, the new id of every node and of every edge by their
+    #   ids before the change (the nodes added are those missing from the first).
+    # @raises ValueError if a coordinate has no fixed-point key.
+    def addSegments(self, segments):
+        nodeCount = self.nodeCount()
+        newNodes = {}   # key -> GeoCoord of the coordinates not on the map yet
+        for start, end, _, _ in segments:
+            for geoCoord in (start, end):
+                if geoCoord.key is None:
+                    raise ValueError('bad coordinate {0} {1}'.format(
+                        geoCoord.latitudeText, geoCoord.longitudeText))
+                if self.nodeId(geoCoord) is None:
+                    newNodes.setdefault(geoCoord.key, geoCoord)
+        newKeys = sorted(newNodes)
+
+        # merge the new keys into the sorted keys
+        nodeIds = array('I', [0]) * nodeCount    # new id of every node, by its old id
+        order = []                               # old id, or the GeoCoord of a new node, by new id
+        i = j = 0
+        while i < nodeCount or j < len(newKeys):
+            if j == len(newKeys) or (i < nodeCount and self.__keys[i] < newKeys[j]):
+                nodeIds[i] = len(order)
+                order.append(i)
+                i += 1
+            else:
+                order.append(newNodes[newKeys[j]])
+                newNodes[newKeys[j]] = len(order) - 1
+                j += 1
+        def newId(geoCoord):
+            node = self.nodeId(geoCoord)
+            return nodeIds[node] if node is not None else newNodes[geoCoord.key]
+
+        nameIds = {self.streetName(nameId): nameId for nameId in range(len(self.__names))}
+        added = {}  # new node id -> [(new target id, weight, name id)]
+        for start, end, name, length in segments:
+            nameId = nameIds.get(name)
+            if nameId is None:
+                nameId = nameIds[name] = len(self.__names)
+                self.__names.append(name)
+            u, v = newId(start), newId(end)
+            added.setdefault(u, []).append((v, length, nameId))
+            added.setdefault(v, []).append((u, length, nameId))
+
+        if len(newKeys) > 0:
+            # the coordinate texts of a compiled map are found by node id, so decode them
+            geoCoords = [self.geoCoord(node) for node in range(nodeCount)]
+            self.__coordText = self.__coordTextOffsets = None
+        else:
+            geoCoords = self.__geoCoords
+        keys, latitudes, longitudes = array('q'), array('d'), array('d')
+        weights, offsets, targets, edgeNames = array('d'), array('I', [0]), array('I'), array('I')
+        edgeIds = array('I', [0]) * len(self.__targets)
+        self.__geoCoords = []
+        for node, old in enumerate(order):
+            if isinstance(old, int):
+                geoCoord = geoCoords[old]
+                keys.append(self.__keys[old])
+                latitudes.append(self.__latitudes[old])
+                longitudes.append(self.__longitudes[old])
+                begin, end = self.__offsets[old], self.__offsets[old+1]
+                edgeIds[begin:end] = array('I', range(len(targets), len(targets) + end - begin))
+                for edge in range(begin, end):
+                    targets.append(nodeIds[self.__targets[edge]])
+                    weights.append(self.__weights[edge])
+                    edgeNames.append(self.__edgeNames[edge])
+            else:
+                geoCoord = old
+                keys.append(geoCoord.key)
+                latitudes.append(geoCoord.latitude)
+                longitudes.append(geoCoord.longitude)
+            self.__geoCoords.append(geoCoord)
+            for target, weight, nameId in added.get(node, ()):
+                targets.append(target)
+                weights.append(weight)
+                edgeNames.append(nameId)
+            offsets.append(len(targets))
+        self.__keys, self.__latitudes, self.__longitudes = keys, latitudes, longitudes
+        self.__weights, self.__offsets, self.__targets, self.__edgeNames = \
+            weights, offsets, targets, edgeNames
+        return nodeIds, edgeIds
+
+    # returns the number of nodes (distinct coordinates) of the graph
+    def nodeCount(self):
+        return len(self.__keys)
+
+    # returns the number of directed edges (twice the number of segments) of the graph
+    def edgeCount(self):
+        return len(self.__targets)
+
+    # Gets the CSR arrays for loops that walk many edges.
+    # @return A tuple of the offsets, targets and weights arrays (see above).
+    def adjacency(self):
+        return self.__offsets, self.__targets, self.__weights
+
+    # Gets the coordinate arrays for loops that look at many nodes.
+    # @return A tuple of the latitudes and longitudes arrays (in degrees, by node id).
+    def coordinates(self):
+        return self.__latitudes, self.__longitudes
+
+    # Finds the node of a geospatial coordinate.
+    # @param geoCoord The coordinate to look up.
+    # @return The node id, or None if the coordinate is not on the map.
+    def nodeId(self, geoCoord):
+        key = geoCoord.key
+        if key is None:
+            return None
+        node = bisect_left(self.__keys, key)
+        if node == len(self.__keys) or self.__keys[node] != key:
+            return None
+        return node
+
+    # Gets the geospatial coordinate of a node.
+    # @param nodeId The node id.
+    # @return The GeoCoord of the node (the same object on every call).
+    def geoCoord(self, nodeId):
+        geoCoord = self.__geoCoords[nodeId]
+        if geoCoord is None:
+            geoCoord = self.__geoCoords[nodeId] = GeoCoord(
+                self.__text(self.__coordText, self.__coordTextOffsets, 2 * nodeId),
+                self.__text(self.__coordText, self.__coordTextOffsets, 2 * nodeId + 1))
+        return geoCoord
+
+    # Gets a street name.
+    # @param nameId The index of the street name.
+    # @return The street name (the same object on every call).
+    def streetName(self, nameId):
+        name = self.__names[nameId]
+        if name is None:
+            name = self.__names[nameId] = \
+                self.__text(self.__nameBytes, self.__nameOffsets, nameId)
+        return name
+
+    # Gets the street name of an edge.
+    # @param edge The edge id.
+    # @return The street name (the same object on every call).
+    def edgeStreetName(self, edge):
+        return self.streetName(self.__edgeNames[edge])
+
+    # Iterates over the edges leaving a node.
+    # @param nodeId The node id.
+    # @return A generator of (target node id, weight in miles, edge id) tuples.
+    def neighbors(self, nodeId):
+        targets = self.__targets
+        weights = self.__weights
+        for edge in range(self.__offsets[nodeId], self.__offsets[nodeId+1]):
+            yield targets[edge], weights[edge], edge
+
+    # Finds the opposite direction of an edge (every segment is stored both ways).
+    # @param nodeId The node the edge leaves from.
+    # @param edge The edge id.
+    # @return The id of the edge from the edge's target back to nodeId on the same street,
+    #   or None if there is none.
+    def reverseEdge(self, nodeId, edge):
+        target = self.__targets[edge]
+        name   = self.__edgeNames[edge]
+        for reverse in range(self.__offsets[target], self.__offsets[target+1]):
+            if self.__targets[reverse] == nodeId and self.__edgeNames[reverse] == name:
+                return reverse
+        return None
+
+    # Builds the street segments that start with a node.
+    # @param nodeId The node id.
+    # @return A new list of StreetSegments, one per edge leaving the node (in edge order).
+    def segmentsFrom(self, nodeId):
+        start = self.geoCoord(nodeId)
+        return [StreetSegment(start, self.geoCoord(self.__targets[edge]),
+                    self.streetName(self.__edgeNames[edge]), self.__weights[edge])
+                for edge in range(self.__offsets[nodeId], self.__offsets[nodeId+1])]
+
+    # A private function that decodes an entry of a string table.
+    def __text(self, blob, offsets, index):
+        return str(blob[offsets[index] : offsets[index+1]], 'utf-8')
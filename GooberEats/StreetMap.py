@@ -1,6 +1,21 @@
-from ExpandableHashMap import *
+from enum import Enum
+
+from ChainGraph import ChainGraph
+from SpatialIndex import SpatialIndex
+from StreetGraph import StreetGraph
+from TiledStreetGraph import TiledStreetGraph, DEFAULT_MAX_BYTES
 from provided import *
 
+CLOSED          = float('inf')    # the length of a removed (closed) segment
+CHANGE_LOG_SIZE = 1000            # the most recent changes kept for changesSince
+LENGTH_ROUNDING = 1e-9            # how far (relative) a length may fall below the great-circle distance
+
+# The kinds of changes in the change log of a StreetMap.
+class MapChange(Enum):
+    LOAD     = 0    # new map data: everything derived from the map is stale
+    REWEIGHT = 1    # segment lengths changed; node and edge ids are unchanged
+    ADD      = 2    # segments were added; edge ids (and node ids, if nodes were added) changed
+
 # Generates two GeoCoord objects from a string of four doubles separated by spaces, 
 #   terminated with \n.
 # @param geoCoordString The string containing two latitude, longitude pairs 
@@ -25,37 +40,55 @@ def insertIfUnique(list, element):
 class StreetMap:
 
     def __init__(self):
-        self.__segmentMap  = ExpandableHashMap()
+        self.__graph    = StreetGraph()
+        # StreetSegments leaving each node, built the first time the node is asked for
+        self.__segments = []
+        self.__version  = 0
+        self.__compiledFile = None
+        self.__index    = None
+        self.__chains   = None
+        # (version, MapChange, details) of the most recent changes, oldest first
+        self.__changes  = []
 
     # Generates a segment map from a given text file containing map data
     # @param mapFile A string of the text file name containing the map data.
     # @raises An exception if the file does not exist.
     def load(self, mapFile):
-        mapdata = open(mapFile, "r")
-        name      = None
-        nSegments = None
-        line      = mapdata.readline()
-        while line:
-            if not name:
-                name = line[:-1]
-            elif not nSegments:
-                nSegments = int(line)
-            else:
-                for _ in range(nSegments):
-                    gc1, gc2  = getGeoCoords(line)
-                    streetseg = StreetSegment(gc1, gc2, name)                  
-                    if  self.__segmentMap.find(gc1) is None:
-                        self.__segmentMap[gc1] = []
-                    if  self.__segmentMap.find(gc2) is None:
-                        self.__segmentMap[gc2] = []
-                    self.__segmentMap[gc1].append(streetseg)
-                    self.__segmentMap[gc2].append(streetseg.reversed())
-                    line = mapdata.readline()
-                name      = None       
-                nSegments = None
-                continue
-            line = mapdata.readline()
-        mapdata.close()     
+        self.__setGraph(StreetGraph.fromMapFile(mapFile))
+        self.__compiledFile = None
+
+    # Memory-maps a map compiled by MapCompiler instead of parsing a text file.
+    # Segments are only materialized when a coordinate is looked up, and processes
+    # loading the same file share its pages.
+    # @param compiledFile A string of the compiled map file name.
+    # @raises An exception if the file does not exist or is not a compiled map.
+    def loadCompiled(self, compiledFile):
+        self.__setGraph(StreetGraph.fromCompiledFile(compiledFile))
+        self.__compiledFile = compiledFile
+
+    # Opens a map compiled into tiles (MapCompiler --tiles). A tile is only loaded when a
+    # route or lookup touches a node inside it, and the least recently used tiles are
+    # evicted when the loaded tiles take more than maxBytes. Segments are not cached per
+    # node in this mode, so that evicted tiles are not kept alive through them.
+    # @param directory The directory holding the tiles.
+    # @param maxBytes The memory cap for loaded tiles, in bytes of tile files.
+    # @raises An exception if the directory does not hold a tiled map.
+    def loadTiled(self, directory, maxBytes = DEFAULT_MAX_BYTES):
+        self.__setGraph(TiledStreetGraph(directory, maxBytes), cacheSegments = False)
+        self.__compiledFile = None
+
+    # returns a tuple of the number of tiles loaded now, the bytes they take and the
+    # number of tile loads so far, or None if the map is not tiled
+    def tileStats(self):
+        if not isinstance(self.__graph, TiledStreetGraph):
+            return None
+        return self.__graph.tileStats()
+
+    # returns the name of the compiled map file the map was loaded from (None if the map
+    # was loaded from text or has changed since), so that other processes can map the
+    # same file
+    def compiledFile(self):
+        return self.__compiledFile
 
     # Populates a list with all street segments that start with a given geospatial coordinate.
     # @param geoCoord The coordinate we intend to find all street segment connections with.
@@ -63,7 +96,291 @@ class StreetMap:
     # @post The 'segments' list will be cleared and populated with all connections (if any).
     #   Contents of 'segments' will be unchanged if no connections exist.
     def getSegmentsThatStartWith(self, geoCoord, segments):
-        connections = self.__segmentMap[geoCoord]
-        if connections is not None:
+        nodeId = self.__graph.nodeId(geoCoord)
+        if nodeId is not None:
             segments.clear()
-            segments += connections.copy()
\ No newline at end of file
+            segments += self.__segmentsFrom(nodeId)
+
+    # Iterates over the street segments that start with a given geospatial coordinate.
+    # Unlike getSegmentsThatStartWith nothing is copied: the iterator reads the segments
+    # the map stores for the coordinate.
+    # @param geoCoord The coordinate we intend to find all street segment connections with.
+    # @return An iterator over the connected segments (empty if the coordinate is not on the map).
+    def iterSegmentsFrom(self, geoCoord):
+        nodeId = self.__graph.nodeId(geoCoord)
+        return iter(()) if nodeId is None else iter(self.__segmentsFrom(nodeId))
+
+    # Finds the intersection nearest to a coordinate, e.g. a customer address that is not
+    # on the map. The spatial index this and nearestSegment search is built the first
+    # time either is called.
+    # @param geoCoord Any geospatial coordinate.
+    # @return A tuple of the GeoCoord of the nearest node and its distance in miles, or
+    #   None if the map is empty.
+    def nearestNode(self, geoCoord):
+        nearest = self.__spatialIndex().nearestNode(geoCoord.latitude, geoCoord.longitude)
+        if nearest is None:
+            return None
+        return self.__graph.geoCoord(nearest[0]), nearest[1]
+
+    # Finds the street segment nearest to a coordinate.
+    # @param geoCoord Any geospatial coordinate.
+    # @return A tuple of the nearest StreetSegment (the same object getSegmentsThatStartWith
+    #   lists) and the distance in miles from the coordinate to it, or None if the map has
+    #   no segments.
+    def nearestSegment(self, geoCoord):
+        nearest = self.__spatialIndex().nearestSegment(geoCoord.latitude, geoCoord.longitude)
+        if nearest is None:
+            return None
+        nodeId, edge, miles, _ = nearest
+        return self.edgeSegment(nodeId, edge), miles
+
+    # Snaps coordinates to the map, e.g. all the delivery locations of a file. A
+    # coordinate on the map stays as it is; any other one moves to the end of its
+    # nearest street segment that is nearer to the point of the segment it is closest to.
+    # @param geoCoords A list of geospatial coordinates.
+    # @return A list with a tuple of the snapped GeoCoord and the distance in miles it
+    #   moved for every coordinate (None for every coordinate if the map is empty).
+    def snapGeoCoords(self, geoCoords):
+        snapped = []
+        for geoCoord in geoCoords:
+            nodeId = self.__graph.nodeId(geoCoord)
+            if nodeId is not None:
+                snapped.append((self.__graph.geoCoord(nodeId), 0.0))
+                continue
+            nearest = self.__spatialIndex().nearestSegment(geoCoord.latitude, geoCoord.longitude)
+            if nearest is None:
+                snapped.append(None)
+                continue
+            nodeId, edge, _, fraction = nearest
+            if fraction > 0.5:
+                nodeId = self.__graph.adjacency()[1][edge]
+            node = self.__graph.geoCoord(nodeId)
+            snapped.append((node, distanceEarthMiles(geoCoord, node)))
+        return snapped
+
+    # Collapses the chains of degree-2 nodes of the map into super-edges, the first time
+    # it is called for the current map data (RoutingMode.COLLAPSED_CHAINS routes on it).
+    # @return The ChainGraph of the map.
+    def chainGraph(self):
+        if self.__chains is None:
+            self.__chains = ChainGraph(self)
+            self.__chains.build()
+        return self.__chains
+
+    # returns a number that increases every time the map data changes, so that results
+    # computed from the map (e.g. cached routes) can tell they are stale
+    def version(self):
+        return self.__version
+
+    # Lists the changes made to the map after a version, so that structures derived from
+    # the map can refresh only what the changes touch.
+    # @param version A version returned by version().
+    # @return A list of (version, MapChange, details) tuples, oldest first, or None if the
+    #   log does not reach back to the version. The details of a REWEIGHT are a list of
+    #   (node id, edge id, old length, new length) tuples, one per changed edge; those of
+    #   an ADD are the list of added StreetSegments; a LOAD has None.
+    def changesSince(self, version):
+        if len(self.__changes) == 0 or self.__changes[0][0] > version + 1:
+            return [] if version == self.__version else None
+        return [change for change in self.__changes if change[0] > version]
+
+    # Changes the lengths of street segments on the live map, e.g. when traffic makes a
+    # street slow. Both directions of every segment change. A street is never shorter
+    # than the great-circle distance between its ends (A* relies on it), so nothing is
+    # changed if any new length is, beyond rounding (LENGTH_ROUNDING).
+    # @param changes A list of (StreetSegment, new length in miles) pairs. The start, end
+    #   and name of each StreetSegment pick the segment of the map (its length is ignored).
+    # @return The number of segments found and changed.
+    # @raises ValueError if the map is tiled (tiles are read only) or a length is shorter
+    #   than the great-circle distance between the ends of its segment.
+    def reweightSegments(self, changes):
+        self.__checkWritable()
+        for segment, length in changes:
+            self.__checkLength(segment.start, segment.end, length)
+        _, targets, weights = self.__graph.adjacency()
+        edgeChanges = []
+        seen = set()    # a segment may be listed in both directions
+        changed = 0
+        for segment, length in changes:
+            edges = [(nodeId, edge) for nodeId, edge in self.__segmentEdges(segment)
+                     if weights[edge] != length and edge not in seen]
+            seen.update(edge for _, edge in edges)
+            edgeChanges += [(nodeId, edge, weights[edge], length) for nodeId, edge in edges]
+            changed += len(edges) > 0
+        if changed == 0:
+            return 0
+        self.__graph.setWeights([(edge, length) for _, edge, _, length in edgeChanges])
+        for nodeId, edge, _, _ in edgeChanges:
+            self.__segments[nodeId] = None
+        if self.__chains is not None:
+            self.__chains.updateWeights([edge for _, edge, _, _ in edgeChanges])
+        self.__compiledFile = None
+        self.__logChange(MapChange.REWEIGHT, edgeChanges)
+        return changed
+
+    # Removes street segments from the live map, e.g. for road closures. A removed
+    # segment stays listed with an infinite length, and routes never use it;
+    # reweightSegments with a finite length opens it again.
+    # @param segments A list of StreetSegments (picked by start, end and name).
+    # @return The number of segments found and closed.
+    # @raises ValueError if the map is tiled.
+    def removeSegments(self, segments):
+        return self.reweightSegments([(segment, CLOSED) for segment in segments])
+
+    # Adds street segments to the live map, in both directions. Coordinates that are not
+    # on the map yet become new intersections. The whole batch is applied at once, so
+    # add many segments with one call.
+    # @param segments A list of StreetSegments. A segment without a length gets the
+    #   great-circle distance between its ends, and none may be shorter than that.
+    # @return The number of new intersections.
+    # @raises ValueError if the map is tiled, a coordinate is bad or a length is shorter
+    #   than the great-circle distance between the ends of its segment.
+    def addSegments(self, segments):
+        self.__checkWritable()
+        if len(segments) == 0:
+            return 0
+        lengths = [segment.length if segment.length is not None else
+                   distanceEarthMiles(segment.start, segment.end) for segment in segments]
+        for segment, length in zip(segments, lengths):
+            self.__checkLength(segment.start, segment.end, length)
+        nodeIds, edgeIds = self.__graph.addSegments([(segment.start, segment.end, segment.name,
+            length) for segment, length in zip(segments, lengths)])
+        # the edges of the new segments, in both directions
+        offsets, targets, _ = self.__graph.adjacency()
+        touched = sorted(set(self.__graph.nodeId(geoCoord) for segment in segments
+                             for geoCoord in (segment.start, segment.end)))
+        oldEdges = set(edgeIds)
+        edges = [(u, edge) for u in touched for edge in range(offsets[u], offsets[u+1])
+                 if edge not in oldEdges]
+
+        # node and edge ids changed: what is derived from the map is renumbered, and only
+        # the nodes of the new segments are looked at again
+        cached = self.__segments
+        self.__segments = [None] * self.__graph.nodeCount()
+        for old, new in enumerate(nodeIds):
+            self.__segments[new] = cached[old]
+        for u in touched:
+            self.__segments[u] = None
+        if self.__index is not None:
+            latitudes, longitudes = self.__graph.coordinates()
+            self.__index.addSegments(latitudes, longitudes, offsets, targets, nodeIds, edgeIds, edges)
+        if self.__chains is not None:
+            self.__chains.addSegments(nodeIds, edgeIds, edges)
+        self.__compiledFile = None
+        self.__logChange(MapChange.ADD, list(segments))
+        return self.__graph.nodeCount() - len(nodeIds)
+
+    # Integer interface of the map: every coordinate is a node with a dense id in
+    # [0, nodeCount()) and every directed edge has an id that indexes the CSR arrays
+    # returned by adjacency(). Routing runs on these ids and only turns the edges of
+    # the final route back into StreetSegments.
+
+    # returns the number of nodes (distinct coordinates) of the map
+    def nodeCount(self):
+        return self.__graph.nodeCount()
+
+    # Finds the node id of a geospatial coordinate.
+    # @param geoCoord The coordinate to look up.
+    # @return The node id, or None if the coordinate is not on the map.
+    def nodeId(self, geoCoord):
+        return self.__graph.nodeId(geoCoord)
+
+    # Gets the geospatial coordinate of a node.
+    # @param nodeId The node id.
+    # @return The GeoCoord of the node.
+    def nodeGeoCoord(self, nodeId):
+        return self.__graph.geoCoord(nodeId)
+
+    # Iterates over the edges leaving a node.
+    # @param nodeId The node id.
+    # @return A generator of (target node id, weight in miles, edge id) tuples.
+    def neighbors(self, nodeId):
+        return self.__graph.neighbors(nodeId)
+
+    # Gets the CSR arrays of the map for loops that walk many edges.
+    # @return A tuple of the offsets, targets and weights arrays: the edges leaving
+    #   node u are offsets[u] .. offsets[u+1]-1, edge e ends at node targets[e] and
+    #   is weights[e] miles long.
+    def adjacency(self):
+        return self.__graph.adjacency()
+
+    # Finds the opposite direction of an edge, i.e. the edge a search walking the map
+    # backwards from the end of a route has to take.
+    # @param nodeId The node the edge leaves from.
+    # @param edge The edge id.
+    # @return The id of the edge from the edge's target back to nodeId on the same street.
+    def reverseEdge(self, nodeId, edge):
+        return self.__graph.reverseEdge(nodeId, edge)
+
+    # Gets the coordinate arrays of the map for loops that look at many nodes.
+    # @return A tuple of the latitudes and longitudes arrays (in degrees, by node id).
+    def coordinates(self):
+        return self.__graph.coordinates()
+
+    # Gets the street segment of an edge.
+    # @param nodeId The node the edge leaves from.
+    # @param edge The edge id.
+    # @return The StreetSegment of the edge (the same object getSegmentsThatStartWith lists).
+    def edgeSegment(self, nodeId, edge):
+        offsets, _, _ = self.__graph.adjacency()
+        return self.__segmentsFrom(nodeId)[edge - offsets[nodeId]]
+
+    # A private function that replaces the graph of the map.
+    def __setGraph(self, graph, cacheSegments = True):
+        self.__graph    = graph
+        self.__segments = [None] * graph.nodeCount() if cacheSegments else None
+        self.__index    = None
+        self.__chains   = None
+        self.__changes  = []
+        self.__logChange(MapChange.LOAD, None)
+
+    # A private function that bumps the version and records a change in the log.
+    def __logChange(self, kind, details):
+        self.__version += 1
+        self.__changes.append((self.__version, kind, details))
+        if len(self.__changes) > CHANGE_LOG_SIZE:
+            del self.__changes[0]
+
+    # A private function that raises ValueError if the map data cannot be changed.
+    def __checkWritable(self):
+        if isinstance(self.__graph, TiledStreetGraph):
+            raise ValueError('a tiled map cannot be changed')
+
+    # A private function that raises ValueError if a length is shorter than the
+    # great-circle distance between two coordinates, beyond rounding (the lengths of the
+    # map data can be a little below it).
+    def __checkLength(self, start, end, length):
+        if length < distanceEarthMiles(start, end) * (1 - LENGTH_ROUNDING):
+            raise ValueError('a segment of {0} miles is shorter than the {1} miles between its ends'
+                             .format(length, distanceEarthMiles(start, end)))
+
+    # A private function that finds both directions of a segment of the map.
+    # @return A list of (node id, edge id) pairs, empty if the segment is not on the map.
+    def __segmentEdges(self, segment):
+        u = self.__graph.nodeId(segment.start)
+        v = self.__graph.nodeId(segment.end)
+        if u is None or v is None:
+            return []
+        edges = []
+        for nodeId, other in ((u, v),) if u == v else ((u, v), (v, u)):
+            for target, _, edge in self.__graph.neighbors(nodeId):
+                if target == other and self.__graph.edgeStreetName(edge) == segment.name:
+                    edges.append((nodeId, edge))
+        return edges
+
+    # A private function that builds the spatial index the first time it is needed.
+    def __spatialIndex(self):
+        if self.__index is None:
+            latitudes, longitudes = self.__graph.coordinates()
+            offsets, targets, _ = self.__graph.adjacency()
+            self.__index = SpatialIndex(latitudes, longitudes, offsets, targets)
+        return self.__index
+
+    # A private function that gets the (cached) street segments leaving a node.
+    def __segmentsFrom(self, nodeId):
+        if self.__segments is None:
+            return self.__graph.segmentsFrom(nodeId)
+        segments = self.__segments[nodeId]
+        if segments is None:
+            segments = self.__segments[nodeId] = self.__graph.segmentsFrom(nodeId)
+        return segments
@@ -0,0 +1,278 @@
+"""
+A street graph split into geographic tiles that are loaded on demand, so a process
+routing on a metro-area map only holds the tiles its routes pass through.
+
+A tiled map is a directory written by MapCompiler.compileTiledMap: the nodes fall into
+square tiles of TILE_DEGREES degrees (by floor(latitude / size), floor(longitude /
+size)), each tile is a compiled map file (see StreetGraph) of its nodes and the edges
+leaving them, and a small index file lists the tiles. Nodes are numbered tile by tile,
+in key order within a tile, and edges likewise, so the ids of a tile are a contiguous
+range and the tile of any node or edge id is found by a binary search of the index.
+Edge targets keep their ids across tiles, which is what keeps routes that cross tile
+boundaries correct.
+
+TiledStreetGraph has the interface of StreetGraph. adjacency() and coordinates()
+return array-like views that load the tile of the index they are read at, so the
+searches of PointToPointRouter run on it unchanged (at a few times the cost of plain
+arrays). Loaded tiles are memory-mapped and evicted least recently used first once
+their files add up to more than the memory cap; the tile being read is always kept.
+Structures that walk the whole map (ContractionHierarchy, ChainGraph, SpatialIndex)
+work too, but load every tile in turn.
+
+Layout of the index file (native byte order):
+
+    header      magic, endianness check, the counts T, N, E and the tile size in degrees
+    rows        int32[T]    tile row (floor(latitude / size)) of every tile, ascending
+    cols        int32[T]    tile column (floor(longitude / size)), ascending within a row
+    nodeBases   uint32[T+1] the nodes of tile t are nodeBases[t] .. nodeBases[t+1]-1
+    edgeBases   uint32[T+1] the edges of tile t are edgeBases[t] .. edgeBases[t+1]-1
+"""
+import math
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from StreetGraph import *
+
+TILE_MAGIC        = b'GOOBTIL1'
+TILE_HEADER       = struct.Struct('=8sIIIId')
+INDEX_FILE        = 'tiles.index'
+TILE_FILE         = 'tile{0}.gmap'
+TILE_DEGREES      = 0.05
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Computes the tile a coordinate falls into.
+# @return A tuple of the tile row and column.
+def tileOf(latitude, longitude, tileDegrees):
+    return math.floor(latitude / tileDegrees), math.floor(longitude / tileDegrees)
+
+# Splits a graph into tiles and writes them as a tiled map.
+# @param graph A StreetGraph (e.g. built by StreetGraph.fromMapFile).
+# @param directory The directory to write the index and tile files to (created if needed).
+# @param tileDegrees The side of a tile in degrees.
+# @return The number of tiles written.
+def saveTiles(graph, directory, tileDegrees = TILE_DEGREES):
+    latitudes, longitudes = graph.coordinates()
+    offsets, _, _ = graph.adjacency()
+    tiles = [tileOf(latitudes[node], longitudes[node], tileDegrees) for node in range(graph.nodeCount())]
+    # tile by tile, and in key (= node id) order within a tile
+    order = sorted(range(graph.nodeCount()), key = lambda node: (tiles[node], node))
+    nodeIds = [0] * len(order)
+    for newId, node in enumerate(order):
+        nodeIds[node] = newId
+
+    os.makedirs(directory, exist_ok = True)
+    rows, cols = array('i'), array('i')
+    nodeBases, edgeBases = array('I', [0]), array('I', [0])
+    first = 0
+    while first < len(order):
+        tile = tiles[order[first]]
+        last = first
+        while last < len(order) and tiles[order[last]] == tile:
+            last += 1
+        nodes = order[first:last]
+        graph.subgraph(nodes, nodeIds).save(os.path.join(directory, TILE_FILE.format(len(rows))))
+        rows.append(tile[0])
+        cols.append(tile[1])
+        nodeBases.append(last)
+        edgeBases.append(edgeBases[-1] + sum(offsets[node+1] - offsets[node] for node in nodes))
+        first = last
+
+    with open(os.path.join(directory, INDEX_FILE), 'wb') as output:
+        output.write(TILE_HEADER.pack(TILE_MAGIC, ENDIAN_CHECK, len(rows), graph.nodeCount(),
+            graph.edgeCount(), tileDegrees))
+        for section in (rows, cols, nodeBases, edgeBases):
+            output.write(section)
+    return len(rows)
+
+# A read-only array over the ids of all tiles that reads the array of the tile an index
+# falls in (loading the tile if needed).
+class TiledArray:
+
+    # @param graph The TiledStreetGraph the tiles come from.
+    # @param bases The first id of every tile (and the total count last).
+    # @param section A function of a tile's StreetGraph returning the array to read.
+    def __init__(self, graph, bases, section):
+        self.__graph   = graph
+        self.__bases   = bases
+        self.__section = section
+        # the id range and array of the tile read last
+        self.__low = self.__high = 0
+        self.__array = None
+
+    def __len__(self):
+        return self.__bases[-1]
+
+    def __getitem__(self, i):
+        if self.__low <= i < self.__high:
+            return self.__array[i - self.__low]
+        if not 0 <= i < self.__bases[-1]:
+            raise IndexError('tiled array index out of range')
+        t = bisect_right(self.__bases, i) - 1
+        self.__low, self.__high = self.__bases[t], self.__bases[t+1]
+        self.__array = self.__section(self.__graph.tile(t))
+        return self.__array[i - self.__low]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+# The offsets array of a tiled graph: the local offsets of a tile shifted by the first
+# edge id of the tile. The offset at the first node of a tile is the first edge id of
+# the tile, so reading offsets[u+1] for the last node u of a tile loads no other tile.
+class TiledOffsets:
+
+    def __init__(self, graph, nodeBases, edgeBases):
+        self.__graph     = graph
+        self.__nodeBases = nodeBases
+        self.__edgeBases = edgeBases
+        self.__low = self.__high = self.__edgeBase = 0
+        self.__offsets = None
+
+    def __len__(self):
+        return self.__nodeBases[-1] + 1
+
+    def __getitem__(self, i):
+        if self.__low < i < self.__high:
+            return self.__edgeBase + self.__offsets[i - self.__low]
+        if not 0 <= i <= self.__nodeBases[-1]:
+            raise IndexError('tiled offsets index out of range')
+        t = bisect_right(self.__nodeBases, i) - 1
+        if i == self.__nodeBases[t]:
+            return self.__edgeBases[t]
+        self.__low, self.__high = self.__nodeBases[t], self.__nodeBases[t+1]
+        self.__edgeBase = self.__edgeBases[t]
+        self.__offsets = self.__graph.tile(t).adjacency()[0]
+        return self.__edgeBase + self.__offsets[i - self.__low]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class TiledStreetGraph:
+
+    # Opens a tiled map; no tile is loaded until it is needed.
+    # @param directory The directory written by saveTiles.
+    # @param maxBytes The memory cap: the most bytes of tile files kept loaded.
+    # @raises ValueError if the directory does not hold a tiled map of this machine's byte order.
+    def __init__(self, directory, maxBytes = DEFAULT_MAX_BYTES):
+        with open(os.path.join(directory, INDEX_FILE), 'rb') as index:
+            data = index.read()
+        magic, endianCheck, tileCount, nodeCount, edgeCount, tileDegrees = \
+            TILE_HEADER.unpack_from(data)
+        if magic != TILE_MAGIC or endianCheck != ENDIAN_CHECK:
+            raise ValueError(directory + ' is not a tiled map')
+        offset = TILE_HEADER.size
+        def section(format, count):
+            nonlocal offset
+            values = array(format)
+            values.frombytes(data[offset : offset + values.itemsize * count])
+            offset += values.itemsize * count
+            return values
+
+        self.__directory = directory
+        self.__tileDegrees = tileDegrees
+        rows = section('i', tileCount)
+        cols = section('i', tileCount)
+        self.__tileIds   = {(rows[t], cols[t]): t for t in range(tileCount)}
+        self.__nodeBases = section('I', tileCount + 1)
+        self.__edgeBases = section('I', tileCount + 1)
+        self.__tileBytes = [os.path.getsize(os.path.join(directory, TILE_FILE.format(t)))
+                            for t in range(tileCount)]
+        self.__maxBytes  = maxBytes
+        self.__tiles     = OrderedDict()    # tile index -> StreetGraph, least recently used first
+        self.__loadedBytes = 0
+        self.__loads     = 0
+
+        self.__offsets    = TiledOffsets(self, self.__nodeBases, self.__edgeBases)
+        self.__targets    = TiledArray(self, self.__edgeBases, lambda tile: tile.adjacency()[1])
+        self.__weights    = TiledArray(self, self.__edgeBases, lambda tile: tile.adjacency()[2])
+        self.__latitudes  = TiledArray(self, self.__nodeBases, lambda tile: tile.coordinates()[0])
+        self.__longitudes = TiledArray(self, self.__nodeBases, lambda tile: tile.coordinates()[1])
+
+    # returns the number of tiles of the map
+    def tileCount(self):
+        return len(self.__tileBytes)
+
+    # returns a tuple of the number of tiles loaded now, the bytes of their files and
+    # the number of times a tile has been loaded so far
+    def tileStats(self):
+        return len(self.__tiles), self.__loadedBytes, self.__loads
+
+    # Gets a tile, loading it (and evicting the least recently used tiles above the
+    # memory cap) if it is not loaded.
+    # @param t The tile index.
+    # @return The StreetGraph of the tile, whose ids are relative to the tile except for
+    #   edge targets.
+    def tile(self, t):
+        tile = self.__tiles.get(t)
+        if tile is not None:
+            self.__tiles.move_to_end(t)
+            return tile
+        while len(self.__tiles) > 0 and self.__loadedBytes + self.__tileBytes[t] > self.__maxBytes:
+            evicted, _ = self.__tiles.popitem(last = False)
+            self.__loadedBytes -= self.__tileBytes[evicted]
+        tile = self.__tiles[t] = StreetGraph.fromCompiledFile(
+            os.path.join(self.__directory, TILE_FILE.format(t)))
+        self.__loadedBytes += self.__tileBytes[t]
+        self.__loads += 1
+        return tile
+
+    # The rest has the interface of StreetGraph.
+
+    def nodeCount(self):
+        return self.__nodeBases[-1]
+
+    def edgeCount(self):
+        return self.__edgeBases[-1]
+
+    def adjacency(self):
+        return self.__offsets, self.__targets, self.__weights
+
+    def coordinates(self):
+        return self.__latitudes, self.__longitudes
+
+    def nodeId(self, geoCoord):
+        if geoCoord.key is None:
+            return None
+        t = self.__tileIds.get(tileOf(geoCoord.latitude, geoCoord.longitude, self.__tileDegrees))
+        if t is None:
+            return None
+        node = self.tile(t).nodeId(geoCoord)
+        return None if node is None else self.__nodeBases[t] + node
+
+    def geoCoord(self, nodeId):
+        t, node = self.__locate(self.__nodeBases, nodeId)
+        return self.tile(t).geoCoord(node)
+
+    def neighbors(self, nodeId):
+        weights = self.__weights
+        targets = self.__targets
+        for edge in range(self.__offsets[nodeId], self.__offsets[nodeId+1]):
+            yield targets[edge], weights[edge], edge
+
+    def reverseEdge(self, nodeId, edge):
+        target = self.__targets[edge]
+        name   = self.__streetName(edge)
+        for reverse in range(self.__offsets[target], self.__offsets[target+1]):
+            if self.__targets[reverse] == nodeId and self.__streetName(reverse) == name:
+                return reverse
+        return None
+
+    def segmentsFrom(self, nodeId):
+        start = self.geoCoord(nodeId)
+        return [StreetSegment(start, self.geoCoord(self.__targets[edge]),
+                    self.__streetName(edge), self.__weights[edge])
+                for edge in range(self.__offsets[nodeId], self.__offsets[nodeId+1])]
+
+    # A private function that finds the tile of an id and the id within the tile.
+    def __locate(self, bases, i):
+        t = bisect_right(bases, i) - 1
+        return t, i - bases[t]
+
+    # A private function that gets the street name of an edge.
+    def __streetName(self, edge):
+        t, local = self.__locate(self.__edgeBases, edge)
+        return self.tile(t).edgeStreetName(local)
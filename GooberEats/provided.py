@@ -5,42 +5,79 @@ class DeliveryResult(Enum):
     NO_ROUTE         = 1
     BAD_COORD        = 2
 
+# coordinates are keyed with 7 decimals (the precision of Open Street Map)
+FIXED_POINT_SCALE = 10 ** 7
+LATITUDE_BIAS     = 90 * FIXED_POINT_SCALE
+LONGITUDE_BIAS    = 180 * FIXED_POINT_SCALE
+
+# Computes the fixed-point integer key of a coordinate.
+# @param latitude The latitude in degrees.
+# @param longitude The longitude in degrees.
+# @return A non-negative integer ordered by latitude then longitude,
+#   or None if the coordinate is not a finite position on earth.
+def coordinateKey(latitude, longitude):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return (round(latitude * FIXED_POINT_SCALE) + LATITUDE_BIAS) << 32 |\
+        (round(longitude * FIXED_POINT_SCALE) + LONGITUDE_BIAS)
+
 """
 Dataclass could have been used if mutability is desired to emulate a C++ struct.
 However, this would result in an undesired side-effect when hashing them.
 hash() in Python returns a hashed value only for immutable objects (exception thrown otherwise).
+
+GeoCoords are slotted (no per-instance __dict__) and carry their fixed-point key, which
+is computed once: hashing and comparing two coordinates is an integer operation, and
+the texts only decide for coordinates that have no key (e.g. 'inf').
+StreetMap keeps a single GeoCoord per intersection, so equality is usually an identity check.
 """
 class GeoCoord:
+    __slots__ = ('latitudeText', 'longitudeText', 'latitude', 'longitude', 'key')
+
     def __init__(self, latitudeText, longitudeText):
         self.latitudeText  = latitudeText
         self.longitudeText = longitudeText
         self.latitude      = float(latitudeText)
         self.longitude     = float(longitudeText)
+        self.key           = coordinateKey(self.latitude, self.longitude)
 
     def __eq__(self, other):
-        return self.latitudeText == other.latitudeText and\
-            self.longitudeText == other.longitudeText
+        if self is other:
+            return True
+        if self.key is None or other.key is None:
+            return self.latitudeText == other.latitudeText and\
+                self.longitudeText == other.longitudeText
+        return self.key == other.key
     
     def __lt__(self, other):
-        if (self.latitudeText == other.latitudeText):
-            return self.longitudeText < other.longitudeText
-        return self.latitudeText < other.latitudeText
+        if self.key is None or other.key is None:
+            if (self.latitudeText == other.latitudeText):
+                return self.longitudeText < other.longitudeText
+            return self.latitudeText < other.latitudeText
+        return self.key < other.key
     
     # Specs provided a utility function that hashes GeoCoords.
     # However, in Python, you can override __hash__ instead,
     # resulting in slightly more organized code.
     def __hash__(self):
-        return hash(self.latitudeText + self.longitudeText)
+        if self.key is None:
+            return hash((self.latitudeText, self.longitudeText))
+        return hash(self.key)
 
 class StreetSegment:
-    def __init__(self, start, end, name):
-        self.start = start
-        self.end   = end
-        self.name  = name
+    __slots__ = ('start', 'end', 'name', 'length')
+
+    # @param length The length of the segment in miles, if already known (segments of a
+    #   StreetMap carry the length the map computed when it was loaded).
+    def __init__(self, start, end, name, length = None):
+        self.start  = start
+        self.end    = end
+        self.name   = name
+        self.length = length
 
     def __eq__(self, other):
-        return self.start == other.start and self.end == other.end and\
-            self.name == other.name
+        return self is other or (self.start == other.start and self.end == other.end and\
+            self.name == other.name)
     
     def __lt__(self, other):
         if self.start == other.start:
@@ -125,7 +162,78 @@ def distanceEarthMiles(g1, g2):
     milesPerKm = 1 / 1.609344
     return distanceEarthKM(g1, g2) * milesPerKm
 
+# Batched versions of distanceEarthMiles for many coordinates at once. Each takes the
+# latitudes and longitudes (in degrees) as sequences and returns a list of floats, equal
+# to the scalar results within floating-point tolerance. With NumPy installed (an optional
+# dependency) they are vectorized; otherwise the radians and cosines of each coordinate are
+# computed once. Both ways clamp the haversine term to [0, 1] before the arcsine, since
+# rounding can push it just past 1 for antipodal coordinates.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# in the same order of operations as distanceEarthKM and distanceEarthMiles
+EARTH_DIAMETER_KM = 2.0 * 6371.0
+MILES_PER_KM      = 1 / 1.609344
+
+# Computes the distance between every pair of coordinates of two equally long sequences.
+# @return A list whose ith element is the distance from the ith coordinate of the first
+#   sequence to the ith coordinate of the second, in miles.
+def distanceEarthMilesPairs(latitudes1, longitudes1, latitudes2, longitudes2):
+    if numpy is not None and len(latitudes1) > 0:
+        lat1r = numpy.radians(numpy.asarray(latitudes1, dtype=float))
+        lat2r = numpy.radians(numpy.asarray(latitudes2, dtype=float))
+        u = numpy.sin((lat2r - lat1r) / 2)
+        v = numpy.sin((numpy.radians(numpy.asarray(longitudes2, dtype=float)) -
+                       numpy.radians(numpy.asarray(longitudes1, dtype=float))) / 2)
+        a = numpy.clip(u*u + numpy.cos(lat1r) * numpy.cos(lat2r) * v*v, 0.0, 1.0)
+        return (EARTH_DIAMETER_KM * numpy.arcsin(numpy.sqrt(a)) * MILES_PER_KM).tolist()
+    sin, cos, sqrt, asin, radians = math.sin, math.cos, math.sqrt, math.asin, math.radians
+    distances = []
+    for lat1, lon1, lat2, lon2 in zip(latitudes1, longitudes1, latitudes2, longitudes2):
+        lat1r = radians(lat1)
+        lat2r = radians(lat2)
+        u = sin((lat2r - lat1r) / 2)
+        v = sin((radians(lon2) - radians(lon1)) / 2)
+        a = min(max(u*u + cos(lat1r) * cos(lat2r) * v*v, 0.0), 1.0)    # keeps NaN, as numpy.clip
+        distances.append(EARTH_DIAMETER_KM * asin(sqrt(a)) * MILES_PER_KM)
+    return distances
+
+# Computes the distances between consecutive coordinates of a polyline.
+# @return A list of the n-1 distances in miles along a polyline of n coordinates.
+def distanceEarthMilesAlong(latitudes, longitudes):
+    return distanceEarthMilesPairs(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+
+# Computes the distance between every two coordinates of a sequence.
+# @return A symmetric matrix as a list of n rows of n distances in miles, zero on the diagonal.
+def distanceEarthMilesMatrix(latitudes, longitudes):
+    n = len(latitudes)
+    if numpy is not None and n > 0:
+        latr = numpy.radians(numpy.asarray(latitudes, dtype=float))
+        lonr = numpy.radians(numpy.asarray(longitudes, dtype=float))
+        u = numpy.sin((latr[None, :] - latr[:, None]) / 2)
+        v = numpy.sin((lonr[None, :] - lonr[:, None]) / 2)
+        cosLat = numpy.cos(latr)
+        a = numpy.clip(u*u + numpy.outer(cosLat, cosLat) * v*v, 0.0, 1.0)
+        return (EARTH_DIAMETER_KM * numpy.arcsin(numpy.sqrt(a)) * MILES_PER_KM).tolist()
+    sin, sqrt, asin = math.sin, math.sqrt, math.asin
+    latr = [math.radians(latitude) for latitude in latitudes]
+    lonr = [math.radians(longitude) for longitude in longitudes]
+    cosLat = [math.cos(lat) for lat in latr]
+    matrix = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        lat1r, lon1r, cos1, row = latr[i], lonr[i], cosLat[i], matrix[i]
+        for j in range(i+1, n):
+            u = sin((latr[j] - lat1r) / 2)
+            v = sin((lonr[j] - lon1r) / 2)
+            a = min(max(u*u + cos1 * cosLat[j] * v*v, 0.0), 1.0)
+            row[j] = matrix[j][i] = EARTH_DIAMETER_KM * asin(sqrt(a)) * MILES_PER_KM
+    return matrix
+
 def segmentDistance(streetsegment):
+    if streetsegment.length is not None:
+        return streetsegment.length
     return distanceEarthMiles(streetsegment.start, streetsegment.end)
 
 def routeDistance(route):
@@ -0,0 +1,86 @@
+"""
+Compares Contraction Hierarchies with plain Dijkstra: preprocessing time, hierarchy
+size, query latency and memory, on mapdata.txt and on larger synthetic grid maps.
+Preprocessing is timed without tracing (tracemalloc slows it down several times); the
+memory columns are the size of the saved hierarchy and the traced peak of the queries.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python ContractionHierarchyBenchmark.py [number of queries]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ContractionHierarchy import ContractionHierarchy
+from PointToPointRouter import *
+from StreetMap import StreetMap
+from SyntheticMap import writeGridMap
+
+MAP_FILE   = '../GooberEatsTest/mapdata.txt'
+GRID_SIZES = [(60, 60), (100, 100)]
+
+# Routes random pairs of nodes with a router, then routes them again traced.
+# @return A tuple of (distances, mean settled nodes, mean milliseconds per query,
+#   peak traced memory of the queries in bytes).
+def runQueries(router, streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    queries = [(streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())),
+                streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())))
+               for _ in range(count)]
+    distances = []
+    settled = 0
+    begin = time.perf_counter()
+    for start, end in queries:
+        distances.append(router.generatePointToPointRoute(start, end, [])[1])
+        settled += router.settledNodeCount()
+    elapsed = time.perf_counter() - begin
+
+    tracemalloc.start()
+    for start, end in queries:
+        router.generatePointToPointRoute(start, end, [])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return distances, settled / count, elapsed * 1000 / count, peak
+
+def benchmark(title, mapFile, count):
+    streetmap = StreetMap()
+    streetmap.load(mapFile)
+    print('{0}: {1} nodes'.format(title, streetmap.nodeCount()))
+
+    hierarchy = ContractionHierarchy(streetmap)
+    begin = time.perf_counter()
+    shortcuts = hierarchy.preprocess()
+    preprocessTime = time.perf_counter() - begin
+
+    with tempfile.TemporaryDirectory() as directory:
+        hierarchyFile = os.path.join(directory, 'map.ch')
+        hierarchy.save(hierarchyFile)
+        fileSize = os.path.getsize(hierarchyFile)
+        begin = time.perf_counter()
+        hierarchy = ContractionHierarchy.load(streetmap, hierarchyFile)
+        loadTime = time.perf_counter() - begin
+    print('  preprocess {0:.2f} s   shortcuts {1}   upward edges {2}   file {3:.1f} KiB'
+        '   load {4:.1f} ms'.format(preprocessTime, shortcuts, hierarchy.upwardEdgeCount(),
+        fileSize / 1024, loadTime * 1000))
+
+    expected = None
+    for mode in (RoutingMode.DIJKSTRA, RoutingMode.CONTRACTION_HIERARCHIES):
+        router = PointToPointRouter(streetmap, mode, hierarchy)
+        distances, settled, milliseconds, peak = runQueries(router, streetmap, count)
+        if expected is None:
+            expected = distances
+        mismatches = sum(1 for a, b in zip(distances, expected) if abs(a - b) > 1e-9)
+        print('  {0:<24} settled {1:8.1f}   {2:7.2f} ms/query   peak {3:7.1f} KiB'
+            '   mismatches {4}'.format(mode.name, settled, milliseconds, peak / 1024, mismatches))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    benchmark('mapdata.txt', MAP_FILE, count)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows, cols in GRID_SIZES:
+            gridFile = os.path.join(directory, 'grid.txt')
+            writeGridMap(gridFile, rows, cols)
+            benchmark('synthetic grid {0}x{1}'.format(rows, cols), gridFile, count)
@@ -0,0 +1,45 @@
+"""
+Compares the batched great-circle distance kernels of provided with the scalar
+distanceEarthMiles: the crow distance table of an order, and the lengths of all the
+segments of mapdata.txt. The kernels are vectorized when NumPy is installed.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python DistanceKernelBenchmark.py
+"""
+import random
+import time
+
+from StreetGraph import *
+
+MAP_FILE    = '../GooberEatsTest/mapdata.txt'
+ORDER_SIZES = [50, 200, 1000]
+
+if __name__ == '__main__':
+    print('kernels {0}'.format('vectorized (NumPy)' if numpy is not None else 'pure Python'))
+    graph = StreetGraph.fromMapFile(MAP_FILE)
+    rng = random.Random(0)
+    for size in ORDER_SIZES:
+        gcs = [graph.geoCoord(rng.randrange(graph.nodeCount())) for _ in range(size + 1)]
+        begin = time.perf_counter()
+        [[distanceEarthMiles(gc1, gc2) for gc2 in gcs] for gc1 in gcs]
+        scalarTime = time.perf_counter() - begin
+        begin = time.perf_counter()
+        distanceEarthMilesMatrix([gc.latitude for gc in gcs], [gc.longitude for gc in gcs])
+        batchTime = time.perf_counter() - begin
+        print('  {0:5d} stops, crow table    scalar {1:9.1f} ms   batched {2:9.1f} ms'.format(
+            size, scalarTime * 1000, batchTime * 1000))
+
+    # every segment of the map, once
+    segments = [segment for u in range(graph.nodeCount()) for segment in graph.segmentsFrom(u)
+                if segment.start < segment.end]
+    begin = time.perf_counter()
+    [distanceEarthMiles(segment.start, segment.end) for segment in segments]
+    scalarTime = time.perf_counter() - begin
+    begin = time.perf_counter()
+    distanceEarthMilesPairs([segment.start.latitude for segment in segments],
+                            [segment.start.longitude for segment in segments],
+                            [segment.end.latitude for segment in segments],
+                            [segment.end.longitude for segment in segments])
+    batchTime = time.perf_counter() - begin
+    print('  {0:5d} segments of the map  scalar {1:9.1f} ms   batched {2:9.1f} ms'.format(
+        len(segments), scalarTime * 1000, batchTime * 1000))
@@ -0,0 +1,95 @@
+"""
+Measures what the edge lengths stored at load time save per query: a Dijkstra that
+calls distanceEarthMiles on every relaxation against the same search reading the
+weights array, and routeDistance over segments with and without a stored length.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python EdgeWeightBenchmark.py [number of queries]
+"""
+import random
+import sys
+import time
+from heapq import *
+
+from PointToPointRouter import *
+from StreetMap import StreetMap
+
+MAP_FILE = '../GooberEatsTest/mapdata.txt'
+
+# Dijkstra over the integer graph, computing every edge length with the haversine formula.
+# @param geoCoords The GeoCoords of the map by node id.
+def haversineDijkstra(streetmap, geoCoords, source, target):
+    offsets, targets, _ = streetmap.adjacency()
+    dist = {source: 0}
+    pq = [(0, source)]
+    while len(pq) > 0:
+        distance, u = heappop(pq)
+        if distance > dist[u]:
+            continue
+        if u == target:
+            return distance
+        for edge in range(offsets[u], offsets[u+1]):
+            v = targets[edge]
+            tentative_dist = distance + distanceEarthMiles(geoCoords[u], geoCoords[v])
+            if tentative_dist < dist.get(v, INFINITY):
+                dist[v] = tentative_dist
+                heappush(pq, (tentative_dist, v))
+    return -1
+
+# Dijkstra over the integer graph, reading the stored edge lengths.
+def weightDijkstra(streetmap, geoCoords, source, target):
+    offsets, targets, weights = streetmap.adjacency()
+    dist = {source: 0}
+    pq = [(0, source)]
+    while len(pq) > 0:
+        distance, u = heappop(pq)
+        if distance > dist[u]:
+            continue
+        if u == target:
+            return distance
+        for edge in range(offsets[u], offsets[u+1]):
+            v = targets[edge]
+            tentative_dist = distance + weights[edge]
+            if tentative_dist < dist.get(v, INFINITY):
+                dist[v] = tentative_dist
+                heappush(pq, (tentative_dist, v))
+    return -1
+
+def timeQueries(search, streetmap, geoCoords, queries):
+    begin = time.perf_counter()
+    distances = [search(streetmap, geoCoords, source, target) for source, target in queries]
+    return distances, (time.perf_counter() - begin) * 1000 / len(queries)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    rng = random.Random(0)
+    queries = [(rng.randrange(streetmap.nodeCount()), rng.randrange(streetmap.nodeCount()))
+               for _ in range(count)]
+
+    geoCoords = [streetmap.nodeGeoCoord(u) for u in range(streetmap.nodeCount())]
+
+    expected, haversineTime = timeQueries(haversineDijkstra, streetmap, geoCoords, queries)
+    distances, weightTime = timeQueries(weightDijkstra, streetmap, geoCoords, queries)
+    mismatches = sum(1 for a, b in zip(distances, expected) if abs(a - b) > 1e-9)
+    print('{0} queries on mapdata.txt'.format(count))
+    print('  haversine per relaxation {0:8.2f} ms/query'.format(haversineTime))
+    print('  stored edge weights      {0:8.2f} ms/query   mismatches {1}'.format(weightTime, mismatches))
+
+    router = PointToPointRouter(streetmap)
+    routes = []
+    for source, target in queries:
+        route = []
+        router.generatePointToPointRoute(streetmap.nodeGeoCoord(source),
+                                         streetmap.nodeGeoCoord(target), route)
+        routes.append(route)
+    unweighted = [[StreetSegment(s.start, s.end, s.name) for s in route] for route in routes]
+    segmentCount = sum(len(route) for route in routes)
+    for title, segmentLists in (('recomputed lengths', unweighted), ('stored lengths', routes)):
+        begin = time.perf_counter()
+        for route in segmentLists:
+            routeDistance(route)
+        elapsed = time.perf_counter() - begin
+        print('  routeDistance, {0:<18} {1:8.3f} us/segment'.format(title,
+            elapsed * 1e6 / max(segmentCount, 1)))
@@ -0,0 +1,93 @@
+"""
+Compares ExpandableHashMap, OpenAddressingHashMap and a plain dict.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python HashMapBenchmark.py [number of keys]
+
+Two workloads are measured:
+  * the GeoCoords of mapdata.txt (what StreetMap and PointToPointRouter store)
+  * N synthetic GeoCoords on a grid, N defaults to 200000 which is well past the
+    last prime (25969) of ExpandableHashMap
+"""
+import sys
+import time
+
+from provided import *
+from ExpandableHashMap import ExpandableHashMap
+from OpenAddressingHashMap import OpenAddressingHashMap
+
+MAP_FILE = '../GooberEatsTest/mapdata.txt'
+
+class DictMap(dict):
+    def find(self, key):
+        return self.get(key)
+
+    def associate(self, key, value):
+        self[key] = value
+
+ENGINES = [
+    ('ExpandableHashMap',     ExpandableHashMap),
+    ('OpenAddressingHashMap', OpenAddressingHashMap),
+    ('dict',                  DictMap),
+]
+
+# Reads every distinct GeoCoord of a map data file.
+# @param mapFile The map data file.
+# @return A list of GeoCoords (in order of first appearance).
+def mapGeoCoords(mapFile):
+    seen = set()
+    coords = []
+    with open(mapFile, 'r') as mapdata:
+        lines = mapdata.read().split('\n')
+    i = 0
+    while i + 1 < len(lines):
+        nSegments = int(lines[i+1])
+        segmentLines = lines[i+2:i+2+nSegments]
+        i += 2 + nSegments
+        for line in segmentLines:
+            parts = line.split(' ')
+            for lat, lon in ((parts[0], parts[1]), (parts[2], parts[3])):
+                if (lat, lon) not in seen:
+                    seen.add((lat, lon))
+                    coords.append(GeoCoord(lat, lon))
+    return coords
+
+# Generates n distinct GeoCoords on a square grid around Westwood.
+def gridGeoCoords(n):
+    side = int(n ** 0.5) + 1
+    coords = []
+    for i in range(side):
+        for j in range(side):
+            if len(coords) == n:
+                return coords
+            coords.append(GeoCoord('{:.7f}'.format(34.0 + i * 1e-4),
+                                   '{:.7f}'.format(-118.5 + j * 1e-4)))
+    return coords
+
+# Times insertion of every key followed by a successful and a failed lookup of each.
+# @return A tuple of (insert seconds, lookup seconds).
+def timeEngine(engineType, keys, missingKeys):
+    table = engineType()
+    begin = time.perf_counter()
+    for i, key in enumerate(keys):
+        table.associate(key, i)
+    inserted = time.perf_counter()
+    for key in keys:
+        table.find(key)
+    for key in missingKeys:
+        table.find(key)
+    found = time.perf_counter()
+    return inserted - begin, found - inserted
+
+def runWorkload(title, keys):
+    missingKeys = [GeoCoord(str(-k.latitude), k.longitudeText) for k in keys[:len(keys) // 4]]
+    print('{0}: {1} keys'.format(title, len(keys)))
+    for name, engineType in ENGINES:
+        insertTime, lookupTime = timeEngine(engineType, keys, missingKeys)
+        print('  {0:<22} insert {1:8.1f} ms   lookup {2:8.1f} ms'.format(
+            name, insertTime * 1000, lookupTime * 1000))
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    runWorkload('mapdata.txt', mapGeoCoords(MAP_FILE))
+    runWorkload('synthetic grid', gridGeoCoords(n))
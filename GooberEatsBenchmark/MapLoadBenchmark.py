@@ -0,0 +1,94 @@
+"""
+Compares StreetMap.load on the text map data with StreetMap.loadCompiled.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python MapLoadBenchmark.py [map data text file]
+
+The time to the first answer is what a freshly started worker pays, so each
+measurement loads the map and then routes one query across it. The coordinate texts
+and street names that StreetGraph.fromMapFile interns are also put into hash tables
+growing from empty and into tables reserved from the file's segment count, as the
+loader does.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from MapCompiler import compileMap
+from OpenAddressingHashMap import OpenAddressingHashMap
+from PointToPointRouter import *
+from StreetGraph import readMapFile
+from StreetMap import StreetMap
+
+MAP_FILE = '../GooberEatsTest/mapdata.txt'
+START    = GeoCoord('34.0625329', '-118.4470263')
+END      = GeoCoord('34.0712323', '-118.4505969')
+
+# Loads a map and routes one query.
+# @param loader A function that loads a StreetMap.
+# @return A tuple of (load seconds, load + first route seconds, peak bytes allocated).
+def timeLoader(loader):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    streetmap = loader()
+    loaded = time.perf_counter()
+    PointToPointRouter(streetmap).generatePointToPointRoute(START, END, [])
+    routed = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded - begin, routed - begin, peak
+
+# Interns the coordinate texts and street names of a map file like StreetGraph.fromMapFile.
+# @param rows The rows of readMapFile.
+# @param reserve Whether to size the tables from the number of rows first.
+# @return The seconds taken.
+def timeInterning(rows, reserve):
+    begin = time.perf_counter()
+    textIds = OpenAddressingHashMap()
+    nameIds = OpenAddressingHashMap()
+    if reserve:
+        textIds.reserve(len(rows))
+        nameIds.reserve(sum(1 for i in range(len(rows)) if i == 0 or rows[i][0] != rows[i-1][0]))
+    for name, lat1, lon1, lat2, lon2 in rows:
+        for text in (lat1 + ' ' + lon1, lat2 + ' ' + lon2):
+            if textIds[text] is None:
+                textIds[text] = len(textIds)
+        if nameIds[name] is None:
+            nameIds[name] = len(nameIds)
+    return time.perf_counter() - begin
+
+def textLoader(mapFile):
+    def load():
+        streetmap = StreetMap()
+        streetmap.load(mapFile)
+        return streetmap
+    return load
+
+def compiledLoader(compiledFile):
+    def load():
+        streetmap = StreetMap()
+        streetmap.loadCompiled(compiledFile)
+        return streetmap
+    return load
+
+if __name__ == '__main__':
+    mapFile = sys.argv[1] if len(sys.argv) > 1 else MAP_FILE
+    with tempfile.TemporaryDirectory() as directory:
+        compiledFile = os.path.join(directory, 'map.gmap')
+        begin = time.perf_counter()
+        nodeCount, edgeCount = compileMap(mapFile, compiledFile)
+        print('compiled {0} nodes, {1} edges in {2:.1f} ms ({3} -> {4} bytes)'.format(
+            nodeCount, edgeCount, (time.perf_counter() - begin) * 1000,
+            os.path.getsize(mapFile), os.path.getsize(compiledFile)))
+
+        for name, loader in [('load',         textLoader(mapFile)),
+                             ('loadCompiled', compiledLoader(compiledFile))]:
+            loadTime, firstRouteTime, peak = timeLoader(loader)
+            print('{0:<13} load {1:8.2f} ms   first route {2:8.2f} ms   peak {3:8.1f} KiB'.format(
+                name, loadTime * 1000, firstRouteTime * 1000, peak / 1024))
+
+    rows = list(readMapFile(mapFile))
+    for name, reserve in [('growing', False), ('reserved', True)]:
+        print('interning into {0:<9} tables {1:8.2f} ms'.format(name, timeInterning(rows, reserve) * 1000))
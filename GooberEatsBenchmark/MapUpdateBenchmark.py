@@ -0,0 +1,78 @@
+"""
+Measures live map updates against reloading the map: closing a batch of random
+segments (StreetMap.removeSegments), reopening them and adding a batch of new
+segments, on a map loaded from text and on a memory-mapped compiled map (whose
+weights are copied on the first change).
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python MapUpdateBenchmark.py [batch size]
+
+The chain graph and the spatial index are built before the updates, so the closures
+include refreshing the chain graph's super-edge lengths and the additions include
+renumbering both and walking the chains through the new segments again. A contraction hierarchy is preprocessed too, and bringing it up to
+date after the closures and reopenings (ContractionHierarchy.update, which contracts
+again only the nodes the changes reach) is timed against that.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from ContractionHierarchy import ContractionHierarchy
+from MapCompiler import compileMap
+from StreetMap import *
+
+MAP_FILE = '../GooberEatsTest/mapdata.txt'
+
+# Picks random segments of a map.
+def randomSegments(streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    offsets, _, _ = streetmap.adjacency()
+    segments = []
+    while len(segments) < count:
+        node = rng.randrange(streetmap.nodeCount())
+        if offsets[node+1] > offsets[node]:
+            segments.append(streetmap.edgeSegment(node, rng.randrange(offsets[node], offsets[node+1])))
+    return segments
+
+# Builds segments from random intersections to new coordinates next to them.
+def newSegments(streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    segments = []
+    for i in range(count):
+        start = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        end = GeoCoord('{0:.7f}'.format(start.latitude + 0.0005), '{0:.7f}'.format(start.longitude))
+        segments.append(StreetSegment(start, end, 'New Street {0}'.format(i)))
+    return segments
+
+# Times a function call in milliseconds.
+def timed(function, *args):
+    begin = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - begin) * 1000
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as directory:
+        compiledFile = os.path.join(directory, 'mapdata.gmap')
+        compileMap(MAP_FILE, compiledFile)
+        for title, load, source in [('text map', StreetMap.load, MAP_FILE),
+                                    ('compiled map', StreetMap.loadCompiled, compiledFile)]:
+            streetmap = StreetMap()
+            reload = timed(load, streetmap, source)
+            streetmap.chainGraph()
+            streetmap.nearestNode(streetmap.nodeGeoCoord(0))
+            hierarchy = ContractionHierarchy(streetmap)
+            preprocess = timed(hierarchy.preprocess)
+            segments = randomSegments(streetmap, count)
+            print('{0}: reload {1:.1f} ms   preprocess hierarchy {2:.1f} ms'.format(title, reload, preprocess))
+            print('  close  {0} segments {1:8.2f} ms   update hierarchy {2:8.2f} ms'.format(count,
+                timed(streetmap.removeSegments, segments), timed(hierarchy.update)))
+            print('  reopen {0} segments {1:8.2f} ms   update hierarchy {2:8.2f} ms'.format(count,
+                timed(streetmap.reweightSegments, [(segment, segment.length) for segment in segments]),
+                timed(hierarchy.update)))
+            print('  close  1 segment {0:10.2f} ms   update hierarchy {1:8.2f} ms'.format(
+                timed(streetmap.removeSegments, segments[:1]), timed(hierarchy.update)))
+            print('  add    {0} segments {1:8.2f} ms'.format(count, timed(streetmap.addSegments,
+                newSegments(streetmap, count))))
@@ -0,0 +1,143 @@
+"""
+Compares the delivery order optimizers on random orders of mapdata.txt intersections:
+the original annealing loop, which scores every step by recomputing the crow distance
+of two whole routes, against the delta-scored annealing of DeliveryOptimizer. Then
+compares the road miles of orders optimized for crow distance and for road distance,
+single-chain annealing with multi-start annealing on a process pool, the fixed
+annealing schedule with time-budgeted annealing, and annealing from random orders with
+the exact solver for small orders and annealing from a constructed tour for large ones.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python OptimizerBenchmark.py
+"""
+import os
+import random
+import time
+
+from DeliveryOptimizer import *
+from StreetMap import StreetMap
+
+MAP_FILE     = '../GooberEatsTest/mapdata.txt'
+ORDER_SIZES  = [5, 10, 50, 200]
+ROAD_SIZES   = [5, 10, 50]
+MULTI_SIZES  = [50, 200]
+MULTI_STARTS = [(1, 0), (8, 0), (8, 4)]     # (chains, exchanges)
+BUDGET_SIZES = [50, 200]
+BUDGETS_MS   = [10, 50, 200]
+SOLVER_SIZES = [5, 10, 12, 50, 200]
+SEEDS        = range(3)
+
+# The annealing loop DeliveryOptimizer used to run (swap moves, full rescoring).
+# @return The crow distance of the best order found.
+def legacyOptimize(depot, deliveries, rng):
+    temperature = TEMPERATURE
+    currentSolution = deliveries.copy()
+    rng.shuffle(currentSolution)
+    bestDistance = deliveryRouteCrowDistance(depot, currentSolution)
+    while temperature > 1:
+        newSolution = currentSolution.copy()
+        index1, index2 = rng.sample(range(len(deliveries)), 2)
+        swap(newSolution, index1, index2)
+        currentDistance = deliveryRouteCrowDistance(depot, currentSolution)
+        newDistance     = deliveryRouteCrowDistance(depot, newSolution)
+        if acceptanceProbability(currentDistance, newDistance, temperature) > rng.random():
+            currentSolution = newSolution
+        bestDistance = min(bestDistance, currentDistance)
+        temperature *= 1-COOLINGRATE
+    return bestDistance
+
+# @return The crow distance of the best order found by DeliveryOptimizer.
+def deltaOptimize(optimizer, depot, deliveries, rng):
+    random.seed(rng.random())
+    return optimizer.optimizeDeliveryOrder(depot, deliveries.copy())[1]
+
+# @return The road miles of delivering an order in the given sequence.
+def roadMiles(router, depot, deliveries):
+    stops = [depot] + [delivery.location for delivery in deliveries] + [depot]
+    return sum(router.generatePointToPointRoute(gc1, gc2, [])[1] for gc1, gc2 in zip(stops, stops[1:]))
+
+def randomOrder(streetmap, size, seed):
+    rng = random.Random(seed)
+    depot = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+    deliveries = [DeliveryRequest(str(i), streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())))
+                  for i in range(size)]
+    return depot, deliveries
+
+if __name__ == '__main__':
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    optimizer = DeliveryOptimizer(streetmap, solver = Solver.ANNEAL)
+    solvers = [('legacy swap', legacyOptimize),
+               ('delta annealing', lambda depot, deliveries, rng: deltaOptimize(optimizer, depot, deliveries, rng))]
+    for size in ORDER_SIZES:
+        print('{0} stops (mean of {1} orders)'.format(size, len(SEEDS)))
+        for title, solve in solvers:
+            distances = []
+            begin = time.perf_counter()
+            for seed in SEEDS:
+                depot, deliveries = randomOrder(streetmap, size, seed)
+                distances.append(solve(depot, deliveries, random.Random(seed)))
+            elapsed = (time.perf_counter() - begin) / len(SEEDS)
+            print('  {0:<18} {1:9.1f} ms   {2:8.3f} crow miles'.format(title, elapsed * 1000,
+                sum(distances) / len(distances)))
+
+    router = PointToPointRouter(streetmap)
+    for size in ROAD_SIZES:
+        print('{0} stops, road miles (mean of {1} orders)'.format(size, len(SEEDS)))
+        for metric in DistanceMetric:
+            metricOptimizer = DeliveryOptimizer(streetmap, metric)
+            miles = []
+            begin = time.perf_counter()
+            for seed in SEEDS:
+                depot, deliveries = randomOrder(streetmap, size, seed)
+                random.seed(seed)
+                metricOptimizer.optimizeDeliveryOrder(depot, deliveries)
+                miles.append(roadMiles(router, depot, deliveries))
+            elapsed = (time.perf_counter() - begin) / len(SEEDS)
+            print('  optimized for {0:<5} {1:9.1f} ms   {2:8.3f} road miles'.format(metric.name,
+                elapsed * 1000, sum(miles) / len(miles)))
+
+    for size in MULTI_SIZES:
+        print('{0} stops, multi-start on {1} processes (mean of {2} orders)'.format(size,
+            os.cpu_count(), len(SEEDS)))
+        for chains, exchanges in MULTI_STARTS:
+            multiOptimizer = DeliveryOptimizer(streetmap, chains = chains, processes = os.cpu_count(),
+                seed = 0, exchanges = exchanges)
+            distances = []
+            begin = time.perf_counter()
+            for seed in SEEDS:
+                depot, deliveries = randomOrder(streetmap, size, seed)
+                distances.append(multiOptimizer.optimizeDeliveryOrder(depot, deliveries)[1])
+            elapsed = (time.perf_counter() - begin) / len(SEEDS)
+            multiOptimizer.close()
+            print('  {0} chains, {1} exchanges {2:9.1f} ms   {3:8.3f} crow miles'.format(chains,
+                exchanges, elapsed * 1000, sum(distances) / len(distances)))
+
+    for size in BUDGET_SIZES:
+        print('{0} stops, time budgets (mean of {1} orders)'.format(size, len(SEEDS)))
+        for budget in [None] + BUDGETS_MS:
+            budgetOptimizer = DeliveryOptimizer(streetmap, seed = 0)
+            distances, worst = [], 0
+            for seed in SEEDS:
+                depot, deliveries = randomOrder(streetmap, size, seed)
+                begin = time.perf_counter()
+                distances.append(budgetOptimizer.optimizeDeliveryOrder(depot, deliveries, budget)[1])
+                worst = max(worst, time.perf_counter() - begin)
+            print('  budget {0:>8}   worst {1:9.1f} ms   {2:8.3f} crow miles'.format(
+                'fixed' if budget is None else '{0} ms'.format(budget), worst * 1000,
+                sum(distances) / len(distances)))
+
+    for size in SOLVER_SIZES:
+        print('{0} stops, solvers (mean of {1} orders)'.format(size, len(SEEDS)))
+        for solver in Solver:
+            for budget in [None, BUDGETS_MS[-1]]:
+                solverOptimizer = DeliveryOptimizer(streetmap, seed = 0, solver = solver)
+                distances = []
+                begin = time.perf_counter()
+                for seed in SEEDS:
+                    depot, deliveries = randomOrder(streetmap, size, seed)
+                    distances.append(solverOptimizer.optimizeDeliveryOrder(depot, deliveries, budget)[1])
+                elapsed = (time.perf_counter() - begin) / len(SEEDS)
+                print('  {0:<6} budget {1:>8} {2:9.1f} ms   {3:8.3f} crow miles'.format(solver.name,
+                    'fixed' if budget is None else '{0} ms'.format(budget), elapsed * 1000,
+                    sum(distances) / len(distances)))
@@ -0,0 +1,45 @@
+"""
+Compares routing the legs of a delivery plan one after another with routing them on
+a RoutePool, for batches of random stops on mapdata.txt.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python PlannerBenchmark.py [number of processes]
+"""
+import os
+import random
+import sys
+import time
+
+from RoutePool import *
+from StreetMap import StreetMap
+
+MAP_FILE    = '../GooberEatsTest/mapdata.txt'
+STOP_COUNTS = [10, 50, 100]
+
+# Draws a depot and random stops and returns the legs of the tour through them in order.
+def randomLegs(streetmap, stopCount, seed = 0):
+    rng = random.Random(seed)
+    stops = [streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+             for _ in range(stopCount + 1)]
+    stops.append(stops[0])
+    return list(zip(stops, stops[1:]))
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    router = PointToPointRouter(streetmap)
+    with RoutePool(streetmap, processes) as pool:
+        pool.routeLegs(randomLegs(streetmap, processes))    # start the workers
+        print('{0} worker processes'.format(pool.processCount()))
+        for stopCount in STOP_COUNTS:
+            legs = randomLegs(streetmap, stopCount)
+            begin = time.perf_counter()
+            expected = [router.generatePointToPointRoute(start, end, [])[1] for start, end in legs]
+            serialTime = time.perf_counter() - begin
+            begin = time.perf_counter()
+            distances = [distance for _, distance, _ in pool.routeLegs(legs)]
+            parallelTime = time.perf_counter() - begin
+            print('  {0:4d} stops   serial {1:8.1f} ms   pool {2:8.1f} ms   speedup {3:5.2f}'
+                '   mismatches {4}'.format(stopCount, serialTime * 1000, parallelTime * 1000,
+                serialTime / parallelTime, sum(1 for a, b in zip(distances, expected) if a != b)))
@@ -0,0 +1,71 @@
+"""
+Compares the routing modes of PointToPointRouter on mapdata.txt.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python RoutingBenchmark.py [number of queries]
+
+Queries are random pairs of intersections, split into short hops (less than a mile
+apart, like consecutive deliveries) and long legs, and every mode is checked to
+return the same distance as Dijkstra. The contraction hierarchy is preprocessed once
+and the chains of degree-2 nodes are collapsed once, both outside the timed queries
+(see ContractionHierarchyBenchmark.py for the cost of the hierarchy).
+"""
+import random
+import sys
+import time
+
+from ContractionHierarchy import ContractionHierarchy
+from PointToPointRouter import *
+from StreetMap import StreetMap
+
+MAP_FILE = '../GooberEatsTest/mapdata.txt'
+SHORT_HOP_MILES = 1.0
+MODES = list(RoutingMode)
+
+# Draws random pairs of intersections.
+# @return A tuple of (short hop pairs, long leg pairs), count of each.
+def randomQueries(streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    short, long = [], []
+    while len(short) < count or len(long) < count:
+        start = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        end   = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        queries = short if distanceEarthMiles(start, end) < SHORT_HOP_MILES else long
+        if len(queries) < count:
+            queries.append((start, end))
+    return short, long
+
+# Routes every query with a router.
+# @return A tuple of (distances, mean settled nodes, mean milliseconds per query).
+def runQueries(router, queries):
+    distances = []
+    settled = 0
+    begin = time.perf_counter()
+    for start, end in queries:
+        _, distance = router.generatePointToPointRoute(start, end, [])
+        distances.append(distance)
+        settled += router.settledNodeCount()
+    elapsed = time.perf_counter() - begin
+    return distances, settled / len(queries), elapsed * 1000 / len(queries)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    hierarchy = ContractionHierarchy(streetmap)
+    hierarchy.preprocess()
+    begin = time.perf_counter()
+    chainGraph = streetmap.chainGraph()
+    print('collapsed chains in {0:.1f} ms: {1} -> {2} nodes, {3} -> {4} directed edges'.format(
+        (time.perf_counter() - begin) * 1000, streetmap.nodeCount(), chainGraph.coreNodeCount(),
+        len(streetmap.adjacency()[1]), chainGraph.superEdgeCount()))
+    for title, queries in zip(['short hops', 'long legs'], randomQueries(streetmap, count)):
+        print('{0}: {1} queries'.format(title, len(queries)))
+        expected = None
+        for mode in MODES:
+            distances, settled, milliseconds = runQueries(PointToPointRouter(streetmap, mode, hierarchy), queries)
+            if expected is None:
+                expected = distances
+            mismatches = sum(1 for a, b in zip(distances, expected) if abs(a - b) > 1e-9)
+            print('  {0:<24} settled {1:8.1f}   {2:7.2f} ms/query   mismatches {3}'.format(
+                mode.name, settled, milliseconds, mismatches))
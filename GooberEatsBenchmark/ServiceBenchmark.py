@@ -0,0 +1,57 @@
+"""
+A local client stand-in for RoutingService: starts the service on mapdata.txt, sends
+bursts of concurrent route requests from a few depots over its socket and reports the
+latencies the service measured, with and without coalescing.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python ServiceBenchmark.py [requests per burst]
+"""
+import asyncio
+import json
+import random
+import sys
+import time
+
+from RoutingService import *
+
+MAP_FILE     = '../GooberEatsTest/mapdata.txt'
+DEPOT_COUNT  = 3
+WINDOWS      = [None, COALESCE_WINDOW]
+
+async def burst(streetmap, window, count, seed = 0):
+    rng = random.Random(seed)
+    depots = [streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())) for _ in range(DEPOT_COUNT)]
+    requests = []
+    for i in range(count):
+        start = depots[i % DEPOT_COUNT]
+        end   = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        requests.append({'id': i, 'type': 'route', 'start': [start.latitudeText, start.longitudeText],
+                         'end': [end.latitudeText, end.longitudeText]})
+
+    service = RoutingService(streetmap, window)
+    port = await service.start()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    begin = time.perf_counter()
+    for request in requests:
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+    await writer.drain()
+    for _ in requests:
+        await reader.readline()
+    elapsed = time.perf_counter() - begin
+    writer.close()
+    await writer.wait_closed()
+    await service.close()
+
+    stats = service.stats()
+    print('  window {0:>8}   batches {1:4d}   total {2:8.1f} ms   mean {3:8.1f} ms'
+        '   p50 {4:8.1f} ms   p95 {5:8.1f} ms'.format(
+        'off' if window is None else '{0:g} ms'.format(window * 1000), stats['routeBatches'],
+        elapsed * 1000, stats['meanMs'], stats['p50Ms'], stats['p95Ms']))
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    print('{0} route requests from {1} depots'.format(count, DEPOT_COUNT))
+    for window in WINDOWS:
+        asyncio.run(burst(streetmap, window, count))
@@ -0,0 +1,57 @@
+"""
+Measures snapping random coordinates to the streets of mapdata.txt: building the
+spatial index, nearestNode against a scan of every node, and snapGeoCoords for
+batches of delivery locations near the streets.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python SnapBenchmark.py
+"""
+import random
+import time
+
+from StreetMap import *
+
+MAP_FILE      = '../GooberEatsTest/mapdata.txt'
+SCAN_QUERIES  = 20
+BATCH_SIZES   = [100, 1000, 5000]
+JITTER        = 0.001
+
+# Draws coordinates the way geocoded addresses fall: up to JITTER degrees (about a
+# block) off random intersections.
+def randomGeoCoords(streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    geoCoords = []
+    for _ in range(count):
+        node = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        geoCoords.append(GeoCoord('{0:.7f}'.format(node.latitude + rng.uniform(-JITTER, JITTER)),
+                                  '{0:.7f}'.format(node.longitude + rng.uniform(-JITTER, JITTER))))
+    return geoCoords
+
+if __name__ == '__main__':
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    begin = time.perf_counter()
+    streetmap.nearestNode(streetmap.nodeGeoCoord(0))
+    print('{0} nodes, index built in {1:.1f} ms'.format(streetmap.nodeCount(),
+        (time.perf_counter() - begin) * 1000))
+
+    geoCoords = randomGeoCoords(streetmap, SCAN_QUERIES)
+    nodes = [streetmap.nodeGeoCoord(i) for i in range(streetmap.nodeCount())]
+    begin = time.perf_counter()
+    for gc in geoCoords:
+        min(nodes, key = lambda node: distanceEarthMiles(gc, node))
+    scanTime = (time.perf_counter() - begin) / len(geoCoords)
+    begin = time.perf_counter()
+    for gc in geoCoords:
+        streetmap.nearestNode(gc)
+    indexTime = (time.perf_counter() - begin) / len(geoCoords)
+    print('  nearestNode   scan {0:8.3f} ms   index {1:8.3f} ms per query'.format(
+        scanTime * 1000, indexTime * 1000))
+
+    for size in BATCH_SIZES:
+        geoCoords = randomGeoCoords(streetmap, size, size)
+        begin = time.perf_counter()
+        snapped = streetmap.snapGeoCoords(geoCoords)
+        elapsed = time.perf_counter() - begin
+        print('  snap {0:5d} locations {1:9.1f} ms   {2:9.0f} per minute   mean move {3:.3f} miles'.format(
+            size, elapsed * 1000, size / elapsed * 60, sum(distance for _, distance in snapped) / size))
@@ -0,0 +1,68 @@
+"""
+Compares DeliveryPlanner.generateDeliveryPlan with streamDeliveryPlan for plans of
+random stops on mapdata.txt: the time until the first delivery command is ready, the
+time for the whole plan and the peak memory allocated while generating it.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python StreamingPlanBenchmark.py
+
+Both planners order the stops within the same short time budget, which is part of
+every measured time (and of the time to the first command).
+"""
+import random
+import time
+import tracemalloc
+
+from DeliveryPlanner import *
+from StreetMap import StreetMap
+
+MAP_FILE      = '../GooberEatsTest/mapdata.txt'
+STOP_COUNTS   = [10, 50, 200]
+TIME_BUDGET   = 100
+
+# Draws a depot and delivery requests at random intersections reachable from it.
+def randomPlan(streetmap, stopCount, seed = 0):
+    rng = random.Random(seed)
+    depot = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+    candidates = [streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())) for _ in range(2 * stopCount)]
+    distances = PointToPointRouter(streetmap).distanceMatrix([depot], candidates)[0]
+    locations = [gc for gc, distance in zip(candidates, distances) if distance >= 0][:stopCount]
+    return depot, [DeliveryRequest('item {0}'.format(i), location) for i, location in enumerate(locations)]
+
+# Generates a plan all at once.
+# @return A tuple of (ms to the first command, ms in total, peak bytes, command count).
+def batchPlan(planner, depot, deliveries):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    commands = []
+    planner.generateDeliveryPlan(depot, deliveries, commands, TIME_BUDGET)
+    elapsed = (time.perf_counter() - begin) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, elapsed, peak, len(commands)
+
+# Generates a plan command by command, as a driver app reading the stream would.
+# @return The same as batchPlan.
+def streamedPlan(planner, depot, deliveries):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    stream = planner.streamDeliveryPlan(depot, deliveries, TIME_BUDGET)
+    next(stream)
+    first = (time.perf_counter() - begin) * 1000
+    count = 1 + sum(1 for _ in stream)
+    elapsed = (time.perf_counter() - begin) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, elapsed, peak, count
+
+if __name__ == '__main__':
+    streetmap = StreetMap()
+    streetmap.load(MAP_FILE)
+    for stopCount in STOP_COUNTS:
+        print('{0} stops'.format(stopCount))
+        for title, plan in [('batch', batchPlan), ('stream', streamedPlan)]:
+            planner = DeliveryPlanner(streetmap)
+            depot, deliveries = randomPlan(streetmap, stopCount)
+            first, elapsed, peak, count = plan(planner, depot, deliveries)
+            print('  {0:<7} first command {1:8.1f} ms   all {2:5d} commands {3:8.1f} ms   peak {4:7.0f} KB'.format(
+                title, first, count, elapsed, peak / 1024))
@@ -0,0 +1,63 @@
+"""
+Writes synthetic street maps in the text format of mapdata.txt, for benchmarking on
+maps larger than the Westwood data.
+
+The map is a grid of avenues (rows) and streets (columns) around Westwood, with
+jittered intersections, every block split into a few curved segments (like Open Street
+Map splits its streets) and a fraction of the blocks missing.
+"""
+import random
+
+ORIGIN_LATITUDE  = 34.0
+ORIGIN_LONGITUDE = -118.5
+BLOCK_DEGREES    = 0.001
+
+# Writes a synthetic grid map.
+# @param mapFile The text file to be written.
+# @param rows The number of east-west avenues.
+# @param cols The number of north-south streets.
+# @param segmentsPerBlock The number of segments every block is split into.
+# @param missingBlocks The fraction of blocks left out.
+# @param seed The seed of the random jitter.
+# @return The number of segments written.
+def writeGridMap(mapFile, rows, cols, segmentsPerBlock = 3, missingBlocks = 0.1, seed = 0):
+    rng = random.Random(seed)
+    def coordinate(i, j):
+        return (ORIGIN_LATITUDE + (i + rng.uniform(-0.2, 0.2)) * BLOCK_DEGREES,
+                ORIGIN_LONGITUDE + (j + rng.uniform(-0.2, 0.2)) * BLOCK_DEGREES)
+    intersections = [[coordinate(i, j) for j in range(cols)] for i in range(rows)]
+
+    def blockSegments(start, end):
+        points = [start]
+        for k in range(1, segmentsPerBlock):
+            t = k / segmentsPerBlock
+            points.append((start[0] + (end[0] - start[0]) * t + rng.uniform(-1e-5, 1e-5),
+                           start[1] + (end[1] - start[1]) * t + rng.uniform(-1e-5, 1e-5)))
+        points.append(end)
+        return ['{0:.7f} {1:.7f} {2:.7f} {3:.7f}'.format(a[0], a[1], b[0], b[1])
+                for a, b in zip(points, points[1:])]
+
+    streets = []
+    for i in range(rows):
+        segments = []
+        for j in range(cols - 1):
+            if rng.random() >= missingBlocks:
+                segments += blockSegments(intersections[i][j], intersections[i][j+1])
+        streets.append(('Avenue {0}'.format(i), segments))
+    for j in range(cols):
+        segments = []
+        for i in range(rows - 1):
+            if rng.random() >= missingBlocks:
+                segments += blockSegments(intersections[i][j], intersections[i+1][j])
+        streets.append(('Street {0}'.format(j), segments))
+
+    segmentCount = 0
+    with open(mapFile, 'w') as output:
+        for name, segments in streets:
+            if len(segments) == 0:
+                continue
+            output.write(name + '\n' + str(len(segments)) + '\n')
+            for segment in segments:
+                output.write(segment + '\n')
+            segmentCount += len(segments)
+    return segmentCount
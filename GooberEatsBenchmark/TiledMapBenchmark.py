@@ -0,0 +1,68 @@
+"""
+Compares routing on a tiled map (StreetMap.loadTiled) with the whole compiled map
+under different memory caps: tile loads, memory held and milliseconds per query.
+
+Run from this directory with the sources on the path, e.g.
+    PYTHONPATH=../GooberEats python TiledMapBenchmark.py [number of queries]
+
+Queries are short hops between random intersections, the usual leg of a delivery
+route, so a route touches a few neighboring tiles; a small cap makes consecutive
+queries reload the tiles the previous ones evicted.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from MapCompiler import *
+from PointToPointRouter import *
+from StreetMap import StreetMap
+
+MAP_FILE        = '../GooberEatsTest/mapdata.txt'
+TILE_DEGREES    = [0.01, 0.02, 0.05]
+MAX_BYTES       = [100 * 1024, 400 * 1024, 64 * 1024 * 1024]
+SHORT_HOP_MILES = 1.0
+
+# Draws random pairs of intersections less than SHORT_HOP_MILES apart.
+def randomHops(streetmap, count, seed = 0):
+    rng = random.Random(seed)
+    hops = []
+    while len(hops) < count:
+        start = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        end   = streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))
+        if distanceEarthMiles(start, end) < SHORT_HOP_MILES:
+            hops.append((start, end))
+    return hops
+
+# Routes every query with A*.
+# @return The mean milliseconds per query.
+def runQueries(streetmap, queries):
+    router = PointToPointRouter(streetmap, RoutingMode.ASTAR)
+    begin = time.perf_counter()
+    for start, end in queries:
+        router.generatePointToPointRoute(start, end, [])
+    return (time.perf_counter() - begin) * 1000 / len(queries)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as directory:
+        compiledFile = os.path.join(directory, 'mapdata.gmap')
+        compileMap(MAP_FILE, compiledFile)
+        compiledMap = StreetMap()
+        compiledMap.loadCompiled(compiledFile)
+        queries = randomHops(compiledMap, count)
+        print('whole map: {0} KB   {1:7.2f} ms/query'.format(
+            os.path.getsize(compiledFile) // 1024, runQueries(compiledMap, queries)))
+
+        for tileDegrees in TILE_DEGREES:
+            tileDirectory = os.path.join(directory, 'tiles{0}'.format(tileDegrees))
+            _, _, tileCount = compileTiledMap(MAP_FILE, tileDirectory, tileDegrees)
+            print('{0} degree tiles: {1} tiles'.format(tileDegrees, tileCount))
+            for maxBytes in MAX_BYTES:
+                tiledMap = StreetMap()
+                tiledMap.loadTiled(tileDirectory, maxBytes)
+                milliseconds = runQueries(tiledMap, queries)
+                loaded, loadedBytes, loads = tiledMap.tileStats()
+                print('  cap {0:6d} KB   {1:7.2f} ms/query   {2:6d} tile loads   {3:3d} tiles ({4} KB) held'.format(
+                    maxBytes // 1024, milliseconds, loads, loaded, loadedBytes // 1024))
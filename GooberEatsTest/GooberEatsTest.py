@@ -1,9 +1,26 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
+import provided
 from provided import *
 from ExpandableHashMap import *
+from OpenAddressingHashMap import *
+from MapCompiler import *
 from StreetMap import *
+from SpatialIndex import *
+from ContractionHierarchy import *
 from PointToPointRouter import *
+from RoutePool import *
+from RoutingService import *
 from DeliveryOptimizer import *
 from DeliveryPlanner import *
 
@@ -44,6 +61,15 @@ def routeContainsTheseGeoCoords(route, expectedGeoCoords):
         i += 1
     return True
 
+# A stand-in for the time module whose clock advances a millisecond every time it is read.
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        self.now += 0.001
+        return self.now
+
 def printDeliveryCommands(commands):
     print()
     for command in commands:
@@ -55,6 +81,25 @@ class utilityFunctionTest(unittest.TestCase):
         self.assertEqual(gc1, GeoCoord("34.0547000", "-118.4794734") )
         self.assertEqual(gc2, GeoCoord("34.0544590", "-118.4801137") )
 
+    def test_geoCoordKey(self):
+        gc = GeoCoord('34.0547000', '-118.4794734')
+        self.assertFalse(hasattr(gc, '__dict__'))
+        self.assertFalse(hasattr(StreetSegment(gc, gc, ''), '__dict__'))
+        self.assertEqual(gc, GeoCoord('34.0547', '-118.4794734'))
+        self.assertEqual(hash(gc), hash(GeoCoord('34.0547', '-118.4794734')))
+        self.assertNotEqual(gc, GeoCoord('34.0547001', '-118.4794734'))
+        self.assertLess(GeoCoord('9', '0'), GeoCoord('10', '0'))
+        self.assertEqual(GeoCoord('inf', 'inf'), GeoCoord('inf', 'inf'))
+        self.assertNotEqual(GeoCoord('inf', 'inf'), gc)
+
+    def test_geoCoordsAreInterned(self):
+        route = []
+        router2.generatePointToPointRoute(GeoCoord('34.0625329', '-118.4470263'),
+            GeoCoord('34.0712323', '-118.4505969'), route)
+        for seg1, seg2 in zip(route, route[1:]):
+            self.assertIs(seg1.end, seg2.start)
+        self.assertIs(streetmap.nodeGeoCoord(streetmap.nodeId(route[0].end)), route[0].end)
+
     def test_routeDistance(self):
         start = GeoCoord('0', '0')
         end   = GeoCoord('2', '3')
@@ -67,6 +112,60 @@ class utilityFunctionTest(unittest.TestCase):
         self.assertEqual(route[0].name, 'A Street')
         self.assertEqual(route[1].name, 'A Street')
 
+    def test_distanceKernels(self):
+        rng = random.Random(4)
+        gcs = [GeoCoord(str(rng.uniform(-80, 80)), str(rng.uniform(-179, 179))) for _ in range(20)]
+        gcs.append(gcs[0])
+        latitudes, longitudes = [gc.latitude for gc in gcs], [gc.longitude for gc in gcs]
+        for kernelNumpy in [provided.numpy, None]:
+            with unittest.mock.patch.object(provided, 'numpy', kernelNumpy):
+                matrix = distanceEarthMilesMatrix(latitudes, longitudes)
+                for i, gc1 in enumerate(gcs):
+                    for j, gc2 in enumerate(gcs):
+                        self.assertAlmostEqual(matrix[i][j], distanceEarthMiles(gc1, gc2), 9)
+                pairs = distanceEarthMilesPairs(latitudes, longitudes, latitudes[::-1], longitudes[::-1])
+                for gc1, gc2, distance in zip(gcs, gcs[::-1], pairs):
+                    self.assertAlmostEqual(distance, distanceEarthMiles(gc1, gc2), 9)
+                along = distanceEarthMilesAlong(latitudes, longitudes)
+                self.assertEqual(len(along), len(gcs) - 1)
+                for gc1, gc2, distance in zip(gcs, gcs[1:], along):
+                    self.assertAlmostEqual(distance, distanceEarthMiles(gc1, gc2), 9)
+                self.assertEqual(distanceEarthMilesMatrix([], []), [])
+                self.assertEqual(distanceEarthMilesAlong(latitudes[:1], longitudes[:1]), [])
+
+    def test_distanceKernelsNearAntipodes(self):
+        # the haversine term of these coordinates rounds to just above 1, which the kernels
+        # clamp to 1 before taking the arcsine
+        latitudes  = [-2.7592273749760636, 2.7592273749760636]
+        longitudes = [-2.5940268611821864, -2.5940268611821864 + 180]
+        halfCircumference = EARTH_DIAMETER_KM * 3.141592653589793 / 2 * MILES_PER_KM
+        for kernelNumpy in [provided.numpy, None]:
+            with unittest.mock.patch.object(provided, 'numpy', kernelNumpy):
+                pairs = distanceEarthMilesPairs(latitudes[:1], longitudes[:1], latitudes[1:], longitudes[1:])
+                self.assertAlmostEqual(pairs[0], halfCircumference, 6)
+                self.assertAlmostEqual(distanceEarthMilesAlong(latitudes, longitudes)[0], halfCircumference, 6)
+                self.assertAlmostEqual(distanceEarthMilesMatrix(latitudes, longitudes)[0][1], halfCircumference, 6)
+
+    @unittest.skipIf(provided.numpy is None, 'NumPy is not installed')
+    def test_distanceKernelsWithAndWithoutNumpy(self):
+        rng = random.Random(5)
+        latitudes  = [rng.uniform(-90, 90) for _ in range(40)] + [-2.7592273749760636, float('nan')]
+        longitudes = [rng.uniform(-180, 180) for _ in range(40)] + [-2.5940268611821864, 0.0]
+        antipodes  = [-latitude for latitude in latitudes], [longitude + 180 for longitude in longitudes]
+        results = []
+        for kernelNumpy in [provided.numpy, None]:
+            with unittest.mock.patch.object(provided, 'numpy', kernelNumpy):
+                results.append(distanceEarthMilesPairs(latitudes, longitudes, *antipodes) +
+                               distanceEarthMilesAlong(latitudes, longitudes) +
+                               sum(distanceEarthMilesMatrix(latitudes + antipodes[0], longitudes + antipodes[1]), []))
+        vectorized, pure = results
+        self.assertEqual(len(vectorized), len(pure))
+        for vectorDistance, pureDistance in zip(vectorized, pure):
+            if pureDistance != pureDistance:
+                self.assertNotEqual(vectorDistance, vectorDistance)
+            else:
+                self.assertAlmostEqual(vectorDistance, pureDistance, 9)
+
     def test_routeContainsTheseGeoCoords(self):
         start = GeoCoord('0', '0')
         end   = GeoCoord('1', '1')
@@ -154,8 +253,93 @@ class ExpandableHashMapTest(unittest.TestCase):
         self.assertEqual(hashtables[1]['cookie'], 'dessert')
         self.test_size()
 
+    def test_reserve(self):
+        table = ExpandableHashMap()
+        table.reserve(4)
+        self.assertEqual(table._ExpandableHashMap__capacity, 8)
+        table.reserve(1000)
+        self.assertEqual(table._ExpandableHashMap__capacity, 3191)
+        for i in range(1000):
+            table[i] = str(i)
+        self.assertEqual(table._ExpandableHashMap__capacity, 3191)
+        self.assertEqual(table.size(), 1000)
+        self.assertEqual(table[999], '999')
+        table.reserve(10 ** 6)
+        self.assertEqual(table._ExpandableHashMap__capacity, primeNumberList[-1])
+        self.assertEqual(table[999], '999')
+
+    def test_rehashMovesNodes(self):
+        table = ExpandableHashMap()
+        for i in range(4):
+            table[i] = str(i)
+        nodes = [node for bucket in table._ExpandableHashMap__table for node in bucket]
+        table[4] = '4'
+        self.assertEqual(table._ExpandableHashMap__capacity, 11)
+        for node in nodes:
+            self.assertIs(table._ExpandableHashMap__table[hash(node.key) % 11][0], node)
+
+    def test_fromItems(self):
+        table = ExpandableHashMap.fromItems((i, i * i) for i in range(500))
+        self.assertEqual(table.size(), 500)
+        self.assertEqual(table._ExpandableHashMap__capacity, 1597)
+        self.assertEqual(table[20], 400)
+        self.assertIsNone(table[500])
+        table = ExpandableHashMap.fromItems([('apple', 'fruit'), ('apple', 'carbohydrate source')])
+        self.assertEqual(table.size(), 1)
+        self.assertEqual(table['apple'], 'carbohydrate source')
+
+class OpenAddressingHashMapTest(unittest.TestCase):
+
+    def test_associate_find(self):
+        table = OpenAddressingHashMap()
+        self.assertIsNone(table.find('cookie'))
+        self.assertIsNone(table[None])
+        table['cookie'] = 'chocolate chip'
+        table.associate('cookie', 'dessert')
+        table[None] = 'nothing'
+        self.assertEqual(table['cookie'], 'dessert')
+        self.assertEqual(table[None], 'nothing')
+        self.assertEqual(table.size(), 2)
+
+    def test_growsPastLastPrime(self):
+        table = OpenAddressingHashMap()
+        n = 2 * primeNumberList[-1]
+        for i in range(n):
+            table[GeoCoord(str(i), str(-i))] = i
+        self.assertEqual(table.size(), n)
+        self.assertGreaterEqual(table._OpenAddressingHashMap__capacity, 2 * n)
+        for i in range(0, n, 97):
+            self.assertEqual(table[GeoCoord(str(i), str(-i))], i)
+        self.assertIsNone(table[GeoCoord(str(n), str(-n))])
+
+    def test_collidingHashes(self):
+        class Collider:
+            def __init__(self, value):
+                self.value = value
+            def __eq__(self, other):
+                return self.value == other.value
+            def __hash__(self):
+                return 42
+
+        table = OpenAddressingHashMap()
+        for i in range(100):
+            table[Collider(i)] = i
+        for i in range(100):
+            self.assertEqual(table[Collider(i)], i)
+        self.assertIsNone(table[Collider(100)])
+        self.assertEqual(sorted(value for _, value in table.items()), list(range(100)))
+
+    def test_reserve_fromItems(self):
+        table = OpenAddressingHashMap()
+        table.reserve(1000)
+        self.assertEqual(table._OpenAddressingHashMap__capacity, 2048)
+        table = OpenAddressingHashMap.fromItems((str(i), i) for i in range(1000))
+        self.assertEqual(table._OpenAddressingHashMap__capacity, 2048)
+        self.assertEqual(table.size(), 1000)
+        self.assertEqual(table['999'], 999)
+
 class StreetMapTest(unittest.TestCase):
-    
+
     def test_getSegmentsThatStartWith(self):   
         segments = []
         gc = GeoCoord("34.0547000", "-118.4794734")
@@ -191,6 +375,176 @@ class StreetMapTest(unittest.TestCase):
         with self.assertRaises(FileNotFoundError):
             streetmap.load("BAD_FILE_NAME")
 
+    def test_iterSegmentsFrom(self):
+        gc = GeoCoord("34.0356922", "-118.4937358")
+        segments = []
+        streetmap.getSegmentsThatStartWith(gc, segments)
+        self.assertEqual(list(streetmap.iterSegmentsFrom(gc)), segments)
+        for copied, stored in zip(segments, streetmap.iterSegmentsFrom(gc)):
+            self.assertIs(copied, stored)
+
+        # modifying the out-parameter list does not touch the stored segments
+        segments.clear()
+        self.assertEqual(len(list(streetmap.iterSegmentsFrom(gc))), 4)
+        self.assertEqual(list(streetmap.iterSegmentsFrom(GeoCoord('inf', 'inf'))), [])
+
+    def test_nodeIds(self):
+        self.assertEqual(imaginationMap.nodeCount(), 16)
+        self.assertEqual(streetmap.nodeCount(), 18055)
+        self.assertIsNone(imaginationMap.nodeId(GeoCoord('inf', 'inf')))
+        self.assertIsNone(imaginationMap.nodeId(GeoCoord('43', '43')))
+        ids = set()
+        for gc in [GeoCoord('0', '0'), GeoCoord('0', '19'), GeoCoord('53', '20')]:
+            nodeId = imaginationMap.nodeId(gc)
+            self.assertEqual(imaginationMap.nodeGeoCoord(nodeId), gc)
+            ids.add(nodeId)
+        self.assertEqual(len(ids), 3)
+
+    def test_neighbors(self):
+        gc = GeoCoord("34.0356922", "-118.4937358")
+        segments = []
+        streetmap.getSegmentsThatStartWith(gc, segments)
+        nodeId = streetmap.nodeId(gc)
+        neighbors = list(streetmap.neighbors(nodeId))
+        offsets, targets, weights = streetmap.adjacency()
+        self.assertEqual(len(neighbors), offsets[nodeId+1] - offsets[nodeId])
+        self.assertEqual(len(neighbors), len(segments))
+        for (target, weight, edge), segment in zip(neighbors, segments):
+            self.assertEqual(targets[edge], target)
+            self.assertEqual(weights[edge], weight)
+            self.assertEqual(streetmap.nodeGeoCoord(target), segment.end)
+            self.assertEqual(weight, segmentDistance(segment))
+            self.assertIs(streetmap.edgeSegment(nodeId, edge), segments[edge - offsets[nodeId]])
+
+    def test_segmentLengths(self):
+        segments = []
+        streetmap.getSegmentsThatStartWith(GeoCoord("34.0356922", "-118.4937358"), segments)
+        for segment in segments:
+            self.assertAlmostEqual(segment.length, distanceEarthMiles(segment.start, segment.end))
+            self.assertEqual(segmentDistance(segment), segment.length)
+            unweighted = StreetSegment(segment.start, segment.end, segment.name)
+            self.assertIsNone(unweighted.length)
+            self.assertEqual(unweighted, segment)
+            self.assertEqual(segmentDistance(unweighted), segment.length)
+        self.assertIsNone(segments[0].reversed().length)
+
+class MapCompilerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.compiledFile = os.path.join(cls.directory.name, 'mapdata.gmap')
+        cls.nodeCount, cls.edgeCount = compileMap('mapdata.txt', cls.compiledFile)
+        cls.compiledMap = StreetMap()
+        cls.compiledMap.loadCompiled(cls.compiledFile)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_counts(self):
+        self.assertEqual(self.nodeCount, 18055)
+        self.assertEqual(self.edgeCount, 2 * sum(1 for _ in readMapFile('mapdata.txt')))
+
+    def test_coordinateKey(self):
+        self.assertLess(coordinateKey(34.05, -118.5), coordinateKey(34.05, -118.4))
+        self.assertLess(coordinateKey(34.05, 100), coordinateKey(34.06, -118.4))
+        self.assertIsNone(coordinateKey(float('inf'), float('inf')))
+
+    def test_getSegmentsThatStartWith(self):
+        for gc in [GeoCoord("34.0547000", "-118.4794734"), GeoCoord("34.0544590", "-118.4801137"),
+                   GeoCoord("34.0420561", "-118.5011699"), GeoCoord("34.0356922", "-118.4937358")]:
+            expected = []
+            segments = []
+            streetmap.getSegmentsThatStartWith(gc, expected)
+            self.compiledMap.getSegmentsThatStartWith(gc, segments)
+            self.assertEqual(segments, expected)
+
+        segments = ['unchanged']
+        self.compiledMap.getSegmentsThatStartWith(GeoCoord('inf', 'inf'), segments)
+        self.compiledMap.getSegmentsThatStartWith(GeoCoord('34.0547001', '-118.4794734'), segments)
+        self.assertEqual(segments, ['unchanged'])
+
+        # coordinates are compared by their fixed-point value, not their text
+        self.compiledMap.getSegmentsThatStartWith(GeoCoord('34.0547', '-118.4794734'), segments)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0].start.latitudeText, '34.0547000')
+
+    def test_route(self):
+        start = GeoCoord('34.0625329', '-118.4470263')
+        end   = GeoCoord('34.0712323', '-118.4505969')
+        expectedRoute = []
+        route = []
+        expected = router2.generatePointToPointRoute(start, end, expectedRoute)
+        result = PointToPointRouter(self.compiledMap).generatePointToPointRoute(start, end, route)
+        self.assertEqual(result, expected)
+        self.assertEqual(route, expectedRoute)
+
+    def test_badFile(self):
+        with self.assertRaises(ValueError):
+            StreetMap().loadCompiled('mapdata.txt')
+
+class TiledMapTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.nodeCount, cls.edgeCount, cls.tileCount = \
+            compileTiledMap('mapdata.txt', cls.directory.name, 0.02)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_counts(self):
+        self.assertEqual(self.nodeCount, 18055)
+        self.assertGreater(self.tileCount, 10)
+        tiledMap = StreetMap()
+        tiledMap.loadTiled(self.directory.name)
+        self.assertEqual(tiledMap.nodeCount(), self.nodeCount)
+        self.assertEqual(len(tiledMap.adjacency()[1]), self.edgeCount)
+        self.assertEqual(tiledMap.tileStats(), (0, 0, 0))
+        self.assertIsNone(streetmap.tileStats())
+
+    def test_getSegmentsThatStartWith(self):
+        tiledMap = StreetMap()
+        tiledMap.loadTiled(self.directory.name)
+        for gc in [GeoCoord("34.0547000", "-118.4794734"), GeoCoord("34.0544590", "-118.4801137"),
+                   GeoCoord("34.0420561", "-118.5011699"), GeoCoord("34.0356922", "-118.4937358")]:
+            expected = []
+            segments = []
+            streetmap.getSegmentsThatStartWith(gc, expected)
+            tiledMap.getSegmentsThatStartWith(gc, segments)
+            self.assertEqual(segments, expected)
+        segments = []
+        tiledMap.getSegmentsThatStartWith(GeoCoord('43', '43'), segments)
+        self.assertEqual(segments, [])
+        # only the tiles holding these nodes and their neighbors were loaded
+        self.assertLess(tiledMap.tileStats()[0], 6)
+
+    def test_routesAcrossTiles(self):
+        maxBytes = 100000
+        tiledMap = StreetMap()
+        tiledMap.loadTiled(self.directory.name, maxBytes)
+        rng = random.Random(7)
+        pairs = [(GeoCoord('34.0625329', '-118.4470263'), GeoCoord('34.0712323', '-118.4505969'))]
+        for _ in range(4):
+            pairs.append((streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())),
+                          streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount()))))
+        for mode in [RoutingMode.ASTAR, RoutingMode.COLLAPSED_CHAINS]:
+            router = PointToPointRouter(tiledMap, mode)
+            for start, end in pairs:
+                expectedRoute = []
+                route = []
+                expected = router2.generatePointToPointRoute(start, end, expectedRoute)
+                self.assertEqual(router.generatePointToPointRoute(start, end, route), expected)
+                self.assertEqual(route, expectedRoute)
+
+        # the least recently used tiles were evicted to stay under the cap
+        loaded, loadedBytes, loads = tiledMap.tileStats()
+        self.assertLessEqual(loadedBytes, maxBytes)
+        self.assertGreater(loads, loaded)
+
 class PointToPointRouterTest(unittest.TestCase):
 
     def test_getSegmentsThatStartWith(self):
@@ -217,7 +571,7 @@ class PointToPointRouterTest(unittest.TestCase):
         end = GeoCoord('1', '1')
         result, distance = router1.generatePointToPointRoute(start, end, route)
         self.assertEqual(DeliveryResult.DELIVERY_SUCCESS, result)
-        self.assertEqual(distance, distanceEarthMiles(start, end))
+        self.assertAlmostEqual(distance, distanceEarthMiles(start, end))
         self.assertEqual(len(route), 1)
         self.assertEqual(route[0].name, 'A Street')
         self.assertTrue(routeContainsTheseGeoCoords(route, '0 0 1 1') )
@@ -288,8 +642,8 @@ class PointToPointRouterTest(unittest.TestCase):
         
         start = GeoCoord('30', '5')
         end   = GeoCoord('20', '40')
-        expectedStreetNames = 'Reli Wormhole'
-        expectedGeoCoords   = '30 5 33 33 20 40'
+        expectedStreetNames = 'Reli Area 2'
+        expectedGeoCoords   = '30 5 25 40 20 40'
         result, distance = router1.generatePointToPointRoute(start, end, route)
         self.assertEqual(DeliveryResult.DELIVERY_SUCCESS, result)
         self.assertEqual(len(route), 2)
@@ -330,6 +684,666 @@ class PointToPointRouterTest(unittest.TestCase):
         self.assertTrue(routeContainsTheseStreets(route, expectedStreetNames) )
         self.assertTrue(routeContainsTheseGeoCoords(route, expectedGeoCoords) )
 
+def randomGeoCoordPairs(streetmap, count, seed):
+    rng = random.Random(seed)
+    return [(streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())),
+             streetmap.nodeGeoCoord(rng.randrange(streetmap.nodeCount())))
+            for _ in range(count)]
+
+class RoutingModeTest(unittest.TestCase):
+
+    def assertSameRoutes(self, router, reference, pairs):
+        for start, end in pairs:
+            route = []
+            expectedRoute = []
+            result, distance = router.generatePointToPointRoute(start, end, route)
+            expectedResult, expectedDistance = \
+                reference.generatePointToPointRoute(start, end, expectedRoute)
+            self.assertEqual(result, expectedResult)
+            self.assertEqual(distance, expectedDistance)
+            if result == DeliveryResult.DELIVERY_SUCCESS and len(route) > 0:
+                self.assertEqual(distance, routeDistance(route))
+                self.assertEqual(route[0].start, start)
+                self.assertEqual(route[-1].end, end)
+                for seg1, seg2 in zip(route, route[1:]):
+                    self.assertEqual(seg1.end, seg2.start)
+
+    def test_astar(self):
+        astar = PointToPointRouter(streetmap, RoutingMode.ASTAR)
+        self.assertEqual(astar.mode(), RoutingMode.ASTAR)
+        self.assertEqual(router2.mode(), RoutingMode.DIJKSTRA)
+        self.assertSameRoutes(astar, router2, randomGeoCoordPairs(streetmap, 30, 7))
+
+        imaginationAstar = PointToPointRouter(imaginationMap, RoutingMode.ASTAR)
+        pairs = [(imaginationMap.nodeGeoCoord(i), imaginationMap.nodeGeoCoord(j))
+                 for i in range(imaginationMap.nodeCount()) for j in range(imaginationMap.nodeCount())]
+        self.assertSameRoutes(imaginationAstar, router1, pairs)
+
+    def test_bidirectional(self):
+        bidirectional = PointToPointRouter(streetmap, RoutingMode.BIDIRECTIONAL)
+        self.assertSameRoutes(bidirectional, router2, randomGeoCoordPairs(streetmap, 30, 8))
+
+        imaginationBidirectional = PointToPointRouter(imaginationMap, RoutingMode.BIDIRECTIONAL)
+        pairs = [(imaginationMap.nodeGeoCoord(i), imaginationMap.nodeGeoCoord(j))
+                 for i in range(imaginationMap.nodeCount()) for j in range(imaginationMap.nodeCount())]
+        self.assertSameRoutes(imaginationBidirectional, router1, pairs)
+
+        route = []
+        start = GeoCoord('6', '7')
+        end   = GeoCoord('53', '20')
+        result, distance = imaginationBidirectional.generatePointToPointRoute(start, end, route)
+        self.assertEqual(DeliveryResult.DELIVERY_SUCCESS, result)
+        self.assertTrue(routeContainsTheseStreets(route, 'C Street A Street A Street A Street Reli Reli'))
+        self.assertTrue(routeContainsTheseGeoCoords(route, '6 7 5 6 2 3 1 1 0 0 30 5 53 20'))
+
+    def test_astarSettlesFewerNodes(self):
+        astar = PointToPointRouter(streetmap, RoutingMode.ASTAR)
+        start = GeoCoord('34.0625329', '-118.4470263')
+        end   = GeoCoord('34.0712323', '-118.4505969')
+        astar.generatePointToPointRoute(start, end, [])
+        router2.generatePointToPointRoute(start, end, [])
+        self.assertGreater(astar.settledNodeCount(), 0)
+        self.assertLess(astar.settledNodeCount(), router2.settledNodeCount())
+
+        astar.generatePointToPointRoute(start, GeoCoord('inf', 'inf'), [])
+        self.assertEqual(astar.settledNodeCount(), 0)
+
+    def test_contractionHierarchies(self):
+        imaginationCH = PointToPointRouter(imaginationMap, RoutingMode.CONTRACTION_HIERARCHIES)
+        pairs = [(imaginationMap.nodeGeoCoord(i), imaginationMap.nodeGeoCoord(j))
+                 for i in range(imaginationMap.nodeCount()) for j in range(imaginationMap.nodeCount())]
+        self.assertSameRoutes(imaginationCH, router1, pairs)
+
+        hierarchy = ContractionHierarchy(streetmap)
+        self.assertFalse(hierarchy.isPreprocessed())
+        self.assertGreater(hierarchy.preprocess(), 0)
+        self.assertTrue(hierarchy.isPreprocessed())
+        ch = PointToPointRouter(streetmap, RoutingMode.CONTRACTION_HIERARCHIES, hierarchy)
+        pairs = randomGeoCoordPairs(streetmap, 30, 9)
+        self.assertSameRoutes(ch, router2, pairs)
+        start, end = pairs[0]
+        ch.generatePointToPointRoute(start, end, [])
+        router2.generatePointToPointRoute(start, end, [])
+        self.assertLess(ch.settledNodeCount(), router2.settledNodeCount())
+
+        with tempfile.TemporaryDirectory() as directory:
+            hierarchyFile = os.path.join(directory, 'mapdata.ch')
+            hierarchy.save(hierarchyFile)
+            loaded = ContractionHierarchy.load(streetmap, hierarchyFile)
+            self.assertTrue(loaded.isPreprocessed())
+            self.assertEqual(loaded.upwardEdgeCount(), hierarchy.upwardEdgeCount())
+            loadedCH = PointToPointRouter(streetmap, RoutingMode.CONTRACTION_HIERARCHIES, loaded)
+            self.assertSameRoutes(loadedCH, router2, pairs[:10])
+            with self.assertRaises(ValueError):
+                ContractionHierarchy.load(imaginationMap, hierarchyFile)
+
+    def test_collapsedChains(self):
+        chainGraph = streetmap.chainGraph()
+        self.assertIs(streetmap.chainGraph(), chainGraph)
+        self.assertTrue(chainGraph.isBuilt())
+        self.assertLess(chainGraph.coreNodeCount(), streetmap.nodeCount() // 2)
+        self.assertLess(chainGraph.superEdgeCount(), len(streetmap.adjacency()[1]) // 2)
+
+        chains = PointToPointRouter(streetmap, RoutingMode.COLLAPSED_CHAINS)
+        pairs = randomGeoCoordPairs(streetmap, 30, 10)
+        self.assertSameRoutes(chains, router2, pairs)
+        start, end = pairs[0]
+        chains.generatePointToPointRoute(start, end, [])
+        router2.generatePointToPointRoute(start, end, [])
+        self.assertLess(chains.settledNodeCount(), router2.settledNodeCount())
+
+        # both ends inside the same chain, either way along it
+        route = []
+        router2.generatePointToPointRoute(GeoCoord('34.0625329', '-118.4470263'),
+                                          GeoCoord('34.0712323', '-118.4505969'), route)
+        stops = [segment.end for segment in route[:-1]]
+        self.assertSameRoutes(chains, router2, [(gc1, gc2) for gc1 in stops[:8] for gc2 in stops[:8]])
+
+        imaginationChains = PointToPointRouter(imaginationMap, RoutingMode.COLLAPSED_CHAINS)
+        pairs = [(imaginationMap.nodeGeoCoord(i), imaginationMap.nodeGeoCoord(j))
+                 for i in range(imaginationMap.nodeCount()) for j in range(imaginationMap.nodeCount())]
+        self.assertSameRoutes(imaginationChains, router1, pairs)
+
+        # a loop of degree-2 nodes has no core node of its own, next to a line
+        with tempfile.TemporaryDirectory() as directory:
+            mapFile = os.path.join(directory, 'loop.txt')
+            with open(mapFile, 'w') as file:
+                file.write('Loop Road\n4\n0 0 0 1\n0 1 1 1\n1 1 1 0\n1 0 0 0\n'
+                           'Line Road\n2\n5 5 5 6\n5 6 5 7\n')
+            loopMap = StreetMap()
+            loopMap.load(mapFile)
+            self.assertEqual(loopMap.chainGraph().coreNodeCount(), 3)
+            pairs = [(loopMap.nodeGeoCoord(i), loopMap.nodeGeoCoord(j))
+                     for i in range(loopMap.nodeCount()) for j in range(loopMap.nodeCount())]
+            self.assertSameRoutes(PointToPointRouter(loopMap, RoutingMode.COLLAPSED_CHAINS),
+                                  PointToPointRouter(loopMap), pairs)
+
+class DistanceMatrixTest(unittest.TestCase):
+
+    def assertMatchesRouter(self, router, sources, targets):
+        matrix, trees = router.distanceMatrix(sources, targets, returnTrees = True)
+        self.assertEqual(len(matrix), len(sources))
+        for i, start in enumerate(sources):
+            self.assertEqual(len(matrix[i]), len(targets))
+            for j, end in enumerate(targets):
+                expectedRoute = []
+                expectedResult, expectedDistance = \
+                    router.generatePointToPointRoute(start, end, expectedRoute)
+                self.assertEqual(matrix[i][j], expectedDistance)
+                route = []
+                result = router.generateRouteFromTree(trees[i], end, route)
+                self.assertEqual(result, expectedResult)
+                if result == DeliveryResult.DELIVERY_SUCCESS:
+                    self.assertEqual(routeDistance(route), routeDistance(expectedRoute))
+                    if len(route) > 0:
+                        self.assertEqual(route[0].start, start)
+                        self.assertEqual(route[-1].end, end)
+
+    def test_distanceMatrix(self):
+        nodes = [imaginationMap.nodeGeoCoord(i) for i in range(imaginationMap.nodeCount())]
+        self.assertMatchesRouter(router1, nodes, nodes)
+        self.assertEqual(router1.distanceMatrix([], nodes), [])
+        self.assertEqual(router1.distanceMatrix(nodes[:2], []), [[], []])
+
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        stops = [GeoCoord('34.0712323', '-118.4505969'), GeoCoord('34.0622239', '-118.4475384'),
+                 GeoCoord('34.0685657', '-118.4489289')]
+        self.assertMatchesRouter(router2, [depot] + stops, [depot] + stops)
+
+    def test_badCoords(self):
+        bad = GeoCoord('inf', 'inf')
+        good = imaginationMap.nodeGeoCoord(0)
+        matrix, trees = router1.distanceMatrix([bad, good], [good, bad], returnTrees = True)
+        self.assertEqual(matrix, [[-1, -1], [0, -1]])
+        self.assertIsNone(trees[0])
+        self.assertEqual(router1.generateRouteFromTree(trees[0], good, []), DeliveryResult.BAD_COORD)
+        self.assertEqual(router1.generateRouteFromTree(trees[1], bad, []), DeliveryResult.BAD_COORD)
+
+    def test_stopsWhenTargetsSettled(self):
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        near  = GeoCoord('34.0632405', '-118.4470467')
+        self.assertGreater(router2.distanceMatrix([depot], [near])[0][0], 0)
+        self.assertLess(router2.settledNodeCount(), streetmap.nodeCount() // 10)
+
+class RouteCacheTest(unittest.TestCase):
+
+    def test_hitsAndMisses(self):
+        router = PointToPointRouter(imaginationMap, cacheSize = 2)
+        start = GeoCoord('6', '7')
+        end   = GeoCoord('53', '20')
+        route = []
+        expectedRoute = []
+        self.assertEqual(router.generatePointToPointRoute(start, end, route),
+                         router1.generatePointToPointRoute(start, end, expectedRoute))
+        self.assertEqual(route, expectedRoute)
+        self.assertEqual(router.cacheStats(), (0, 1, 1))
+
+        cachedRoute = []
+        self.assertEqual(router.generatePointToPointRoute(start, end, cachedRoute),
+                         (DeliveryResult.DELIVERY_SUCCESS, routeDistance(expectedRoute)))
+        self.assertEqual(router.settledNodeCount(), 0)
+        self.assertEqual(cachedRoute, expectedRoute)
+        self.assertEqual(router.cacheStats(), (1, 1, 1))
+
+        # changing the returned route does not change the cached one
+        cachedRoute.clear()
+        route = []
+        router.generatePointToPointRoute(start, end, route)
+        self.assertEqual(route, expectedRoute)
+        self.assertEqual(router.cacheStats(), (2, 1, 1))
+
+        router.clearCache()
+        self.assertEqual(router.cacheStats(), (0, 0, 0))
+
+    def test_lruEviction(self):
+        router = PointToPointRouter(imaginationMap, cacheSize = 2)
+        a, b, c, d = GeoCoord('0', '0'), GeoCoord('2', '3'), GeoCoord('6', '7'), GeoCoord('30', '5')
+        router.generatePointToPointRoute(a, b, [])
+        router.generatePointToPointRoute(a, c, [])
+        router.generatePointToPointRoute(a, b, [])     # a -> b is now the most recent
+        router.generatePointToPointRoute(a, d, [])     # evicts a -> c
+        self.assertEqual(router.cacheStats(), (1, 3, 2))
+        router.generatePointToPointRoute(a, b, [])
+        self.assertEqual(router.cacheStats(), (2, 3, 2))
+        router.generatePointToPointRoute(a, c, [])
+        self.assertEqual(router.cacheStats(), (2, 4, 2))
+
+        # bad coordinates and empty routes are not cached
+        self.assertEqual(router.generatePointToPointRoute(a, GeoCoord('inf', 'inf'), []),
+                         (DeliveryResult.BAD_COORD, -1))
+        self.assertEqual(router.generatePointToPointRoute(a, a, []), (DeliveryResult.DELIVERY_SUCCESS, 0))
+        self.assertEqual(router.cacheStats(), (2, 4, 2))
+
+    def test_invalidatedByMapVersion(self):
+        changingMap = StreetMap()
+        changingMap.load('imaginationWorldData.txt')
+        router = PointToPointRouter(changingMap, cacheSize = 8)
+        start = GeoCoord('0', '0')
+        end   = GeoCoord('2', '3')
+        router.generatePointToPointRoute(start, end, [])
+        router.generatePointToPointRoute(start, end, [])
+        self.assertEqual(router.cacheStats(), (1, 1, 1))
+
+        version = changingMap.version()
+        changingMap.load('imaginationWorldData.txt')
+        self.assertNotEqual(changingMap.version(), version)
+        route = []
+        result, distance = router.generatePointToPointRoute(start, end, route)
+        self.assertEqual(result, DeliveryResult.DELIVERY_SUCCESS)
+        self.assertEqual(distance, routeDistance(route))
+        self.assertEqual(router.cacheStats(), (1, 2, 1))
+
+class MapUpdateTest(unittest.TestCase):
+
+    start = GeoCoord('34.0625329', '-118.4470263')
+    end   = GeoCoord('34.0712323', '-118.4505969')
+
+    def test_removeSegments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compiledFile = os.path.join(directory, 'mapdata.gmap')
+            compileMap('mapdata.txt', compiledFile)
+            changingMap = StreetMap()
+            changingMap.loadCompiled(compiledFile)
+            router = PointToPointRouter(changingMap)
+            route = []
+            _, distance = router.generatePointToPointRoute(self.start, self.end, route)
+            closed = route[len(route) // 2]
+            changingMap.chainGraph()
+
+            version = changingMap.version()
+            self.assertEqual(changingMap.removeSegments([closed, closed.reversed()]), 1)
+            self.assertEqual(changingMap.removeSegments([StreetSegment(self.start, self.end, 'Nowhere')]), 0)
+            self.assertGreater(changingMap.version(), version)
+            changes = changingMap.changesSince(version)
+            self.assertEqual([kind for _, kind, _ in changes], [MapChange.REWEIGHT])
+            self.assertEqual(len(changes[0][2]), 2)
+            self.assertEqual(changingMap.changesSince(changingMap.version()), [])
+            self.assertEqual([kind for _, kind, _ in changingMap.changesSince(version - 1)],
+                             [MapChange.LOAD, MapChange.REWEIGHT])
+
+            detour = []
+            result, detourDistance = router.generatePointToPointRoute(self.start, self.end, detour)
+            self.assertEqual(result, DeliveryResult.DELIVERY_SUCCESS)
+            self.assertGreater(detourDistance, distance)
+            self.assertNotIn(closed, detour)
+            self.assertNotIn(closed.reversed(), detour)
+            segments = []
+            changingMap.getSegmentsThatStartWith(closed.start, segments)
+            self.assertIn(float('inf'), [segment.length for segment in segments])
+
+            # every routing mode sees the closure
+            for mode in [RoutingMode.ASTAR, RoutingMode.BIDIRECTIONAL,
+                         RoutingMode.CONTRACTION_HIERARCHIES, RoutingMode.COLLAPSED_CHAINS]:
+                modeRoute = []
+                self.assertEqual(PointToPointRouter(changingMap, mode).generatePointToPointRoute(
+                    self.start, self.end, modeRoute), (result, detourDistance))
+                self.assertEqual(modeRoute, detour)
+            # from inside the chain of the closed segment
+            chainRoute, expectedRoute = [], []
+            self.assertEqual(PointToPointRouter(changingMap, RoutingMode.COLLAPSED_CHAINS)
+                             .generatePointToPointRoute(closed.end, self.end, chainRoute),
+                             router.generatePointToPointRoute(closed.end, self.end, expectedRoute))
+            self.assertEqual(chainRoute, expectedRoute)
+
+            self.assertEqual(changingMap.reweightSegments([(closed, closed.length)]), 1)
+            reopened = []
+            self.assertEqual(router.generatePointToPointRoute(self.start, self.end, reopened),
+                             (DeliveryResult.DELIVERY_SUCCESS, distance))
+            self.assertEqual(reopened, route)
+
+    def test_addSegments(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        router = PointToPointRouter(changingMap, RoutingMode.COLLAPSED_CHAINS)
+        changingMap.chainGraph()
+        nodeCount = changingMap.nodeCount()
+
+        newNode = GeoCoord('34.0668', '-118.4488')
+        self.assertIsNone(changingMap.nodeId(newNode))
+        self.assertEqual(changingMap.addSegments([StreetSegment(self.start, newNode, 'Shortcut Lane'),
+                                                  StreetSegment(newNode, self.end, 'Shortcut Lane')]), 1)
+        self.assertEqual(changingMap.nodeCount(), nodeCount + 1)
+        self.assertEqual(changingMap.changesSince(changingMap.version() - 1)[0][1], MapChange.ADD)
+        segments = []
+        changingMap.getSegmentsThatStartWith(newNode, segments)
+        self.assertEqual(sorted(segment.end for segment in segments), sorted([self.start, self.end]))
+        self.assertEqual(changingMap.nearestNode(newNode), (newNode, 0.0))
+
+        route = []
+        result, distance = router.generatePointToPointRoute(self.start, self.end, route)
+        self.assertEqual(result, DeliveryResult.DELIVERY_SUCCESS)
+        self.assertEqual([segment.name for segment in route], ['Shortcut Lane'] * 2)
+        self.assertEqual(distance, routeDistance(route))
+        # nodes keep their ids unless a new node comes before them in key order
+        self.assertEqual(changingMap.nodeId(GeoCoord('34.0547000', '-118.4794734')),
+                         streetmap.nodeId(GeoCoord('34.0547000', '-118.4794734')))
+
+    def test_addSegmentsKeepsDerivedData(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        changingMap.chainGraph()
+        changingMap.nearestNode(self.start)
+        # a dead end, a chain of new nodes, a street across existing nodes and a new loop
+        loop = [GeoCoord('34.1000000', '-118.3000000'), GeoCoord('34.1002000', '-118.3000000'),
+                GeoCoord('34.1002000', '-118.3002000')]
+        pairs = randomGeoCoordPairs(changingMap, 10, 21)
+        segments = [StreetSegment(self.start, GeoCoord('34.0630000', '-118.4460000'), 'Dead End'),
+                    StreetSegment(self.end, GeoCoord('34.0650000', '-118.4470000'), 'New Chain'),
+                    StreetSegment(GeoCoord('34.0650000', '-118.4470000'),
+                                  GeoCoord('34.0652000', '-118.4473000'), 'New Chain'),
+                    StreetSegment(pairs[0][0], pairs[0][1], 'Cross Street')] + \
+                   [StreetSegment(loop[i], loop[i-1], 'Loop Road') for i in range(3)]
+        changingMap.addSegments(segments)
+        rebuilt = StreetMap()
+        rebuilt.load('mapdata.txt')
+        rebuilt.addSegments(segments)
+
+        # renumbered and extended in place, they match the ones built for the new map
+        chains, rebuiltChains = changingMap.chainGraph(), rebuilt.chainGraph()
+        self.assertEqual(chains.coreNodeCount(), rebuiltChains.coreNodeCount())
+        self.assertEqual(chains.superEdgeCount(), rebuiltChains.superEdgeCount())
+        collapsed = PointToPointRouter(changingMap, RoutingMode.COLLAPSED_CHAINS)
+        dijkstra = PointToPointRouter(changingMap)
+        for start, end in pairs + [(self.start, loop[1]), (loop[0], loop[2])]:
+            self.assertEqual(collapsed.generatePointToPointRoute(start, end, []),
+                             dijkstra.generatePointToPointRoute(start, end, []))
+        for geoCoord in [segment.end for segment in segments] + [GeoCoord('34.0640000', '-118.4465000'),
+                                                               GeoCoord('34.2000000', '-118.2000000')]:
+            self.assertEqual(changingMap.nearestNode(geoCoord), rebuilt.nearestNode(geoCoord))
+            self.assertEqual(changingMap.nearestSegment(geoCoord)[1], rebuilt.nearestSegment(geoCoord)[1])
+
+    def test_routeCache(self):
+        changingMap = StreetMap()
+        changingMap.load('imaginationWorldData.txt')
+        router = PointToPointRouter(changingMap, cacheSize = 8)
+        a, b, c = GeoCoord('0', '0'), GeoCoord('2', '3'), GeoCoord('6', '7')
+        routeAB, routeAC = [], []
+        router.generatePointToPointRoute(a, b, routeAB)
+        router.generatePointToPointRoute(a, c, routeAC)
+        elsewhere = [segment for segment in routeAC if segment not in routeAB]
+
+        # closing a segment only drops the cached routes over it
+        changingMap.removeSegments(elsewhere[:1])
+        router.generatePointToPointRoute(a, b, [])
+        self.assertEqual(router.cacheStats(), (1, 2, 1))
+        router.generatePointToPointRoute(a, c, [])
+        self.assertEqual(router.cacheStats(), (1, 3, 2))
+
+        # making a segment shorter (here opening it again) can change any route
+        changingMap.reweightSegments([(elsewhere[0], elsewhere[0].length)])
+        router.generatePointToPointRoute(a, b, [])
+        self.assertEqual(router.cacheStats(), (1, 4, 1))
+
+    def test_lengthsStayAdmissible(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        route = []
+        PointToPointRouter(changingMap).generatePointToPointRoute(self.start, self.end, route)
+        version = changingMap.version()
+        with self.assertRaises(ValueError):
+            changingMap.reweightSegments([(route[0], route[0].length * 3),
+                                          (route[1], route[1].length / 2)])
+        with self.assertRaises(ValueError):
+            changingMap.addSegments([StreetSegment(self.start, self.end, 'Shortcut Lane', 0.1)])
+        self.assertEqual(changingMap.version(), version)     # nothing of either batch applied
+        # rounding below the great-circle distance is fine (the map data has some)
+        self.assertEqual(changingMap.reweightSegments([(segment, distanceEarthMiles(segment.end, segment.start)
+                                                        * (1 - 1e-12)) for segment in route]), len(route))
+        changingMap.reweightSegments([(segment, segment.length) for segment in route])
+
+        # A* still matches Dijkstra after streets get slower
+        changingMap.reweightSegments([(segment, segment.length * 3) for segment in route[::2]])
+        changingMap.addSegments([StreetSegment(self.start, self.end, 'Slow Lane',
+                                               distanceEarthMiles(self.start, self.end) * 2)])
+        dijkstra = PointToPointRouter(changingMap)
+        astar = PointToPointRouter(changingMap, RoutingMode.ASTAR)
+        for start, end in randomGeoCoordPairs(changingMap, 30, 12) + [(self.start, self.end)]:
+            self.assertEqual(astar.generatePointToPointRoute(start, end, []),
+                             dijkstra.generatePointToPointRoute(start, end, []))
+
+    def test_savedHierarchyAfterChanges(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        route = []
+        PointToPointRouter(changingMap).generatePointToPointRoute(self.start, self.end, route)
+        hierarchy = ContractionHierarchy(changingMap)
+        hierarchy.preprocess()
+        with tempfile.TemporaryDirectory() as directory:
+            hierarchyFile = os.path.join(directory, 'mapdata.ch')
+            hierarchy.save(hierarchyFile)
+            changingMap.removeSegments(route)
+            # same counts, other lengths
+            with self.assertRaises(ValueError):
+                ContractionHierarchy.load(changingMap, hierarchyFile)
+            changingMap.reweightSegments([(segment, segment.length) for segment in route])
+            loaded = ContractionHierarchy.load(changingMap, hierarchyFile)
+            self.assertTrue(loaded.isCurrent())
+            self.assertEqual(PointToPointRouter(changingMap, RoutingMode.CONTRACTION_HIERARCHIES, loaded)
+                             .generatePointToPointRoute(self.start, self.end, []),
+                             PointToPointRouter(changingMap).generatePointToPointRoute(self.start, self.end, []))
+
+    def test_hierarchyAfterChanges(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        hierarchy = ContractionHierarchy(changingMap)
+        hierarchy.preprocess()
+        ch = PointToPointRouter(changingMap, RoutingMode.CONTRACTION_HIERARCHIES, hierarchy)
+        dijkstra = PointToPointRouter(changingMap)
+        pairs = randomGeoCoordPairs(changingMap, 20, 13) + [(self.start, self.end)]
+        def assertSameDistances():
+            for start, end in pairs:
+                self.assertEqual(ch.generatePointToPointRoute(start, end, []),
+                                 dijkstra.generatePointToPointRoute(start, end, []))
+
+        # lengths change: the same hierarchy is contracted again where they matter
+        route = []
+        dijkstra.generatePointToPointRoute(self.start, self.end, route)
+        changingMap.removeSegments(route[::3])
+        changingMap.reweightSegments([(segment, segment.length * 2) for segment in route[1::3]])
+        self.assertFalse(hierarchy.isCurrent())
+        self.assertTrue(hierarchy.update())
+        self.assertTrue(hierarchy.isCurrent())
+        assertSameDistances()
+        self.assertLess(ch.settledNodeCount(), dijkstra.settledNodeCount())
+
+        # the router answers with Dijkstra while it updates the hierarchy in the background
+        changingMap.reweightSegments([(segment, segment.length) for segment in route])
+        assertSameDistances()
+        ch.waitForHierarchy()
+        self.assertTrue(hierarchy.isCurrent())
+        assertSameDistances()
+
+        # a loaded hierarchy has no record of its contraction and is contracted again in order
+        with tempfile.TemporaryDirectory() as directory:
+            hierarchy.save(os.path.join(directory, 'mapdata.ch'))
+            loaded = ContractionHierarchy.load(changingMap, os.path.join(directory, 'mapdata.ch'))
+        changingMap.removeSegments(route[::2])
+        self.assertTrue(loaded.update())
+        self.assertTrue(hierarchy.update())
+        for start, end in pairs:
+            self.assertEqual(PointToPointRouter(changingMap, RoutingMode.CONTRACTION_HIERARCHIES, loaded)
+                             .generatePointToPointRoute(start, end, []),
+                             dijkstra.generatePointToPointRoute(start, end, []))
+
+        # segments are added: Dijkstra answers until a new hierarchy is ready
+        newNode = GeoCoord('34.0668', '-118.4488')
+        changingMap.addSegments([StreetSegment(self.start, newNode, 'Shortcut Lane'),
+                                 StreetSegment(newNode, self.end, 'Shortcut Lane')])
+        self.assertFalse(hierarchy.update())
+        shortcut = []
+        expected = dijkstra.generatePointToPointRoute(self.start, self.end, [])
+        self.assertEqual(ch.generatePointToPointRoute(self.start, self.end, shortcut), expected)
+        self.assertEqual(ch.settledNodeCount(), dijkstra.settledNodeCount())
+        self.assertEqual([segment.name for segment in shortcut], ['Shortcut Lane'] * 2)
+        ch.waitForHierarchy()
+        self.assertEqual(ch.generatePointToPointRoute(self.start, self.end, []), expected)
+        self.assertLess(ch.settledNodeCount(), dijkstra.settledNodeCount())
+        pairs = randomGeoCoordPairs(changingMap, 20, 14)
+        assertSameDistances()
+
+    def test_tiledMapIsReadOnly(self):
+        with tempfile.TemporaryDirectory() as directory:
+            compileTiledMap('mapdata.txt', directory)
+            tiledMap = StreetMap()
+            tiledMap.loadTiled(directory)
+            with self.assertRaises(ValueError):
+                tiledMap.removeSegments([StreetSegment(self.start, self.end, 'Nowhere')])
+
+class RoutePoolTest(unittest.TestCase):
+
+    def test_generateEdgeRoute(self):
+        start = GeoCoord('6', '7')
+        end   = GeoCoord('53', '20')
+        route = []
+        expectedResult, expectedDistance = router1.generatePointToPointRoute(start, end, route)
+        result, distance, edges = router1.generateEdgeRoute(start, end)
+        self.assertEqual((result, distance), (expectedResult, expectedDistance))
+        self.assertEqual([imaginationMap.edgeSegment(u, edge) for u, edge in edges], route)
+        self.assertEqual(router1.generateEdgeRoute(start, start), (DeliveryResult.DELIVERY_SUCCESS, 0, []))
+        self.assertEqual(router1.generateEdgeRoute(start, GeoCoord('inf', 'inf')),
+                         (DeliveryResult.BAD_COORD, -1, []))
+
+    def test_routeLegs(self):
+        pairs = randomGeoCoordPairs(streetmap, 12, 10) + [(GeoCoord('inf', 'inf'), GeoCoord('0', '0'))]
+        with RoutePool(streetmap, 2) as pool:
+            legRoutes = pool.routeLegs(pairs)
+            self.assertEqual(len(legRoutes), len(pairs))
+            for (start, end), (result, distance, route) in zip(pairs, legRoutes):
+                expectedRoute = []
+                self.assertEqual((result, distance),
+                                 router2.generatePointToPointRoute(start, end, expectedRoute))
+                if result == DeliveryResult.DELIVERY_SUCCESS:
+                    self.assertEqual(len(route), len(expectedRoute))
+                    for segment, expectedSegment in zip(route, expectedRoute):
+                        self.assertIs(segment, expectedSegment)     # segments of this map, not copies
+            self.assertEqual(pool.routeLegs([]), [])
+
+    def test_mapChangesBetweenPlans(self):
+        changingMap = StreetMap()
+        changingMap.load('mapdata.txt')
+        router = PointToPointRouter(changingMap)
+        start, end = MapUpdateTest.start, MapUpdateTest.end
+        legs = [(start, end), (end, start)]
+        def expectedLegs():
+            expected = []
+            for legStart, legEnd in legs:
+                route = []
+                result, distance = router.generatePointToPointRoute(legStart, legEnd, route)
+                expected.append((result, distance, route))
+            return expected
+
+        with RoutePool(changingMap, 2) as pool:
+            before = pool.routeLegs(legs)
+            self.assertEqual(before, expectedLegs())
+            closed = before[0][2][len(before[0][2]) // 2]
+            changingMap.removeSegments([closed, closed.reversed()])
+            after = pool.routeLegs(legs)
+            self.assertEqual(after, expectedLegs())
+            self.assertGreater(after[0][1], before[0][1])
+            self.assertNotIn(closed, after[0][2])
+
+            newNode = GeoCoord('34.0668', '-118.4488')
+            changingMap.addSegments([StreetSegment(start, newNode, 'Shortcut Lane'),
+                                     StreetSegment(newNode, end, 'Shortcut Lane')])
+            added = list(pool.iterRouteLegs(legs))
+            self.assertEqual(added, expectedLegs())
+            self.assertEqual([segment.name for segment in added[0][2]], ['Shortcut Lane'] * 2)
+
+    def test_parallelPlanner(self):
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [pair[0] for pair in randomGeoCoordPairs(streetmap, 8, 11)]
+        deliveries = [DeliveryRequest('item {0}'.format(i), gc) for i, gc in enumerate(locations)]
+        parallelPlanner = DeliveryPlanner(streetmap, processes = 2)
+        try:
+            random.seed(5)
+            serialDeliveries = deliveries.copy()
+            serialCommands = []
+            serial = planner2.generateDeliveryPlan(depot, serialDeliveries, serialCommands)
+            random.seed(5)
+            parallelDeliveries = deliveries.copy()
+            parallelCommands = []
+            parallel = parallelPlanner.generateDeliveryPlan(depot, parallelDeliveries, parallelCommands)
+        finally:
+            parallelPlanner.close()
+        self.assertEqual(parallel, serial)
+        self.assertEqual(parallelDeliveries, serialDeliveries)
+        self.assertEqual([command.description() for command in parallelCommands],
+                         [command.description() for command in serialCommands])
+
+class RoutingServiceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.service = RoutingService(imaginationMap)
+        port = await self.service.start()
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.service.close()
+
+    async def request(self, *requests, extraResponses = 0):
+        for request in requests:
+            self.writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        responses = {}
+        for _ in range(len(requests) + extraResponses):
+            response = json.loads(await self.reader.readline())
+            responses[response.get('id')] = response
+        return responses
+
+    async def test_coalescedRoutes(self):
+        pairs = [('6', '7', '53', '20'), ('0', '0', '2', '3'), ('0', '0', '30', '5'),
+                 ('6', '7', '6', '7'), ('0', '0', '99', '99')]
+        responses = await self.request(*[{'id': i, 'type': 'route', 'start': [a, b], 'end': [c, d]}
+                                        for i, (a, b, c, d) in enumerate(pairs)])
+        for i, (a, b, c, d) in enumerate(pairs):
+            route = []
+            result, distance = router1.generatePointToPointRoute(GeoCoord(a, b), GeoCoord(c, d), route)
+            self.assertEqual(responses[i]['result'], result.name)
+            self.assertEqual(responses[i]['distance'], distance)
+            self.assertEqual(responses[i]['route'], routeToJson(route))
+            self.assertGreaterEqual(responses[i]['latencyMs'], 0)
+        stats = self.service.stats()
+        self.assertEqual(stats['requests'], len(pairs))
+        self.assertEqual(stats['routeBatches'], 1)
+
+    async def test_planAndMatrix(self):
+        random.seed(3)
+        responses = await self.request(
+            {'id': 'plan', 'type': 'plan', 'depot': ['5', '6'],
+             'deliveries': [{'item': 'salmon', 'location': ['0', '0']},
+                            {'item': 'pho', 'location': [42, 42]}]},
+            {'id': 'matrix', 'type': 'matrix', 'sources': [['0', '0'], ['5', '6']],
+             'targets': [['2', '3'], ['inf', 'inf']]})
+        plan = responses['plan']
+        self.assertEqual(plan['result'], 'DELIVERY_SUCCESS')
+        self.assertGreater(plan['distance'], 0)
+        self.assertEqual(sorted(plan['deliveries']), ['pho', 'salmon'])
+        self.assertEqual(len([c for c in plan['commands'] if c.startswith('Deliver')]), 2)
+        self.assertEqual(responses['matrix']['matrix'],
+            router1.distanceMatrix([GeoCoord('0', '0'), GeoCoord('5', '6')],
+                                   [GeoCoord('2', '3'), GeoCoord('inf', 'inf')]))
+
+    async def test_badRequests(self):
+        self.writer.write(b'not json\n')
+        responses = await self.request({'id': 1, 'type': 'teleport'}, {'id': 2, 'type': 'route'},
+                                       extraResponses = 1)
+        self.assertIn('error', responses[None])
+        self.assertIn('error', responses[1])
+        self.assertIn('error', responses[2])
+        self.assertEqual((await self.request({'id': 3, 'type': 'stats'}))[3]['requests'], 2)
+
+    async def test_unexpectedErrors(self):
+        # any exception becomes an error response to the request, not a lost reply
+        with unittest.mock.patch.object(DeliveryPlanner, 'generateDeliveryPlan',
+                                        side_effect = RuntimeError('planner crashed')):
+            responses = await self.request({'id': 'plan', 'type': 'plan', 'depot': ['5', '6'],
+                                            'deliveries': []})
+        self.assertEqual(responses['plan']['error'], 'planner crashed')
+        responses = await self.request({'id': 1, 'type': 'route', 'start': ['0', '0'], 'end': ['2', '3']})
+        self.assertEqual(responses[1]['result'], 'DELIVERY_SUCCESS')
+
 class DeliveryOptimizerTest(unittest.TestCase):
     def test_optimizeDeliverOrder(self):
         deliveries = [
@@ -393,6 +1407,251 @@ class DeliveryOptimizerTest(unittest.TestCase):
 
         print('Old Crow Distance: {0}\tNew Crow Distance: {1}'.format(oldCrowDistance, newCrowDistance))
 
+    def test_moveDeltas(self):
+        rng = random.Random(1)
+        for _ in range(500):
+            n = rng.randint(2, 9)
+            points = [(rng.random(), rng.random()) for _ in range(n+1)]
+            table = [[math.hypot(a[0]-b[0], a[1]-b[1]) for b in points] for a in points]
+            stops = list(range(1, n+1))
+            rng.shuffle(stops)
+            tour = [0] + stops + [0]
+            cost = tourCost(table, tour)
+
+            i, j = sorted(rng.sample(range(1, n+1), 2))
+            swapped = tour.copy()
+            swap(swapped, i, j)
+            self.assertAlmostEqual(tourCost(table, swapped) - cost, swapDelta(table, tour, i, j))
+            reversedTour = tour.copy()
+            twoOpt(reversedTour, i, j)
+            self.assertEqual(reversedTour[i:j+1], tour[j:i-1:-1])
+            self.assertAlmostEqual(tourCost(table, reversedTour) - cost, twoOptDelta(table, tour, i, j))
+
+            length = rng.randint(1, min(3, n-1))
+            i = rng.randint(1, n-length+1)
+            k = rng.choice([k for k in range(1, n-length+2) if k != i])
+            moved = tour.copy()
+            orOpt(moved, i, length, k)
+            self.assertEqual(sorted(moved), sorted(tour))
+            self.assertEqual((moved[0], moved[-1]), (0, 0))
+            self.assertAlmostEqual(tourCost(table, moved) - cost, orOptDelta(table, tour, i, length, k))
+
+    def test_anneal(self):
+        n = 12
+        points = [(math.cos(2 * math.pi * i / (n+1)), math.sin(2 * math.pi * i / (n+1))) for i in range(n+1)]
+        table = [[math.hypot(a[0]-b[0], a[1]-b[1]) for b in points] for a in points]
+        stops = list(range(1, n+1))
+        random.Random(2).shuffle(stops)
+        tour, cost = anneal(table, [0] + stops + [0], random.Random(3))
+        self.assertEqual((tour[0], tour[-1]), (0, 0))
+        self.assertEqual(sorted(tour[1:-1]), list(range(1, n+1)))
+        self.assertEqual(cost, tourCost(table, tour))
+        self.assertLessEqual(cost, tourCost(table, [0] + stops + [0]))
+        self.assertEqual(anneal(table, [0] + stops + [0], random.Random(3)), (tour, cost))
+
+    def test_timeBudget(self):
+        n = 12
+        points = [(math.cos(2 * math.pi * i / (n+1)), math.sin(2 * math.pi * i / (n+1))) for i in range(n+1)]
+        table = [[math.hypot(a[0]-b[0], a[1]-b[1]) for b in points] for a in points]
+        stops = list(range(1, n+1))
+        random.Random(2).shuffle(stops)
+        temperature = initialTemperature(table, [0] + stops + [0], random.Random(3))
+        self.assertGreater(temperature, 0)
+
+        # the schedule is driven by a clock that advances a millisecond per reading, so the
+        # checks do not depend on how fast this machine is
+        optimizerModule = sys.modules[anneal.__module__]
+        def annealWithClock(*args, **kwargs):
+            with unittest.mock.patch.object(optimizerModule, 'time', FakeClock()), \
+                 unittest.mock.patch.object(optimizerModule, 'randomMove',
+                                            wraps = optimizerModule.randomMove) as moves:
+                return args[0](*args[1:], **kwargs), moves.call_count
+
+        # the calibrated schedule finds the circle within its budget, reading the clock
+        # every CHECK_INTERVAL moves
+        (tour, cost), moves = annealWithClock(anneal, table, [0] + stops + [0], random.Random(3),
+            temperature, finalTemperature = temperature * FINAL_TEMPERATURE_RATIO, timeBudgetMs = 300)
+        self.assertLessEqual(moves, 300 * CHECK_INTERVAL)
+        self.assertAlmostEqual(cost, tourCost(table, list(range(n+1)) + [0]))
+
+        # a set stop event returns the best tour so far at the first check
+        stopEvent = threading.Event()
+        stopEvent.set()
+        (tour, cost), moves = annealWithClock(anneal, table, [0] + stops + [0], random.Random(3),
+            temperature, finalTemperature = temperature * FINAL_TEMPERATURE_RATIO, timeBudgetMs = 10000,
+            stopEvent = stopEvent)
+        self.assertEqual(moves, CHECK_INTERVAL)
+        self.assertEqual(sorted(tour[1:-1]), list(range(1, n+1)))
+        self.assertLessEqual(cost, tourCost(table, [0] + stops + [0]))
+
+        # the optimizer splits the budget of the whole call among its chains and rounds
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        deliveries = [DeliveryRequest(str(i), pair[0]) for i, pair in enumerate(randomGeoCoordPairs(streetmap, 30, 5))]
+        for budgetOptimizer in [DeliveryOptimizer(streetmap, seed = 1),
+                                DeliveryOptimizer(streetmap, chains = 3, seed = 1, exchanges = 2)]:
+            (oldDistance, newDistance), moves = annealWithClock(budgetOptimizer.optimizeDeliveryOrder,
+                depot, deliveries, timeBudgetMs = 200)
+            self.assertGreater(moves, 0)
+            self.assertLessEqual(moves, 200 * CHECK_INTERVAL)
+            self.assertLessEqual(newDistance, oldDistance)
+            self.assertAlmostEqual(newDistance, deliveryRouteCrowDistance(depot, deliveries))
+
+    def test_roadDistances(self):
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [pair[0] for pair in randomGeoCoordPairs(streetmap, 6, 12)]
+        deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+        roadOptimizer = DeliveryOptimizer(streetmap, DistanceMetric.ROAD)
+        self.assertEqual(roadOptimizer.metric(), DistanceMetric.ROAD)
+        self.assertEqual(optimizer2.metric(), DistanceMetric.CROW)
+
+        given = deliveries.copy()
+        oldDistance, newDistance = roadOptimizer.optimizeDeliveryOrder(depot, deliveries)
+        self.assertLessEqual(newDistance, oldDistance)
+        def roadDistance(order):
+            stops = [depot] + [delivery.location for delivery in order] + [depot]
+            return sum(router2.generatePointToPointRoute(gc1, gc2, [])[1] for gc1, gc2 in zip(stops, stops[1:]))
+        self.assertAlmostEqual(oldDistance, roadDistance(given))
+        self.assertAlmostEqual(newDistance, roadDistance(deliveries))
+
+        # the legs come from the optimizer's searches
+        for gc1, gc2 in [(depot, deliveries[0].location), (deliveries[2].location, deliveries[1].location)]:
+            route = []
+            expectedRoute = []
+            self.assertEqual(roadOptimizer.generateLegRoute(gc1, gc2, route),
+                             router2.generatePointToPointRoute(gc1, gc2, expectedRoute))
+            self.assertEqual(routeDistance(route), routeDistance(expectedRoute))
+        self.assertIsNone(roadOptimizer.generateLegRoute(depot, GeoCoord('34.0712323', '-118.4505969'), []))
+
+    def test_roadPlanner(self):
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [pair[1] for pair in randomGeoCoordPairs(streetmap, 5, 13)]
+        deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+        commands = []
+        roadPlanner = DeliveryPlanner(streetmap, metric = DistanceMetric.ROAD)
+        result, distance = roadPlanner.generateDeliveryPlan(depot, deliveries, commands)
+        self.assertEqual(result, DeliveryResult.DELIVERY_SUCCESS)
+        stops = [depot] + [delivery.location for delivery in deliveries] + [depot]
+        self.assertAlmostEqual(distance,
+            sum(router2.generatePointToPointRoute(gc1, gc2, [])[1] for gc1, gc2 in zip(stops, stops[1:])))
+        self.assertEqual(len([c for c in commands if c.description().startswith('Deliver')]), len(deliveries))
+
+    def test_multiStart(self):
+        locations = [pair[0] for pair in randomGeoCoordPairs(streetmap, 15, 14)]
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        def optimize(optimizer):
+            deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+            try:
+                distances = optimizer.optimizeDeliveryOrder(depot, deliveries)
+            finally:
+                optimizer.close()
+            return distances, [delivery.item for delivery in deliveries]
+
+        serial = optimize(DeliveryOptimizer(streetmap, chains = 4, seed = 7))
+        self.assertEqual(optimize(DeliveryOptimizer(streetmap, chains = 4, seed = 7)), serial)
+        self.assertEqual(optimize(DeliveryOptimizer(streetmap, chains = 4, processes = 2, seed = 7)), serial)
+        (oldDistance, newDistance), order = serial
+        self.assertLessEqual(newDistance, oldDistance)
+        self.assertEqual(sorted(order, key = int), [str(i) for i in range(len(locations))])
+
+        exchanging = optimize(DeliveryOptimizer(streetmap, chains = 3, processes = 2, seed = 7, exchanges = 4))
+        self.assertEqual(optimize(DeliveryOptimizer(streetmap, chains = 3, seed = 7, exchanges = 4)), exchanging)
+        self.assertLessEqual(exchanging[0][1], exchanging[0][0])
+
+    def test_solvers(self):
+        rng = random.Random(5)
+        points = [(rng.random(), rng.random()) for _ in range(8)]
+        table = [[math.hypot(a[0]-b[0], a[1]-b[1]) for b in points] for a in points]
+        shortest = min(tourCost(table, [0] + list(stops) + [0])
+                       for stops in itertools.permutations(range(1, len(points))))
+        tour, cost = heldKarp(table)
+        self.assertEqual(sorted(tour[1:-1]), list(range(1, len(points))))
+        self.assertAlmostEqual(cost, shortest)
+        self.assertAlmostEqual(cost, tourCost(table, tour))
+        for construct in [nearestNeighborTour, farthestInsertionTour]:
+            tour = construct(table)
+            self.assertEqual((tour[0], tour[-1]), (0, 0))
+            self.assertEqual(sorted(tour[1:-1]), list(range(1, len(points))))
+            self.assertGreaterEqual(tourCost(table, tour), shortest - 1e-9)
+
+        # small orders are solved exactly, whatever the order they come in
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [pair[0] for pair in randomGeoCoordPairs(streetmap, 9, 3)]
+        deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+        self.assertEqual(optimizer2.solver(), Solver.AUTO)
+        newDistance = optimizer2.optimizeDeliveryOrder(depot, deliveries)[1]
+        self.assertAlmostEqual(newDistance, heldKarp(crowDistanceTable(depot, deliveries))[1])
+        random.Random(1).shuffle(deliveries)
+        self.assertAlmostEqual(optimizer2.optimizeDeliveryOrder(depot, deliveries)[1], newDistance)
+        annealer = DeliveryOptimizer(streetmap, seed = 2, solver = Solver.ANNEAL)
+        self.assertGreaterEqual(annealer.optimizeDeliveryOrder(depot, deliveries)[1], newDistance - 1e-9)
+
+    def test_nanCoordinate(self):
+        nan = float('nan')
+        table = [[0, 1, 2], [1, 0, nan], [2, nan, 0]]
+        self.assertEqual(heldKarp(table)[0], [0, 1, 2, 0])
+
+        # no stop is dropped, and the plan fails on the bad coordinate
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [pair[0] for pair in randomGeoCoordPairs(streetmap, 4, 3)] + [GeoCoord('nan', 'nan')]
+        for solver in [Solver.AUTO, Solver.ANNEAL]:
+            deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+            optimizer = DeliveryOptimizer(streetmap, seed = 2, solver = solver)
+            optimizer.optimizeDeliveryOrder(depot, deliveries)
+            self.assertEqual(sorted(delivery.item for delivery in deliveries), ['0', '1', '2', '3', '4'])
+        deliveries = [DeliveryRequest(str(i), gc) for i, gc in enumerate(locations)]
+        self.assertEqual(DeliveryPlanner(streetmap).generateDeliveryPlan(depot, deliveries, []),
+                         (DeliveryResult.BAD_COORD, -1))
+        self.assertEqual(len(deliveries), 5)
+
+class SpatialIndexTest(unittest.TestCase):
+    def test_nearestNode(self):
+        latitudes, longitudes = streetmap.coordinates()
+        rng = random.Random(8)
+        for _ in range(40):
+            gc = GeoCoord(str(rng.uniform(min(latitudes) - 0.01, max(latitudes) + 0.01)),
+                          str(rng.uniform(min(longitudes) - 0.01, max(longitudes) + 0.01)))
+            node, distance = streetmap.nearestNode(gc)
+            nearest = min(distanceEarthMiles(gc, streetmap.nodeGeoCoord(i)) for i in range(streetmap.nodeCount()))
+            self.assertAlmostEqual(distance, nearest)
+            self.assertAlmostEqual(distance, distanceEarthMiles(gc, node))
+            self.assertIsNotNone(streetmap.nodeId(node))
+            segment, segmentDistance = streetmap.nearestSegment(gc)
+            # (segment distances are planar, within a fraction of a foot at street scale)
+            self.assertLessEqual(segmentDistance, distance * (1 + 1e-4))
+        self.assertEqual(streetmap.nearestNode(GeoCoord('34.0547000', '-118.4794734')),
+                         (GeoCoord('34.0547000', '-118.4794734'), 0.0))
+        self.assertIsNone(StreetMap().nearestNode(GeoCoord('0', '0')))
+
+    def test_snapGeoCoords(self):
+        segments = []
+        streetmap.getSegmentsThatStartWith(GeoCoord('34.0547000', '-118.4794734'), segments)
+        segment = segments[0]
+        # a little off the segment, a quarter of the way along it
+        offStreet = GeoCoord(str(0.75 * segment.start.latitude + 0.25 * segment.end.latitude + 0.00002),
+                             str(0.75 * segment.start.longitude + 0.25 * segment.end.longitude))
+        nearest, distance = streetmap.nearestSegment(offStreet)
+        self.assertEqual({nearest.start, nearest.end}, {segment.start, segment.end})
+        self.assertLess(distance, 0.01)
+
+        onMap = GeoCoord('34.0625329', '-118.4470263')
+        snapped = streetmap.snapGeoCoords([onMap, offStreet])
+        self.assertEqual(snapped[0], (onMap, 0.0))
+        self.assertEqual(snapped[1][0], segment.start)
+        self.assertAlmostEqual(snapped[1][1], distanceEarthMiles(offStreet, segment.start))
+        self.assertEqual(StreetMap().snapGeoCoords([onMap]), [None])
+
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        deliveries = [DeliveryRequest('pho', offStreet)]
+        commands = []
+        self.assertEqual(planner2.generateDeliveryPlan(depot, deliveries, commands), (DeliveryResult.BAD_COORD, -1))
+        snappingPlanner = DeliveryPlanner(streetmap, snapMiles = 0.001)
+        self.assertEqual(snappingPlanner.generateDeliveryPlan(depot, deliveries, commands), (DeliveryResult.BAD_COORD, -1))
+        snappingPlanner = DeliveryPlanner(streetmap, snapMiles = 0.1)
+        result, distance = snappingPlanner.generateDeliveryPlan(depot, deliveries, commands)
+        self.assertEqual(result, DeliveryResult.DELIVERY_SUCCESS)
+        self.assertEqual((deliveries[0].item, deliveries[0].location), ('pho', segment.start))
+        self.assertIn('Deliver pho', [command.description() for command in commands])
+
 class DeliveryPlannerTest(unittest.TestCase):
     def test_generateDeliveryPlan(self):
         depot = GeoCoord('5','6')
@@ -425,5 +1684,52 @@ class DeliveryPlannerTest(unittest.TestCase):
         printDeliveryCommands(commands)
         print('Total Distance: {0}'.format(totalDistance) )
 
+    def test_streamDeliveryPlan(self):
+        depot = GeoCoord('34.0625329', '-118.4470263')
+        locations = [GeoCoord('34.0712323', '-118.4505969'), GeoCoord('34.0547000', '-118.4794734'),
+                     GeoCoord('34.0420561', '-118.5011699')]
+        items = ['salmon', 'fillet mignon', 'pho']
+        deliveries = [DeliveryRequest(item, location) for item, location in zip(items, locations)]
+        commands = []
+        expected = planner2.generateDeliveryPlan(depot, deliveries, commands)
+
+        streamedDeliveries = [DeliveryRequest(item, location) for item, location in zip(items, locations)]
+        stream = planner2.streamDeliveryPlan(depot, streamedDeliveries)
+        self.assertEqual([delivery.item for delivery in streamedDeliveries],
+                         [delivery.item for delivery in deliveries])
+        first = next(stream)
+        self.assertIsNone(stream.result())
+        streamed = [first] + list(stream)
+        self.assertEqual((stream.result(), stream.totalDistance()), expected)
+        self.assertEqual([command.description() for command in streamed],
+                         [command.description() for command in commands])
+        self.assertEqual(list(stream), [])
+
+        # the commands of a route are the same however the route is handed over
+        route = []
+        router2.generatePointToPointRoute(depot, locations[0], route)
+        routeCommands = []
+        generateDeliveryCommand(route, routeCommands, [])
+        self.assertEqual([command.description() for command in iterDeliveryCommands(iter(route), [])],
+                         [command.description() for command in routeCommands])
+        self.assertEqual(list(iterDeliveryCommands([], [])), [])
+
+        stream = planner2.streamDeliveryPlan(depot, [DeliveryRequest('pho', GeoCoord('43', '43'))])
+        self.assertEqual(list(stream), [])
+        self.assertEqual((stream.result(), stream.totalDistance()), (DeliveryResult.BAD_COORD, -1))
+
+    def test_streamStopsAtMissingRoute(self):
+        with tempfile.TemporaryDirectory() as directory:
+            mapFile = os.path.join(directory, 'islands.txt')
+            with open(mapFile, 'w') as output:
+                output.write('Main Street\n2\n0 0 0 1\n0 1 0 2\nIsland Road\n1\n5 5 5 6\n')
+            islands = StreetMap()
+            islands.load(mapFile)
+            stream = DeliveryPlanner(islands).streamDeliveryPlan(GeoCoord('0', '0'),
+                [DeliveryRequest('pho', GeoCoord('0', '2')), DeliveryRequest('salmon', GeoCoord('5', '6'))])
+            for command in stream:
+                self.assertNotEqual(command.streetName(), 'Island Road')
+            self.assertEqual((stream.result(), stream.totalDistance()), (DeliveryResult.NO_ROUTE, -1))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file